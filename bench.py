@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from bot import BotStats, run_bots
+from recorder import LogReader
+from replay import replay
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = Path(__file__).resolve().parent
+PROCESS_ERRORS = (OSError, ValueError) + ((psutil.Error,) if psutil is not None else ())
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def read_process_usage(pid):
+    # Returns (cpu seconds, rss bytes) for a process; psutil when available, /proc otherwise.
+    if psutil is not None:
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        return times.user + times.system, process.memory_info().rss
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+                break
+    return cpu, rss
+
+def process_tree(pid):
+    # The server pid plus its descendants, so multi-worker servers are measured as a whole.
+    if psutil is not None:
+        return [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError):
+                continue
+    tree = [pid]
+    for current in tree:
+        tree.extend(child for child, parent in parents.items() if parent == current)
+    return tree
+
+def read_tree_usage(pid):
+    cpu = rss = 0
+    for member in process_tree(pid):
+        try:
+            member_cpu, member_rss = read_process_usage(member)
+        except PROCESS_ERRORS:
+            continue  # exited between listing and reading
+        cpu += member_cpu
+        rss += member_rss
+    return cpu, rss
+
+class ResourceSampler:
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss = []
+
+    async def run(self):
+        last_cpu, _ = read_tree_usage(self.pid)
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                cpu, rss = read_tree_usage(self.pid)
+            except PROCESS_ERRORS:
+                return
+            now = time.monotonic()
+            self.cpu_percent.append(100 * (cpu - last_cpu) / (now - last_time))
+            self.rss.append(rss)
+            last_cpu, last_time = cpu, now
+
+    def summary(self):
+        return {
+            "cpu_percent_avg": sum(self.cpu_percent) / len(self.cpu_percent) if self.cpu_percent else None,
+            "cpu_percent_max": max(self.cpu_percent, default=None),
+            "rss_mb_max": max(self.rss, default=0) / (1024 * 1024),
+        }
+
+def start_server(port, tick_rate, extra_env=None, workers=1):
+    env = dict(os.environ)
+    env["TICK_RATE"] = str(tick_rate)
+    env.update(extra_env or {})
+    command = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start listening in time")
+
+def bot_worker(url, count, duration, protocol, prefix, spawn_rate, world_width, world_height, seed, rooms, batch):
+    return asyncio.run(run_bots(url, count, duration, protocol, prefix, spawn_rate, world_width, world_height, seed, rooms,
+                                batch))
+
+def replay_worker(url, log, speed):
+    reader = LogReader(log)
+    try:
+        return asyncio.run(replay(url, reader, speed))
+    finally:
+        reader.close()
+
+def run_worker(worker, args, results):
+    # Every worker posts exactly one result, a failure included, so the collector never waits on it.
+    try:
+        stats = worker(*args)
+    except BaseException as e:
+        results.put({"failed": f"{type(e).__name__}: {e}"})
+        raise
+    results.put(stats.to_dict())
+
+async def collect_results(sampler, results, processes):
+    # Drain results while waiting: a worker cannot exit until its queued stats are read.
+    task = asyncio.create_task(sampler.run()) if sampler else None
+    collected = []
+    try:
+        while len(collected) < len(processes):
+            try:
+                result = results.get_nowait()
+            except queue.Empty:
+                # Killed outright, a worker cannot post its failure
+                if any(process.exitcode for process in processes) or all(process.exitcode is not None for process in processes):
+                    raise RuntimeError("A benchmark worker exited without reporting its stats")
+                await asyncio.sleep(0.2)
+                continue
+            if "failed" in result:
+                raise RuntimeError(f"A benchmark worker failed: {result['failed']}")
+            collected.append(result)
+    finally:
+        if task:
+            task.cancel()
+    return collected
+
+def run_benchmark(args):
+    server = None
+    if not args.url:
+        extra_env = {"BROKER_URL": args.broker} if args.server_workers > 1 else {}
+        if args.npcs:
+            extra_env["NPCS_PER_ROOM"] = str(args.npcs)
+        server = start_server(args.port, args.tick_rate, extra_env, args.server_workers)
+        url = f"ws://127.0.0.1:{args.port}/ws"
+    else:
+        url = args.url
+    server_pid = server.pid if server else args.server_pid
+    sampler = ResourceSampler(server_pid) if server_pid else None
+    results = multiprocessing.Queue()
+    per_worker = [args.bots // args.workers + (1 if i < args.bots % args.workers else 0) for i in range(args.workers)]
+    processes = []
+    started = time.time()
+    if args.replay:
+        # A recorded session stands in for the bots
+        per_worker = []
+        process = multiprocessing.Process(target=run_worker, args=(replay_worker, (url, args.replay, args.replay_speed), results))
+        process.start()
+        processes.append(process)
+    for i, count in enumerate(per_worker):
+        if not count:
+            continue
+        process = multiprocessing.Process(target=run_worker, args=(bot_worker, (
+            url, count, args.duration, args.protocol, f"w{i}bot", args.spawn_rate / args.workers,
+            args.world_width, args.world_height, i * 100000, args.rooms, args.batch_bots,
+        ), results))
+        process.start()
+        processes.append(process)
+    try:
+        total = BotStats()
+        for stats in asyncio.run(collect_results(sampler, results, processes)):
+            total.merge(BotStats.from_dict(stats))
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+    elapsed = time.time() - started
+    latencies = sorted(total.latencies)
+    report = {
+        "timestamp": started,
+        "git_commit": git_commit(),
+        "params": {
+            "bots": args.bots,
+            "duration": args.duration,
+            "protocol": args.protocol,
+            "tick_rate": args.tick_rate,
+            "workers": args.workers,
+            "server_workers": args.server_workers,
+            "rooms": args.rooms,
+            "npcs_per_room": args.npcs,
+            "batch_bots": args.batch_bots,
+            "replay": args.replay,
+            "replay_speed": args.replay_speed if args.replay else None,
+            "world": [args.world_width, args.world_height],
+        },
+        "elapsed": elapsed,
+        # Directions are from the server's point of view: "in" is what bots sent.
+        "messages_in_per_sec": total.messages_out / elapsed,
+        "messages_out_per_sec": total.messages_in / elapsed,
+        "bytes_in_per_sec": total.bytes_out / elapsed,
+        "bytes_out_per_sec": total.bytes_in / elapsed,
+        "latency_ms": {
+            name: (value * 1000 if value is not None else None)
+            for name, value in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p90", percentile(latencies, 0.9)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+        "server": sampler.summary() if sampler else None,
+        "errors": total.errors,
+    }
+    return report
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the game server with headless bots.")
+    parser.add_argument("--bots", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run after all bots joined")
+    parser.add_argument("--protocol", choices=["json", "binary"], default="json")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="bot processes")
+    parser.add_argument("--spawn-rate", type=float, default=100, help="bots joining per second")
+    parser.add_argument("--tick-rate", type=int, default=20)
+    parser.add_argument("--world-width", type=int, default=1000)
+    parser.add_argument("--world-height", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=0, help="spread bots over this many named rooms")
+    parser.add_argument("--npcs", type=int, default=0, help="server-simulated NPCs in every room")
+    parser.add_argument("--batch-bots", action="store_true", help="simulate each bot process's bots in one vectorized batch")
+    parser.add_argument("--replay", help="drive the server with a session recording instead of bots")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="replay pace multiplier, 0 for no pacing")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes sharing one world")
+    parser.add_argument("--broker", default="local", help="BROKER_URL for the server workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid to sample CPU/RSS from when using --url")
+    parser.add_argument("--output", default="bench_results.jsonl", help="results are appended as one JSON line")
+    args = parser.parse_args()
+
+    try:
+        report = run_benchmark(args)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    with open(args.output, "a") as f:
+        f.write(json.dumps(report) + "\n")
+    latency = report["latency_ms"]
+    server = report["server"] or {}
+    load = f"replay of {args.replay}" if args.replay else f"{args.bots} bots"
+    print(f"{load}, {report['elapsed']:.1f}s: "
+          f"in {report['messages_in_per_sec']:.0f} msg/s {report['bytes_in_per_sec'] / 1024:.0f} KiB/s, "
+          f"out {report['messages_out_per_sec']:.0f} msg/s {report['bytes_out_per_sec'] / 1024:.0f} KiB/s")
+    if latency["p50"] is not None:
+        print(f"broadcast latency p50 {latency['p50']:.1f}ms p90 {latency['p90']:.1f}ms "
+              f"p99 {latency['p99']:.1f}ms max {latency['max']:.1f}ms")
+    if server:
+        print(f"server cpu avg {server['cpu_percent_avg'] or 0:.0f}% max {server['cpu_percent_max'] or 0:.0f}%, "
+              f"rss max {server['rss_mb_max']:.1f} MiB")
+    print(f"Results appended to {args.output}")
+
+if __name__ == "__main__":
+    main()
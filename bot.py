@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import random
+import time
+
+import websockets
+
+from protocol import BINARY_CODEC, SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON, decode_message, encode_message, peek_server_time
+
+from simulation import (ATTACK_CHANCE, ATTACK_COOLDOWN, ATTACK_DURATION, AFTERIMAGES, COMBO_WINDOW, DIRECTION_STEPS,
+                        DODGE_CHANCE, DODGE_COOLDOWN, DODGE_DURATION, DODGE_SPEED, FRAME_COUNT, FRAME_DURATION,
+                        HOLD_CHOICES, HOLD_TIME, PLAYER_SIZE, PLAYER_SPEED, SIM_RATE, EntityBatch)
+
+WORLD_WIDTH = 1000
+WORLD_HEIGHT = 1000
+FRAME_RATE = SIM_RATE
+MAX_SEND_RATE = 30
+HEARTBEAT_INTERVAL = 2.0
+
+class BotStats:
+    def __init__(self):
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = []  # seconds from snapshot creation on the server to receipt
+        self.errors = 0
+
+    def merge(self, other):
+        self.messages_in += other.messages_in
+        self.messages_out += other.messages_out
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+
+    def to_dict(self):
+        return {
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latencies": self.latencies,
+            "errors": self.errors,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for key, value in data.items():
+            setattr(stats, key, value)
+        return stats
+
+class Bot:
+    # Headless player that speaks the same join/update/action/ping protocol as MultiplayerClient.
+    def __init__(self, url, nickname, protocol="json", world_width=WORLD_WIDTH, world_height=WORLD_HEIGHT, seed=None,
+                 room=None):
+        self.url = url
+        self.nickname = nickname
+        self.room = room
+        self.protocol = protocol
+        self.world_width = world_width
+        self.world_height = world_height
+        self.random = random.Random(seed)
+        self.x = self.random.uniform(0, world_width - PLAYER_SIZE)
+        self.y = self.random.uniform(0, world_height - PLAYER_SIZE)
+        self.state = "idle"
+        self.direction = "down"
+        self.current_frame = 0
+        self.current_time = 0
+        self.attack_timer = 0
+        self.dodge_timer = 0
+        self.dodge_cooldown_timer = 0
+        self.cooldown_timer = 0
+        self.queued_attack = False
+        self.last_attack_press = -COMBO_WINDOW
+        self.clock = 0
+        self.afterimages = []
+        self.held_direction = None
+        self.hold_timer = 0
+        self.snapshot_seq = None
+        self.binary = False
+        self.names = {}
+        self.last_sent_key = None
+        self.last_sent_time = 0
+        self.stats = BotStats()
+        self.swarm = None  # BotSwarm that simulates this bot, if any
+        self.index = None  # this bot's entity in the swarm
+
+    def player_state(self):
+        return {
+            "x": self.x,
+            "y": self.y,
+            "state": self.state,
+            "direction": self.direction,
+            "current_frame": self.current_frame,
+            "current_time": self.current_time,
+            "is_invulnerable": self.state == "dodge",
+            "afterimages": [list(a) for a in self.afterimages],
+        }
+
+    def state_key(self):
+        # Same change detection as MultiplayerClient._state_key
+        return (self.x, self.y, self.state, self.direction, self.current_frame, len(self.afterimages))
+
+    async def send(self, ws, data):
+        payload = BINARY_CODEC.encode_client(data) if self.binary else encode_message(data)
+        await ws.send(payload)
+        self.stats.messages_out += 1
+        self.stats.bytes_out += len(payload)
+
+    def choose_input(self, dt):
+        # Hold an arrow key for a while, sometimes let go, sometimes press space or shift.
+        self.hold_timer -= dt
+        if self.hold_timer <= 0:
+            self.held_direction = self.random.choice(HOLD_CHOICES)
+            self.hold_timer = self.random.uniform(*HOLD_TIME)
+        roll = self.random.random()
+        attack = roll < ATTACK_CHANCE
+        dodge = not attack and roll < ATTACK_CHANCE + DODGE_CHANCE
+        return self.held_direction, attack, dodge
+
+    def step(self, dt):
+        return self.apply_input(dt, *self.choose_input(dt))
+
+    def apply_input(self, dt, held, attack, dodge):
+        # Same rules as the movement block of game_loop and PlayerAnimation; simulation.EntityBatch
+        # vectorizes this, so keep the three in step (tests/test_simulation.py checks them).
+        actions = []
+        attacking = self.state in ("attack1", "attack2")
+        moving = held is not None and not attacking
+        direction = held if moving else self.direction
+        speed = DODGE_SPEED if self.state == "dodge" else PLAYER_SPEED
+        if moving:
+            step_x, step_y = DIRECTION_STEPS[held]
+            self.x += step_x * speed
+            self.y += step_y * speed
+        if attack:
+            if not attacking and self.state != "dodge" and self.cooldown_timer <= 0:
+                self.state = "attack1"
+                self.attack_timer = ATTACK_DURATION
+                self.last_attack_press = self.clock
+                actions.append("attack")
+            elif self.state == "attack1" and not self.queued_attack and self.clock - self.last_attack_press < COMBO_WINDOW:
+                self.queued_attack = True
+                actions.append("attack")
+        elif dodge and moving and self.dodge_cooldown_timer <= 0:
+            self.state = "dodge"
+            self.dodge_timer = DODGE_DURATION
+            self.dodge_cooldown_timer = DODGE_COOLDOWN
+            for alpha, lifetime in AFTERIMAGES:
+                self.afterimages.append([self.x, self.y, alpha, lifetime])
+            # game_loop takes one more step into the dodge, at the speed picked before it started
+            self.x += step_x * speed
+            self.y += step_y * speed
+            actions.append("dodge")
+        self.x = max(0, min(self.world_width - PLAYER_SIZE, self.x))
+        self.y = max(0, min(self.world_height - PLAYER_SIZE, self.y))
+        if self.state not in ("attack1", "attack2", "dodge"):
+            self.state = "run" if moving else "idle"
+        self.direction = direction
+        self.advance_timers(dt)
+        return actions
+
+    def advance_timers(self, dt):
+        self.afterimages = [[x, y, alpha, t - dt] for x, y, alpha, t in self.afterimages if t > 0]
+        if self.dodge_cooldown_timer > 0:
+            self.dodge_cooldown_timer -= dt
+        if self.cooldown_timer > 0:
+            self.cooldown_timer -= dt
+        if self.state == "dodge":
+            self.dodge_timer -= dt
+            if self.dodge_timer <= 0:
+                self.state = "idle"
+                self.queued_attack = False
+        elif self.state in ("attack1", "attack2"):
+            self.attack_timer -= dt
+            if self.attack_timer <= 0:
+                if self.state == "attack1" and self.queued_attack:
+                    self.state = "attack2"
+                    self.attack_timer = ATTACK_DURATION
+                else:
+                    # In this order, as in PlayerAnimation.update: attack2 never gets its cooldown
+                    self.state = "idle"
+                    self.cooldown_timer = ATTACK_COOLDOWN if self.state == "attack2" else 0
+                self.queued_attack = False
+        self.current_time += dt
+        while self.current_time >= FRAME_DURATION:
+            self.current_time -= FRAME_DURATION
+            self.current_frame = (self.current_frame + 1) % FRAME_COUNT
+        self.clock += dt
+
+    async def receive_loop(self, ws):
+        async for raw in ws:
+            received = time.time()
+            self.stats.messages_in += 1
+            self.stats.bytes_in += len(raw) if isinstance(raw, bytes) else len(raw.encode())
+            server_time = peek_server_time(raw)
+            if server_time is not None:
+                self.stats.latencies.append(received - server_time)
+            try:
+                data = BINARY_CODEC.decode_server(raw, self.names) if isinstance(raw, bytes) else decode_message(raw)
+            except Exception:
+                self.stats.errors += 1
+                continue
+            if data.get("type") == "ping":
+                await self.send(ws, {"type": "pong", "id": data["id"]})
+            elif data.get("type") == "players_update":
+                self.snapshot_seq = data.get("seq")
+            elif data.get("type") == "players_delta":
+                if data.get("base") == self.snapshot_seq:
+                    self.snapshot_seq = data.get("seq")
+                else:
+                    await self.send(ws, {"type": "resync"})
+
+    async def run(self, deadline):
+        subprotocols = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON] if self.protocol == "binary" else [SUBPROTOCOL_JSON]
+        try:
+            async with websockets.connect(self.url, subprotocols=subprotocols, max_size=None) as ws:
+                self.binary = ws.subprotocol == SUBPROTOCOL_BINARY
+                join = {"type": "join", "nickname": self.nickname, **self.player_state()}
+                if self.room:
+                    join["room"] = self.room
+                await self.send(ws, join)
+                receiver = asyncio.create_task(self.receive_loop(ws))
+                loop = asyncio.get_running_loop()
+                last = next_frame = loop.time()
+                while loop.time() < deadline:
+                    now = loop.time()
+                    actions = self.swarm.take(self) if self.swarm else self.step(now - last)
+                    last = now
+                    key = self.state_key()
+                    elapsed = now - self.last_sent_time
+                    if actions or (key != self.last_sent_key and elapsed >= 1 / MAX_SEND_RATE) or elapsed >= HEARTBEAT_INTERVAL:
+                        for action in actions:
+                            await self.send(ws, {"type": "action", "action": action, **self.player_state()})
+                        if not actions:
+                            await self.send(ws, {"type": "update", **self.player_state()})
+                        self.last_sent_key = key
+                        self.last_sent_time = now
+                    next_frame += 1 / FRAME_RATE
+                    await asyncio.sleep(max(0, next_frame - loop.time()))
+                receiver.cancel()
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"Bot {self.nickname} failed: {e}")
+        return self.stats
+
+class BotSwarm:
+    # Simulates every bot of a run in one EntityBatch step per frame instead of a Bot.step each;
+    # the bots' run loops then only copy their entity out and talk to the server.
+    def __init__(self, bots, world_width=WORLD_WIDTH, world_height=WORLD_HEIGHT, seed=0):
+        self.batch = EntityBatch(len(bots), world_width, world_height, seed=seed)
+        self.actions = [[] for _ in bots]  # per bot, actions since its last take()
+        for i, bot in enumerate(bots):
+            bot.swarm = self
+            bot.index = i
+            self.batch.x[i] = bot.x
+            self.batch.y[i] = bot.y
+
+    async def run(self, deadline):
+        loop = asyncio.get_running_loop()
+        last = next_frame = loop.time()
+        while loop.time() < deadline:
+            now = loop.time()
+            dt = now - last
+            last = now
+            attacked, dodged = self.batch.step(dt, *self.batch.choose_inputs(dt))
+            for i in attacked.nonzero()[0].tolist():
+                self.actions[i].append("attack")
+            for i in dodged.nonzero()[0].tolist():
+                self.actions[i].append("dodge")
+            next_frame += 1 / FRAME_RATE
+            await asyncio.sleep(max(0, next_frame - loop.time()))
+
+    def take(self, bot):
+        for key, value in self.batch.record(bot.index).items():
+            if key != "is_invulnerable":
+                setattr(bot, key, value)
+        actions, self.actions[bot.index] = self.actions[bot.index], []
+        return actions
+
+async def run_bots(url, count, duration, protocol="json", prefix="bot", spawn_rate=50, world_width=WORLD_WIDTH,
+                   world_height=WORLD_HEIGHT, seed=0, rooms=0, batch=False):
+    # Ramps up `count` bots at `spawn_rate` per second, keeps them all running for `duration`
+    # seconds after the last one joined, and returns their merged stats. With `rooms`, bots are
+    # dealt round-robin into that many named rooms instead of the server's default. With `batch`,
+    # one BotSwarm simulates them all so thousands of bots fit in one process.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + count / spawn_rate + duration
+    bots = [
+        Bot(url, f"{prefix}{i}", protocol, world_width, world_height, seed=seed + i,
+            room=f"room{(seed + i) % rooms}" if rooms else None)
+        for i in range(count)
+    ]
+    swarm = asyncio.create_task(BotSwarm(bots, world_width, world_height, seed).run(deadline)) if batch else None
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.create_task(bot.run(deadline)))
+        await asyncio.sleep(1 / spawn_rate)
+    total = BotStats()
+    for stats in await asyncio.gather(*tasks):
+        total.merge(stats)
+    if swarm:
+        await swarm
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless players against the game server.")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--bots", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--protocol", choices=["json", "binary"], default="json")
+    parser.add_argument("--prefix", default="bot")
+    parser.add_argument("--rooms", type=int, default=0, help="spread bots over this many named rooms")
+    parser.add_argument("--batch", action="store_true", help="simulate all bots in one vectorized batch (needs numpy)")
+    args = parser.parse_args()
+    stats = asyncio.run(run_bots(args.url, args.bots, args.duration, args.protocol, args.prefix, rooms=args.rooms,
+                                 batch=args.batch))
+    print(f"sent {stats.messages_out} messages ({stats.bytes_out} bytes), "
+          f"received {stats.messages_in} messages ({stats.bytes_in} bytes), errors {stats.errors}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import fcntl
+import os
+import struct
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+DEFAULT_SOCKET_PATH = "/tmp/pyscript-game-broker.sock"
+DEFAULT_CHANNEL = "pyscript-game:world"
+RECONNECT_DELAY = 0.5  # first retry; doubles up to MAX_RECONNECT_DELAY while the broker stays down
+MAX_RECONNECT_DELAY = 10.0
+LOCK_POLL_INTERVAL = 0.05
+MAX_PEER_BUFFER = 4 * 1024 * 1024  # bytes the hub queues for one worker before dropping it
+FRAME_LENGTH = struct.Struct("<I")
+
+class Broker:
+    # Fan-out pub/sub between server workers: every published payload reaches the other workers.
+    # on_message(payload) is called for each incoming payload; on_connect() after every
+    # (re)connection so the caller can announce itself and re-share its state.
+    async def start(self, on_message, on_connect):
+        raise NotImplementedError
+
+    async def publish(self, payload):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class LocalBroker(Broker):
+    # Workers on one host talk through a Unix socket. The first worker to start hosts the
+    # hub that relays frames between all of them; if it goes away the rest elect a new host.
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self.hub = None  # asyncio server while this process hosts the hub
+        self.peers = set()  # hub side: writers of connected workers
+        self.writer = None
+        self.read_task = None
+        self.on_message = None
+        self.on_connect = None
+
+    async def start(self, on_message, on_connect):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        reader = await self._connect()
+        self.read_task = asyncio.create_task(self._read_loop(reader))
+        await on_connect()
+
+    async def _connect(self):
+        # The lock keeps two workers from both deciding to host when the socket is missing or stale.
+        with open(self.path + ".lock", "w") as lock:
+            # Polled so a worker waiting on the lock does not block its event loop
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self.hub = await asyncio.start_unix_server(self._serve_peer, self.path)
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                print(f"Hosting local broker hub at {self.path}")
+        return reader
+
+    async def _serve_peer(self, reader, writer):
+        self.peers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_LENGTH.size)
+                frame = header + await reader.readexactly(FRAME_LENGTH.unpack(header)[0])
+                for peer in list(self.peers):
+                    if peer is writer:
+                        continue
+                    peer.write(frame)
+                    # Not awaited, so one slow worker cannot stall the rest. One this far behind is
+                    # dropped instead; it reconnects and re-announces its rooms.
+                    if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                        print("Dropping a broker peer that is not keeping up.")
+                        self.peers.discard(peer)
+                        peer.close()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.peers.discard(writer)
+            writer.close()
+
+    async def _read_loop(self, reader):
+        while True:
+            try:
+                header = await reader.readexactly(FRAME_LENGTH.size)
+                payload = await reader.readexactly(FRAME_LENGTH.unpack(header)[0])
+            except (asyncio.IncompleteReadError, ConnectionError):
+                print("Lost the local broker hub, reconnecting.")
+                self.writer = None
+                delay = RECONNECT_DELAY
+                while self.writer is None:
+                    await asyncio.sleep(delay)
+                    try:
+                        reader = await self._connect()
+                    except OSError as e:
+                        print(f"Broker reconnect failed: {e}")
+                        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                await self.on_connect()
+                continue
+            try:
+                self.on_message(payload)
+            except Exception as e:
+                print(f"Error handling broker message: {e}")
+
+    async def publish(self, payload):
+        if self.writer is None:
+            return
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.writer.write(FRAME_LENGTH.pack(len(payload)) + payload)
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass  # the read loop notices the lost hub and reconnects
+
+    async def close(self):
+        if self.read_task:
+            self.read_task.cancel()
+        if self.writer:
+            self.writer.close()
+        if self.hub:
+            self.hub.close()
+            for peer in list(self.peers):
+                peer.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+class RedisBroker(Broker):
+    # Any Redis-compatible server (Redis, Valkey, KeyDB); workers may run on different hosts.
+    def __init__(self, url, channel=DEFAULT_CHANNEL):
+        if aioredis is None:
+            raise RuntimeError("RedisBroker needs the redis package: pip install redis")
+        self.url = url
+        self.channel = channel
+        self.client = None
+        self.pubsub = None
+        self.read_task = None
+        self.on_message = None
+        self.on_connect = None
+
+    async def start(self, on_message, on_connect):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.client = aioredis.from_url(self.url)
+        await self._subscribe()
+        self.read_task = asyncio.create_task(self._read_loop())
+        await on_connect()
+
+    async def _subscribe(self):
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.channel)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        self.on_message(message["data"])
+                    except Exception as e:
+                        print(f"Error handling broker message: {e}")
+            except Exception as e:
+                # redis raises its own ConnectionError/TimeoutError, not the builtin ones
+                print(f"Lost the Redis broker ({e}), reconnecting.")
+            else:
+                print("Redis subscription ended, reconnecting.")
+            await self._reconnect()
+
+    async def _reconnect(self):
+        try:
+            await self.pubsub.close()
+        except Exception:
+            pass
+        delay = RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._subscribe()
+                await self.on_connect()
+                return
+            except Exception as e:
+                print(f"Broker reconnect failed: {e}")
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def publish(self, payload):
+        await self.client.publish(self.channel, payload)
+
+    async def close(self):
+        if self.read_task:
+            self.read_task.cancel()
+        if self.pubsub:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.close()
+        if self.client:
+            await self.client.close()
+
+def make_broker(url):
+    # "" runs a single standalone process; "local" or "unix:///path" a Unix socket hub;
+    # "redis://host:port/db" (or rediss://) a Redis pub/sub channel.
+    if not url:
+        return None
+    if url == "local":
+        return LocalBroker()
+    if url.startswith("unix://"):
+        return LocalBroker(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
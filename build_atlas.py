@@ -0,0 +1,69 @@
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+import pygame
+
+ROOT = Path(__file__).resolve().parent
+SPRITES = ROOT / "frontend" / "static" / "assets" / "sprites"
+MAX_ATLAS_WIDTH = 2048
+PADDING = 1  # transparent gap between strips so filtering never bleeds a neighbour in
+
+def collect_strips(sources, sprite_dir):
+    # Yields (character, state, direction, surface, frame count) for every strip the sources name.
+    for character, source in sources.items():
+        base = sprite_dir / source.get("dir", character)
+        for state, frame_count in source["frames"].items():
+            for direction in source["directions"]:
+                path = base / source["pattern"].format(state=state, direction=direction)
+                if not path.exists():
+                    print(f"Missing strip {path}, skipping")
+                    continue
+                yield character, state, direction, pygame.image.load(str(path)), frame_count
+
+def pack(strips, max_width=MAX_ATLAS_WIDTH):
+    # Shelf packing: tallest strips first, left to right, a new shelf when the row is full.
+    placed = []
+    x = y = shelf_height = width = 0
+    for strip in sorted(strips, key=lambda s: -s[3].get_height()):
+        w, h = strip[3].get_size()
+        if x and x + w > max_width:
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+        placed.append((strip, x, y))
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+        width = max(width, x - PADDING)
+    return placed, width, y + shelf_height
+
+def build(sources_path, out_dir, name="atlas"):
+    sources = json.loads(sources_path.read_text())
+    placed, width, height = pack(list(collect_strips(sources, sources_path.parent)))
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    manifest = {"image": f"{name}.png", "size": [width, height], "characters": {}}
+    for (character, state, direction, sheet, frame_count), x, y in placed:
+        atlas.blit(sheet, (x, y))
+        frame_width = sheet.get_width() // frame_count
+        frame_height = sheet.get_height()
+        entry = manifest["characters"].setdefault(character, {"frame_size": [frame_width, frame_height], "animations": {}})
+        entry["animations"].setdefault(state, {})[direction] = [
+            [x + i * frame_width, y, frame_width, frame_height] for i in range(frame_count)
+        ]
+    pygame.image.save(atlas, str(out_dir / f"{name}.png"))
+    # Lets the client look up its decoded-pixel cache before downloading the image
+    manifest["hash"] = hashlib.sha256((out_dir / f"{name}.png").read_bytes()).hexdigest()
+    (out_dir / f"{name}.json").write_text(json.dumps(manifest, separators=(",", ":"), sort_keys=True) + "\n")
+    print(f"Packed {len(placed)} strips into {name}.png ({width}x{height})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack sprite strips into one atlas image and a JSON manifest.")
+    parser.add_argument("--sources", default=str(SPRITES / "atlas_sources.json"))
+    parser.add_argument("--out-dir", default=str(SPRITES))
+    parser.add_argument("--name", default="atlas")
+    args = parser.parse_args()
+    build(Path(args.sources), Path(args.out_dir), args.name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import math
+
+from protocol import DIRECTIONS
+from simulation import DIRECTION_STEPS, PLAYER_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ATTACK_RANGE = 60  # pixels from the attacker's centre to the edge of its swing
+ATTACK_ARC = 120  # degrees, centred on the direction the attacker faces
+HALF_SIZE = PLAYER_SIZE / 2
+REACH = ATTACK_RANGE + HALF_SIZE  # furthest a target's centre can be and still be clipped
+MIN_COSINE = math.cos(math.radians(ATTACK_ARC / 2))
+FACING = [DIRECTION_STEPS[d] for d in DIRECTIONS]  # unit vector per direction code
+
+def candidate_pairs(attackers, columns, index):
+    # Broad phase: each attacker only looks at the spatial hash cells its swing can reach, so the
+    # cost follows the number of nearby players rather than attackers x players.
+    pairs = []
+    for attacker in attackers:
+        cx = columns["x"][attacker] + HALF_SIZE
+        cy = columns["y"][attacker] + HALF_SIZE
+        # The index holds top-left corners
+        for target in index.query(cx - REACH - HALF_SIZE, cy - REACH - HALF_SIZE, cx + REACH - HALF_SIZE, cy + REACH - HALF_SIZE):
+            if target != attacker:
+                pairs.append((attacker, target))
+    return pairs
+
+def resolve_attacks(attackers, store, index):
+    # Returns (attacker slot, target slot) for every swing that lands. attackers are store slots,
+    # one entry per attack; dodging (invulnerable) targets are never hit.
+    if not attackers:
+        return []
+    columns = store.columns
+    pairs = candidate_pairs(attackers, columns, index)
+    if not pairs:
+        return []
+    if np is not None:
+        a = np.fromiter((attacker for attacker, _ in pairs), dtype="int64", count=len(pairs))
+        t = np.fromiter((target for _, target in pairs), dtype="int64", count=len(pairs))
+        dx = columns["x"][t] - columns["x"][a]
+        dy = columns["y"][t] - columns["y"][a]
+        facing = np.array(FACING, dtype="float64")[columns["direction"][a]]
+        distance = np.hypot(dx, dy)
+        # Overlapping players always connect, whatever the facing
+        in_arc = (dx * facing[:, 0] + dy * facing[:, 1]) >= MIN_COSINE * distance
+        hit = (distance <= REACH) & (in_arc | (distance < HALF_SIZE)) & (columns["is_invulnerable"][t] == 0)
+        return [pairs[i] for i in np.nonzero(hit)[0].tolist()]
+    hits = []
+    for attacker, target in pairs:
+        if columns["is_invulnerable"][target]:
+            continue
+        dx = columns["x"][target] - columns["x"][attacker]
+        dy = columns["y"][target] - columns["y"][attacker]
+        face_x, face_y = FACING[columns["direction"][attacker]]
+        distance = math.hypot(dx, dy)
+        if distance <= REACH and (dx * face_x + dy * face_y >= MIN_COSINE * distance or distance < HALF_SIZE):
+            hits.append((attacker, target))
+    return hits
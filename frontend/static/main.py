@@ -1,12 +1,61 @@
 import pygame
 import asyncio
-from js import Image, document, window, WebSocket, JSON
-from pyodide.ffi import create_proxy
+from js import Blob, Image, Uint8Array, document, window, WebSocket
+from pyodide.ffi import create_proxy, to_js
 import json
+import struct
+import time
+from collections import OrderedDict
 from js import document as js_document
+from sprite_cache import CacheBackend, SpriteCache, content_hash
 
 # Debug flag to control console output
 DEBUG = False
+# Offer the compact binary protocol; the server falls back to JSON if it does not support it
+USE_BINARY_PROTOCOL = True
+# Position updates are only sent when something changed, at most this many times per second
+MAX_SEND_RATE = 30
+# An unchanged state is re-sent this often so the server keeps the connection fresh
+HEARTBEAT_INTERVAL = 2.0
+# Built by build_atlas.py: every character's sprite strips packed into one image
+ATLAS_MANIFEST = "/static/assets/sprites/atlas.json"
+BACKGROUND_IMAGE = "/static/assets/background/grass.png"
+# Browsers open about six connections per host; more in flight only queues inside the browser
+MAX_CONCURRENT_LOADS = 6
+# Decoded sprite pixels are kept in IndexedDB so later visits skip download and decode
+USE_SPRITE_CACHE = True
+SPRITE_CACHE_DB = "pyscript-game-sprites"
+SPRITE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Tinted frames kept for reuse; a 96x80 variant is 30 KB, so this caps the cache near 15 MB
+SPRITE_VARIANT_CACHE_SIZE = 512
+DODGE_ALPHA = 128  # players are drawn half transparent while dodging
+NAMEPLATE_COLOR = (255, 255, 255)
+NAMEPLATE_OUTLINE = (0, 0, 0)  # None for plain text
+# Only redraw screen regions whose sprites changed; pays off when the camera is still
+DIRTY_RECT_RENDERING = False
+RENDER_REPORT_INTERVAL = 300  # frames between draw budget reports when DEBUG is on
+BACKGROUND_COLOR = (128, 128, 128)
+# The ground is rendered in square chunks around the camera and kept in an LRU cache, so memory
+# stays flat however large the map is (a 256px chunk is 256 KB)
+CHUNK_SIZE = 256
+TILE_SIZE = 128
+CHUNK_CACHE_BYTES = 16 * 1024 * 1024
+# Remote players are drawn two snapshot intervals in the past so there are usually two
+# snapshots to blend between. The server sends fewer snapshots on slow links, so the interval is
+# measured; this is the floor, two server ticks at 20 Hz
+INTERPOLATION_DELAY = 0.1
+# Longer gaps between snapshots mean nothing moved, not a slower send rate
+MAX_SNAPSHOT_GAP = 0.5
+# When snapshots run late, keep moving remote players along their last velocity for at most this long
+MAX_EXTRAPOLATION = 0.1
+# The local simulation advances in fixed steps, so movement is the same at any frame rate;
+# player_speed and dodge_speed are pixels per step
+SIM_RATE = 60
+SIM_DT = 1 / SIM_RATE
+# After a long stall (GC pause, background tab) drop the backlog instead of fast-forwarding through it
+MAX_SIM_STEPS = 5
+# requestAnimationFrame pauses in hidden tabs; wake up this often anyway so heartbeats keep flowing
+HIDDEN_FRAME_INTERVAL = 0.5
 
 def debug_print(*args, **kwargs):
     if DEBUG:
@@ -35,7 +84,6 @@ debug_print("Pygame display initialized")
 
 world_width = 1000
 world_height = 1000
-world = pygame.Surface((world_width, world_height))
 
 player_rect = pygame.Rect(100, 100, 40, 40)
 player_speed = 3
@@ -46,23 +94,78 @@ attack_duration = 0.5
 attack_cooldown = 0.3
 
 nickname = window.prompt("Enter your nickname:") or "player"
+# ?room=name joins a named room; without it the server picks one
+room = window.URLSearchParams.new(window.location.search).get("room")
 debug_print(f"Nickname: {nickname}")
 
-clock = pygame.time.Clock()
 running = True
 big_bg = None
 
-def redraw_world_background():
-    global big_bg
-    if not big_bg:
-        debug_print("Warning: big_bg is None, filling with gray")
-        world.fill((128, 128, 128))
-        return
-    tile = pygame.transform.smoothscale(big_bg, (128, 128))
-    for x in range(0, world_width, tile.get_width()):
-        for y in range(0, world_height, tile.get_height()):
-            world.blit(tile, (x, y))
-    debug_print("World background redrawn")
+class ChunkedWorld:
+    # Tiled ground split into CHUNK_SIZE squares that are painted the first time the camera
+    # needs them; the least recently drawn are evicted once the cache passes max_bytes.
+    def __init__(self, width, height, chunk_size=CHUNK_SIZE, tile_size=TILE_SIZE, max_bytes=CHUNK_CACHE_BYTES):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.max_chunks = max(1, max_bytes // (chunk_size * chunk_size * 4))
+        self.tile = None  # scaled once, when the ground image arrives
+        self.chunks = OrderedDict()  # (chunk x, chunk y) -> Surface
+        self.generated = 0
+        self.evicted = 0
+
+    def set_tile(self, image):
+        self.tile = pygame.transform.smoothscale(image, (self.tile_size, self.tile_size)) if image else None
+        self.chunks.clear()
+
+    def _render_chunk(self, cx, cy):
+        size = self.chunk_size
+        left, top = cx * size, cy * size
+        chunk = pygame.Surface((size, size))
+        chunk.fill(BACKGROUND_COLOR)
+        if self.tile:
+            tile = self.tile_size
+            # Tiles are aligned to the world origin, so chunk seams are invisible
+            right, bottom = min(left + size, self.width), min(top + size, self.height)
+            for x in range(left - left % tile, right, tile):
+                for y in range(top - top % tile, bottom, tile):
+                    chunk.blit(self.tile, (x - left, y - top), area=(0, 0, right - x, bottom - y))
+        self.generated += 1
+        return chunk
+
+    def chunk(self, cx, cy):
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = self._render_chunk(cx, cy)
+            while len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.chunks.move_to_end(key)
+        return chunk
+
+    def draw(self, target, region, origin):
+        # Paints the screen-space region of target, whose top-left shows world point origin
+        size = self.chunk_size
+        area = region.move(origin)
+        inside = area.clip(pygame.Rect(0, 0, self.width, self.height))
+        if inside != area:
+            target.fill(BACKGROUND_COLOR, region)  # the view reaches past the map edge
+        blits = []
+        for cx in range(inside.left // size, (inside.right - 1) // size + 1 if inside.width else 0):
+            for cy in range(inside.top // size, (inside.bottom - 1) // size + 1 if inside.height else 0):
+                chunk_rect = pygame.Rect(cx * size, cy * size, size, size).clip(area)
+                if chunk_rect.width and chunk_rect.height:
+                    blits.append((
+                        self.chunk(cx, cy),
+                        (chunk_rect.x - origin[0], chunk_rect.y - origin[1]),
+                        chunk_rect.move(-cx * size, -cy * size),
+                    ))
+        target.blits(blits, doreturn=False)
+
+world = ChunkedWorld(world_width, world_height)
 
 def on_resize(evt):
     global screen, viewport_width, viewport_height
@@ -72,70 +175,517 @@ def on_resize(evt):
     canvas.style.imageRendering = "pixelated"
     screen = pygame.display.set_mode((viewport_width, viewport_height))
     debug_print("Resized canvas to:", viewport_width, viewport_height)
-    redraw_world_background()
 
 window.addEventListener("resize", create_proxy(on_resize))
 
-async def load_image(url):
+async def decode_image(src):
+    # Lets the browser decode src (a URL or object URL); returns ((width, height), RGBA bytes)
+    img = Image.new()
+    loaded = asyncio.get_event_loop().create_future()
+
+    def on_load(event):
+        if not loaded.done():
+            loaded.set_result(True)
+
+    def on_error(event):
+        if not loaded.done():
+            loaded.set_exception(ValueError(f"Failed to load image: {src}"))
+
+    on_load_proxy = create_proxy(on_load)
+    on_error_proxy = create_proxy(on_error)
+    img.addEventListener("load", on_load_proxy)
+    img.addEventListener("error", on_error_proxy)
+    img.src = src
+    try:
+        await loaded
+    finally:
+        img.removeEventListener("load", on_load_proxy)
+        img.removeEventListener("error", on_error_proxy)
+        on_load_proxy.destroy()
+        on_error_proxy.destroy()
+    if img.width == 0 or img.height == 0:
+        raise ValueError(f"Failed to load image: {src}")
+    canvas = document.createElement("canvas")
+    canvas.width = img.width
+    canvas.height = img.height
+    ctx = canvas.getContext("2d")
+    ctx.drawImage(img, 0, 0)
+    img_data = ctx.getImageData(0, 0, img.width, img.height)
+    return (img.width, img.height), img_data.data.to_bytes()
+
+async def load_cached_pixels(url, known_hash, cache):
+    # A hash from a manifest lets a hit skip the download as well as the decode
+    if known_hash:
+        hit = await cache.get(known_hash)
+        if hit:
+            return hit
+    response = await window.fetch(url)
+    if not response.ok:
+        raise ValueError(f"HTTP {response.status} for {url}")
+    buffer = await response.arrayBuffer()
+    key = known_hash or content_hash(buffer.to_bytes())
+    if not known_hash:
+        hit = await cache.get(key)
+        if hit:
+            return hit
+    object_url = window.URL.createObjectURL(Blob.new(to_js([buffer])))
+    try:
+        size, pixels = await decode_image(object_url)
+    finally:
+        window.URL.revokeObjectURL(object_url)
+    try:
+        await cache.put(key, size, pixels)
+    except Exception as e:
+        debug_print(f"Could not cache {url}: {e}")
+    return size, pixels
+
+async def load_image(url, known_hash=None, cache=None):
     try:
         debug_print(f"Loading image: {url}")
-        img = Image.new()
-        img.src = url
-        while not img.complete:
-            await asyncio.sleep(0.05)
-        if img.width == 0 or img.height == 0:
-            raise ValueError(f"Failed to load image: {url}")
-        canvas = document.createElement("canvas")
-        canvas.width = img.width
-        canvas.height = img.height
-        ctx = canvas.getContext("2d")
-        ctx.drawImage(img, 0, 0)
-        img_data = ctx.getImageData(0, 0, img.width, img.height)
-        pixels = bytes(img_data.data.to_py())
-        surface = pygame.image.frombuffer(pixels, (img.width, img.height), "RGBA")
+        if cache is None:
+            size, pixels = await decode_image(url)
+        else:
+            size, pixels = await load_cached_pixels(url, known_hash, cache)
+        # frombuffer wraps the bytes without another copy
+        surface = pygame.image.frombuffer(pixels, size, "RGBA")
         debug_print(f"Successfully loaded image: {url}")
         return surface
     except Exception as e:
         debug_print(f"Error loading image {url}: {e}")
         return None
 
+async def idb_request(request):
+    # Resolves an IndexedDB request on its success/error event
+    done = asyncio.get_event_loop().create_future()
+
+    def on_success(event):
+        if not done.done():
+            done.set_result(request.result)
+
+    def on_error(event):
+        if not done.done():
+            done.set_exception(RuntimeError(f"IndexedDB request failed: {request.error}"))
+
+    proxies = [create_proxy(on_success), create_proxy(on_error)]
+    request.addEventListener("success", proxies[0])
+    request.addEventListener("error", proxies[1])
+    try:
+        return await done
+    finally:
+        request.removeEventListener("success", proxies[0])
+        request.removeEventListener("error", proxies[1])
+        for proxy in proxies:
+            proxy.destroy()
+
+class IndexedDBBackend(CacheBackend):
+    # Values are Uint8Arrays in a single object store
+    STORE = "blobs"
+
+    def __init__(self, name=SPRITE_CACHE_DB):
+        self.name = name
+        self.db = None
+
+    async def open(self):
+        request = window.indexedDB.open(self.name, 1)
+
+        def on_upgrade(event):
+            request.result.createObjectStore(self.STORE)
+
+        upgrade_proxy = create_proxy(on_upgrade)
+        request.addEventListener("upgradeneeded", upgrade_proxy)
+        try:
+            self.db = await idb_request(request)
+        finally:
+            request.removeEventListener("upgradeneeded", upgrade_proxy)
+            upgrade_proxy.destroy()
+        return self
+
+    def _store(self, mode):
+        return self.db.transaction(self.STORE, mode).objectStore(self.STORE)
+
+    async def read(self, key):
+        result = await idb_request(self._store("readonly").get(key))
+        return result.to_bytes() if result is not None else None
+
+    async def write(self, key, data):
+        array = Uint8Array.new(len(data))
+        array.assign(data)
+        await idb_request(self._store("readwrite").put(array, key))
+
+    async def delete(self, key):
+        await idb_request(self._store("readwrite").delete(key))
+
+async def open_sprite_cache():
+    if not USE_SPRITE_CACHE or not hasattr(window, "indexedDB"):
+        return None
+    try:
+        backend = await IndexedDBBackend().open()
+        cache = await SpriteCache(backend, SPRITE_CACHE_MAX_BYTES).open()
+        if hasattr(window.navigator, "storage"):
+            window.navigator.storage.persist()  # best effort: ask the browser not to evict us
+        return cache
+    except Exception as e:
+        debug_print(f"Sprite cache unavailable: {e}")
+        return None
+
+async def fetch_text(url):
+    response = await window.fetch(url)
+    if not response.ok:
+        raise ValueError(f"HTTP {response.status} for {url}")
+    return await response.text()
+
+class AssetLoader:
+    # Runs asset requests concurrently, a few at a time, and counts them for the loading screen.
+    def __init__(self, concurrency=MAX_CONCURRENT_LOADS, cache=None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.cache = cache
+        self.total = 0
+        self.done = 0
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 0
+
+    def image(self, url, known_hash=None):
+        self.total += 1
+        return self._run(load_image(url, known_hash, self.cache))
+
+    def text(self, url):
+        self.total += 1
+        return self._run(fetch_text(url))
+
+    async def _run(self, request):
+        try:
+            async with self.semaphore:
+                return await request
+        finally:
+            self.done += 1
+
 def slice_sprite_strip(sheet, num_frames):
     if not sheet:
         debug_print("Warning: sprite sheet is None")
         return [], 0, 0
     frame_width = sheet.get_width() // num_frames
     frame_height = sheet.get_height()
-    frames = []
-    for i in range(num_frames):
-        frame = pygame.Surface((frame_width, frame_height), pygame.SRCALPHA)
-        frame.blit(sheet, (0, 0), pygame.Rect(i * frame_width, 0, frame_width, frame_height))
-        frames.append(frame)
+    # Subsurfaces share the sheet's pixels instead of copying each frame
+    frames = [sheet.subsurface(pygame.Rect(i * frame_width, 0, frame_width, frame_height)) for i in range(num_frames)]
     return frames, frame_width, frame_height
 
-async def load_player_animations(base_path):
+async def load_atlas(manifest_url, loader):
+    # Returns character -> (animations, frame width, frame height), all frames views into one image.
+    try:
+        manifest = json.loads(await loader.text(manifest_url))
+        base = manifest_url.rsplit("/", 1)[0]
+        sheet = await loader.image(f"{base}/{manifest['image']}", manifest.get("hash"))
+        if not sheet:
+            raise ValueError("atlas image did not load")
+        characters = {}
+        for name, entry in manifest["characters"].items():
+            animations = {
+                state: {direction: [sheet.subsurface(pygame.Rect(rect)) for rect in rects] for direction, rects in directions.items()}
+                for state, directions in entry["animations"].items()
+            }
+            frame_width, frame_height = entry["frame_size"]
+            characters[name] = (animations, frame_width, frame_height)
+        debug_print(f"Loaded atlas with characters: {list(characters)}")
+        return characters
+    except Exception as e:
+        debug_print(f"Failed to load atlas {manifest_url}: {e}")
+        return {}
+
+async def load_player_animations(base_path, loader):
+    # Fallback for trees where build_atlas.py has not been run: one request per strip
     states = ['attack1', 'attack2', 'idle', 'run']
     directions = ['down', 'left', 'right', 'up']
     frame_counts = {'attack1': 8, 'attack2': 8, 'idle': 8, 'run': 8}
-    animations = {}
+    animations = {state: {} for state in states}
     frame_width, frame_height = None, None
-    for state in states:
-        animations[state] = {}
-        for direction in directions:
-            filename = f"{state}_{direction}.png"
-            path = f"{base_path}/{state}/{filename}"
-            debug_print(f"Loading sprite: {path}")
-            sheet = await load_image(path)
-            if sheet:
-                frames, fw, fh = slice_sprite_strip(sheet, frame_counts[state])
-                animations[state][direction] = frames
-                if frame_width is None:
-                    frame_width, frame_height = fw, fh
-                debug_print(f"Successfully loaded sprite: {path}")
-            else:
-                debug_print(f"Failed to load sprite {path}")
-                animations[state][direction] = []
+    strips = [(state, direction, f"{base_path}/{state}/{state}_{direction}.png") for state in states for direction in directions]
+    sheets = await asyncio.gather(*(loader.image(path) for _, _, path in strips))
+    for (state, direction, path), sheet in zip(strips, sheets):
+        if sheet:
+            frames, fw, fh = slice_sprite_strip(sheet, frame_counts[state])
+            animations[state][direction] = frames
+            if frame_width is None:
+                frame_width, frame_height = fw, fh
+            debug_print(f"Successfully loaded sprite: {path}")
+        else:
+            debug_print(f"Failed to load sprite {path}")
+            animations[state][direction] = []
     return animations, frame_width or 40, frame_height or 40
 
+async def load_game_assets(loader):
+    # Sprites and background in parallel; returns (animations, frame width, frame height, background)
+    async def player_sprites():
+        atlas = await load_atlas(ATLAS_MANIFEST, loader)
+        if "player" in atlas:
+            return atlas["player"]
+        return await load_player_animations("/static/assets/sprites/player", loader)
+    (animations, frame_width, frame_height), background = await asyncio.gather(player_sprites(), loader.image(BACKGROUND_IMAGE))
+    if loader.cache:
+        await loader.cache.flush()
+    return animations, frame_width, frame_height, background
+
+def draw_loading_screen(progress):
+    screen.fill((20, 20, 28))
+    bar = pygame.Rect(0, 0, viewport_width // 2, 16)
+    bar.center = (viewport_width // 2, viewport_height // 2)
+    pygame.draw.rect(screen, (80, 80, 96), bar, 1)
+    pygame.draw.rect(screen, (200, 200, 220), (bar.x + 2, bar.y + 2, int((bar.width - 4) * progress), bar.height - 4))
+    label = font.render(f"Loading {int(progress * 100)}%", True, (255, 255, 255))
+    screen.blit(label, label.get_rect(center=(bar.centerx, bar.y - 16)))
+    pygame.display.update()
+
+class SpriteVariantCache:
+    # Alpha-tinted copies of animation frames, made once per (animation set, state, direction,
+    # frame, alpha) and reused; the least recently used are dropped past max_entries.
+    def __init__(self, max_entries=SPRITE_VARIANT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.variants = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, animations, state, direction, frame, alpha):
+        key = (id(animations), state, direction, frame, alpha)
+        surface = self.variants.get(key)
+        if surface is not None:
+            self.variants.move_to_end(key)
+            self.hits += 1
+            return surface
+        frames = animations.get(state, {}).get(direction, [])
+        if not frames:
+            return None
+        self.misses += 1
+        surface = frames[frame % len(frames)].copy()
+        surface.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+        self.variants[key] = surface
+        if len(self.variants) > self.max_entries:
+            self.variants.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def stats(self):
+        return {"entries": len(self.variants), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+sprite_variants = SpriteVariantCache()
+
+class Nameplates:
+    # Each nickname is rendered once per style; plates queued during a frame are drawn together
+    # on top of all sprites with a single blits call.
+    def __init__(self, font, color=NAMEPLATE_COLOR, outline=NAMEPLATE_OUTLINE):
+        self.font = font
+        self.color = color
+        self.outline = outline
+        self.surfaces = {}  # (text, color, outline) -> Surface
+        self.queued = []
+
+    def render(self, text, color=None, outline=None):
+        color = color or self.color
+        outline = outline if outline is not None else self.outline
+        key = (text, color, outline)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = self._render(text, color, outline)
+        return surface
+
+    def _render(self, text, color, outline):
+        label = self.font.render(text, True, color)
+        if not outline:
+            return label
+        edge = self.font.render(text, True, outline)
+        surface = pygame.Surface((label.get_width() + 2, label.get_height() + 2), pygame.SRCALPHA)
+        for dx, dy in ((0, 1), (1, 0), (2, 1), (1, 2), (0, 0), (2, 0), (0, 2), (2, 2)):
+            surface.blit(edge, (dx, dy))
+        surface.blit(label, (1, 1))
+        return surface
+
+    def queue(self, text, center_x, center_y):
+        surface = self.render(text)
+        self.queued.append((surface, surface.get_rect(center=(center_x, center_y))))
+
+    def draw(self, target):
+        target.blits(self.queued, doreturn=False)
+        self.queued.clear()
+
+    def forget(self, text):
+        for key in [key for key in self.surfaces if key[0] == text]:
+            del self.surfaces[key]
+
+class Renderer:
+    # Draws a frame from queued sprites, culling anything outside the camera. In dirty-rect mode,
+    # frames with an unmoved camera only redraw the regions whose sprites changed since the
+    # previous frame and push just those rects to the canvas.
+    def __init__(self, dirty_rects=DIRTY_RECT_RENDERING):
+        self.dirty_rects = dirty_rects
+        self.screen = None
+        self.camera = pygame.Rect(0, 0, 0, 0)
+        self.background = None
+        self.items = []  # (surface or fill colour, screen rect) in draw order
+        self.previous_items = None
+        self.previous_camera = None
+        self.stats = {"draws": 0, "pixels": 0, "culled": 0, "updated": 0}
+        self.totals = dict.fromkeys(self.stats, 0)
+        self.frames = 0
+
+    def begin(self, screen, camera_x, camera_y, background):
+        if screen is not self.screen:
+            self.previous_items = None  # resized: everything is stale
+        self.screen = screen
+        self.camera = pygame.Rect(camera_x, camera_y, screen.get_width(), screen.get_height())
+        self.background = background
+        self.items = []
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def _add(self, what, rect):
+        if rect.colliderect(self.screen.get_rect()):
+            self.items.append((what, rect))
+        else:
+            self.stats["culled"] += 1
+
+    def sprite(self, surface, x, y):
+        # x, y in world coordinates
+        self._add(surface, surface.get_rect(topleft=(x - self.camera.x, y - self.camera.y)))
+
+    def box(self, color, x, y, width, height):
+        self._add(color, pygame.Rect(x - self.camera.x, y - self.camera.y, width, height))
+
+    def blits(self, sequence, doreturn=False):
+        # Screen-space (surface, rect) pairs, same signature as Surface.blits so batches can target either
+        for surface, rect in sequence:
+            self._add(surface, pygame.Rect(rect))
+
+    def _draw(self, what, rect):
+        if isinstance(what, pygame.Surface):
+            drawn = self.screen.blit(what, rect)
+        else:
+            drawn = self.screen.fill(what, rect)
+        self.stats["draws"] += 1
+        self.stats["pixels"] += drawn.width * drawn.height
+
+    def _draw_background(self, rect):
+        if self.background:
+            self.background.draw(self.screen, rect, self.camera.topleft)
+        else:
+            self.screen.fill(BACKGROUND_COLOR, rect)
+        self.stats["draws"] += 1
+        self.stats["pixels"] += rect.width * rect.height
+
+    def _changed_rects(self):
+        key = lambda item: (id(item[0]) if isinstance(item[0], pygame.Surface) else item[0], tuple(item[1]))
+        current = {key(item): item[1] for item in self.items}
+        previous = {key(item): item[1] for item in self.previous_items}
+        bounds = self.screen.get_rect()
+        merged = []
+        for k in current.keys() ^ previous.keys():
+            rect = (current.get(k) or previous[k]).clip(bounds)
+            if not rect.width or not rect.height:
+                continue
+            hit = rect.collidelist(merged)
+            while hit != -1:
+                rect.union_ip(merged.pop(hit))
+                hit = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def end(self):
+        full = not self.dirty_rects or self.previous_items is None or self.camera.topleft != self.previous_camera
+        if full:
+            bounds = self.screen.get_rect()
+            self._draw_background(bounds)
+            for what, rect in self.items:
+                self._draw(what, rect)
+            pygame.display.update()
+            self.stats["updated"] = bounds.width * bounds.height
+        else:
+            dirty = self._changed_rects()
+            for region in dirty:
+                self.screen.set_clip(region)
+                self._draw_background(region)
+                for what, rect in self.items:
+                    if rect.colliderect(region):
+                        self._draw(what, rect)
+            self.screen.set_clip(None)
+            if dirty:
+                pygame.display.update(dirty)
+            self.stats["updated"] = sum(rect.width * rect.height for rect in dirty)
+        self.previous_items = self.items
+        self.previous_camera = self.camera.topleft
+        self._report()
+
+    def _report(self):
+        self.frames += 1
+        for key, value in self.stats.items():
+            self.totals[key] += value
+        if DEBUG and self.frames % RENDER_REPORT_INTERVAL == 0:
+            averages = ", ".join(f"{key} {value / RENDER_REPORT_INTERVAL:.0f}" for key, value in self.totals.items())
+            debug_print(f"Render budget per frame over the last {RENDER_REPORT_INTERVAL}: {averages}")
+            self.totals = dict.fromkeys(self.stats, 0)
+
+class AnimationFrames:
+    # Awaitable requestAnimationFrame: next() resolves with the frame timestamp in seconds when
+    # the browser is about to paint. One proxy is reused, and at most one request is pending.
+    def __init__(self):
+        self.waiter = None
+        self.requested = False
+        self.callback = create_proxy(self._on_frame)
+
+    def _on_frame(self, timestamp=None):
+        if timestamp is not None:
+            self.requested = False
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result((timestamp if timestamp is not None else window.performance.now()) / 1000)
+
+    async def next(self):
+        loop = asyncio.get_event_loop()
+        self.waiter = loop.create_future()
+        if not self.requested:
+            self.requested = True
+            window.requestAnimationFrame(self.callback)
+        fallback = loop.call_later(HIDDEN_FRAME_INTERVAL, self._on_frame)
+        try:
+            return await self.waiter
+        finally:
+            fallback.cancel()
+
+class FrameStats:
+    # Frame times and simulation steps, averaged over RENDER_REPORT_INTERVAL frames
+    def __init__(self):
+        self.frame_time = 0  # seconds, last frame
+        self.steps = 0  # simulation steps run in the last frame
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.total_time = 0
+        self.worst_time = 0
+        self.total_steps = 0
+        self.dropped_steps = 0
+
+    def record(self, frame_time, steps, dropped):
+        self.frame_time = frame_time
+        self.steps = steps
+        self.frames += 1
+        self.total_time += frame_time
+        self.worst_time = max(self.worst_time, frame_time)
+        self.total_steps += steps
+        self.dropped_steps += dropped
+        if DEBUG and self.frames == RENDER_REPORT_INTERVAL:
+            debug_print(f"Frame timing: {self.stats()}")
+            self.reset()
+
+    def stats(self):
+        frames = self.frames or 1
+        average = self.total_time / frames
+        return {
+            "fps": round(1 / average, 1) if average else 0,
+            "frame_ms": round(average * 1000, 2),
+            "worst_frame_ms": round(self.worst_time * 1000, 2),
+            "steps_per_frame": round(self.total_steps / frames, 2),
+            "dropped_steps": self.dropped_steps
+        }
+
 class PlayerAnimation:
     def __init__(self, animations, frame_duration=0.1):
         self.animations = animations
@@ -189,12 +739,14 @@ class PlayerAnimation:
             if self.state == 'attack1' and current_time - self.last_space_press < 0.3 and self.queued_attack is None:
                 self.queued_attack = 'attack2'
                 debug_print("Queued attack2")
-            return
+                return True
+            return False
         self.last_space_press = current_time
         self.state = 'attack1'
         self.attack_timer = attack_duration
         self.queued_attack = None
         debug_print("Triggered attack1")
+        return True
 
     def trigger_dodge(self, direction, x, y):
         if self.dodge_cooldown_timer > 0 or self.state in ['attack1', 'attack2']:
@@ -204,27 +756,216 @@ class PlayerAnimation:
         self.state = 'dodge'
         self.queued_attack = None
         self.direction = direction
-        self.afterimages.append((x, y, self.get_frame(), 200, 0.2))
-        self.afterimages.append((x, y, self.get_frame(), 150, 0.1))
+        # Afterimages remember which frame to draw, not a copy of it
+        self.afterimages.append((x, y, (self.direction, self.current_frame), 200, 0.2))
+        self.afterimages.append((x, y, (self.direction, self.current_frame), 150, 0.1))
         debug_print("Triggered dodge")
         return True
 
     def get_frame(self):
-        frames = self.animations.get(self.state if self.state != 'dodge' else 'run', {}).get(self.direction, [])
-        if frames and self.state == 'dodge':
-            frame = frames[self.current_frame].copy()
-            frame.fill((255, 255, 255, 128), special_flags=pygame.BLEND_RGBA_MULT)
-            return frame
+        if self.state == 'dodge':
+            return sprite_variants.get(self.animations, 'run', self.direction, self.current_frame, DODGE_ALPHA)
+        frames = self.animations.get(self.state, {}).get(self.direction, [])
         return frames[self.current_frame] if frames else None
 
 class Player:
     def __init__(self, x, y, animations, width, height):
         self.x = x
         self.y = y
+        self.previous_x = x  # position before the last simulation step
+        self.previous_y = y
         self.width = width
         self.height = height
         self.animator = PlayerAnimation(animations)
 
+    def save_previous(self):
+        self.previous_x = self.x
+        self.previous_y = self.y
+
+    def render_position(self, alpha):
+        # Blend the last two simulation states; alpha is how far the clock is into the next step
+        return (round(self.previous_x + (self.x - self.previous_x) * alpha),
+                round(self.previous_y + (self.y - self.previous_y) * alpha))
+
+# Binary wire protocol, must match protocol.py on the server
+SUBPROTOCOL_BINARY = "pyg.bin.2"
+SUBPROTOCOL_JSON = "pyg.json"
+PROTOCOL_VERSION = 2
+STATES = ["idle", "run", "attack1", "attack2", "dodge"]
+DIRECTIONS = ["down", "left", "right", "up"]
+ACTIONS = ["attack", "dodge"]
+MSG_JOIN, MSG_UPDATE, MSG_ACTION, MSG_PING, MSG_RESYNC, MSG_PONG = 1, 2, 3, 4, 5, 6
+MSG_KEYFRAME, MSG_DELTA = 16, 17
+PLAYER_RECORD = struct.Struct("<ffBBBBfB")
+AFTERIMAGE_RECORD = struct.Struct("<ffBH")
+HIT_RECORD = struct.Struct("<HH")
+FIELD_ORDER = ["x", "y", "state", "direction", "current_frame", "current_time", "is_invulnerable", "afterimages"]
+
+def pack_player(data):
+    afterimages = list(data.get("afterimages") or [])[:255]
+    parts = [PLAYER_RECORD.pack(
+        data.get("x", 0),
+        data.get("y", 0),
+        STATES.index(data["state"]) if data.get("state") in STATES else 0,
+        DIRECTIONS.index(data["direction"]) if data.get("direction") in DIRECTIONS else 0,
+        int(data.get("current_frame", 0)) & 0xFF,
+        1 if data.get("is_invulnerable") else 0,
+        data.get("current_time", 0),
+        len(afterimages)
+    )]
+    for x, y, alpha, remaining in afterimages:
+        parts.append(AFTERIMAGE_RECORD.pack(x, y, max(0, min(255, int(alpha))), max(0, min(65535, int(remaining * 1000)))))
+    return b"".join(parts)
+
+def encode_binary(data):
+    msg_type = data.get("type")
+    if msg_type == "ping":
+        return bytes([MSG_PING])
+    if msg_type == "resync":
+        return bytes([MSG_RESYNC])
+    if msg_type == "pong":
+        return struct.pack("<BI", MSG_PONG, data["id"])
+    if msg_type == "join":
+        name = data["nickname"].encode("utf-8")[:255]
+        return (struct.pack("<BB", MSG_JOIN, PROTOCOL_VERSION) + pack_player(data)
+                + struct.pack("<HHB", data.get("view_width", 800), data.get("view_height", 600), len(name)) + name)
+    if msg_type == "update":
+        return struct.pack("<B", MSG_UPDATE) + pack_player(data)
+    action = ACTIONS.index(data["action"]) if data.get("action") in ACTIONS else 0
+    return struct.pack("<BB", MSG_ACTION, action) + pack_player(data)
+
+def unpack_afterimages(buf, offset, count):
+    afterimages = []
+    for _ in range(count):
+        x, y, alpha, time_ms = AFTERIMAGE_RECORD.unpack_from(buf, offset)
+        offset += AFTERIMAGE_RECORD.size
+        afterimages.append((x, y, alpha, time_ms / 1000))
+    return afterimages, offset
+
+def unpack_players(buf, offset, names):
+    (count,) = struct.unpack_from("<H", buf, offset)
+    offset += 2
+    players = []
+    for _ in range(count):
+        (player_id,) = struct.unpack_from("<H", buf, offset)
+        x, y, state, direction, frame, flags, current_time, n = PLAYER_RECORD.unpack_from(buf, offset + 2)
+        afterimages, offset = unpack_afterimages(buf, offset + 2 + PLAYER_RECORD.size, n)
+        players.append({
+            "nickname": names.get(player_id),
+            "x": x,
+            "y": y,
+            "state": STATES[state] if state < len(STATES) else "idle",
+            "direction": DIRECTIONS[direction] if direction < len(DIRECTIONS) else "down",
+            "current_frame": frame,
+            "current_time": current_time,
+            "is_invulnerable": bool(flags & 1),
+            "afterimages": afterimages
+        })
+    return players, offset
+
+def unpack_names(buf, offset, names):
+    (count,) = struct.unpack_from("<H", buf, offset)
+    offset += 2
+    for _ in range(count):
+        player_id, length = struct.unpack_from("<HB", buf, offset)
+        names[player_id] = buf[offset + 3:offset + 3 + length].decode("utf-8")
+        offset += 3 + length
+    return offset
+
+def unpack_changes(buf, offset):
+    mask = buf[offset]
+    offset += 1
+    fields = {}
+    for bit, name in enumerate(FIELD_ORDER):
+        if not mask & (1 << bit):
+            continue
+        if name in ("x", "y", "current_time"):
+            (fields[name],) = struct.unpack_from("<f", buf, offset)
+            offset += 4
+        elif name == "afterimages":
+            fields[name], offset = unpack_afterimages(buf, offset + 1, buf[offset])
+        else:
+            value = buf[offset]
+            offset += 1
+            if name == "state":
+                value = STATES[value] if value < len(STATES) else "idle"
+            elif name == "direction":
+                value = DIRECTIONS[value] if value < len(DIRECTIONS) else "down"
+            elif name == "is_invulnerable":
+                value = bool(value)
+            fields[name] = value
+    return fields, offset
+
+def unpack_hits(buf, offset, names):
+    # Optional trailing section: (attacker, target) nickname pairs
+    if offset >= len(buf):
+        return []
+    (count,) = struct.unpack_from("<H", buf, offset)
+    offset += 2
+    hits = []
+    for _ in range(count):
+        attacker, target = HIT_RECORD.unpack_from(buf, offset)
+        offset += HIT_RECORD.size
+        hits.append((names.get(attacker), names.get(target)))
+    return hits
+
+def decode_binary(buf, names):
+    if buf[0] == MSG_PING:
+        return {"type": "ping", "id": struct.unpack_from("<I", buf, 1)[0]}
+    if buf[0] == MSG_KEYFRAME:
+        _, seq, server_time = struct.unpack_from("<BId", buf, 0)
+        offset = unpack_names(buf, 13, names)
+        players, offset = unpack_players(buf, offset, names)
+        return {"type": "players_update", "seq": seq, "t": server_time, "players": players, "hits": unpack_hits(buf, offset, names)}
+    if buf[0] == MSG_DELTA:
+        _, seq, base, server_time = struct.unpack_from("<BIId", buf, 0)
+        (count,) = struct.unpack_from("<H", buf, 17)
+        left = [names.get(player_id) for player_id in struct.unpack_from(f"<{count}H", buf, 19)]
+        offset = unpack_names(buf, 19 + 2 * count, names)
+        joined, offset = unpack_players(buf, offset, names)
+        (count,) = struct.unpack_from("<H", buf, offset)
+        offset += 2
+        changed = []
+        for _ in range(count):
+            (player_id,) = struct.unpack_from("<H", buf, offset)
+            fields, offset = unpack_changes(buf, offset + 2)
+            fields["nickname"] = names.get(player_id)
+            changed.append(fields)
+        return {"type": "players_delta", "seq": seq, "base": base, "t": server_time, "left": left, "joined": joined, "changed": changed,
+                "hits": unpack_hits(buf, offset, names)}
+    return {}
+
+class InterpolationBuffer:
+    # Timestamped positions of one remote player, sampled in server time
+    def __init__(self):
+        self.samples = []  # (server_time, x, y), oldest first
+
+    def add(self, server_time, x, y):
+        if self.samples and server_time <= self.samples[-1][0]:
+            return
+        self.samples.append((server_time, x, y))
+
+    def sample(self, render_time):
+        samples = self.samples
+        if not samples:
+            return None
+        # Drop samples that can no longer bracket the render time
+        while len(samples) > 2 and samples[1][0] <= render_time:
+            samples.pop(0)
+        t0, x0, y0 = samples[0]
+        if render_time <= t0:
+            return x0, y0
+        if len(samples) == 1:
+            return x0, y0
+        t1, x1, y1 = samples[1]
+        if render_time <= t1:
+            k = (render_time - t0) / (t1 - t0)
+            return x0 + (x1 - x0) * k, y0 + (y1 - y0) * k
+        # Late packet: extrapolate along the last segment, then hold
+        ahead = min(render_time - t1, MAX_EXTRAPOLATION)
+        k = ahead / (t1 - t0)
+        return x1 + (x1 - x0) * k, y1 + (y1 - y0) * k
+
 class MultiplayerClient:
     def __init__(self, player, nickname, animations):
         self.player = player
@@ -232,6 +973,17 @@ class MultiplayerClient:
         self.animations = animations
         self.ws = None
         self.other_players = {}
+        self.snapshot_seq = None  # seq of the last server snapshot applied to other_players
+        self.binary = False
+        self.player_names = {}  # binary protocol player id -> nickname
+        self.buffers = {}  # nickname -> InterpolationBuffer
+        self.on_player_left = None  # called with the nickname of each player that is no longer visible
+        self.on_hit = None  # called with (attacker, target) nicknames for every hit the server resolved
+        self.clock_offset = None  # smoothed server time minus local time
+        self.last_snapshot_time = None  # server time of the last snapshot
+        self.snapshot_interval = INTERPOLATION_DELAY / 2  # smoothed server time between snapshots
+        self.last_sent_key = None  # what the server last heard about us, see _state_key
+        self.last_sent_time = 0
         self.connected = False
         self.is_invulnerable = False
         self.on_open_proxy = create_proxy(self._on_open)
@@ -241,7 +993,9 @@ class MultiplayerClient:
 
     async def connect(self):
         try:
-            self.ws = WebSocket.new(f"ws://{window.location.host}/ws")
+            protocols = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON] if USE_BINARY_PROTOCOL else [SUBPROTOCOL_JSON]
+            self.ws = WebSocket.new(f"ws://{window.location.host}/ws", to_js(protocols))
+            self.ws.binaryType = "arraybuffer"
             self.ws.addEventListener("open", self.on_open_proxy)
             self.ws.addEventListener("message", self.on_message_proxy)
             self.ws.addEventListener("error", self.on_error_proxy)
@@ -249,6 +1003,8 @@ class MultiplayerClient:
             self._open_promise = asyncio.Future()
             await self._open_promise
             self.connected = True
+            self.binary = self.ws.protocol == SUBPROTOCOL_BINARY
+            debug_print(f"Negotiated protocol: {self.ws.protocol or 'json'}")
             self.send({
                 "type": "join",
                 "nickname": self.nickname,
@@ -259,7 +1015,10 @@ class MultiplayerClient:
                 "current_frame": self.player.animator.current_frame,
                 "current_time": self.player.animator.current_time,
                 "is_invulnerable": self.is_invulnerable,
-                "afterimages": self.player.animator.afterimages
+                "afterimages": [(x, y, alpha, time) for x, y, _, alpha, time in self.player.animator.afterimages],
+                "view_width": viewport_width,
+                "view_height": viewport_height,
+                **({"room": room} if room else {})
             })
             debug_print("WebSocket connection established")
         except Exception as e:
@@ -272,26 +1031,108 @@ class MultiplayerClient:
 
     def _on_message(self, event):
         try:
-            data = json.loads(event.data)
+            if isinstance(event.data, str):
+                data = json.loads(event.data)
+            else:
+                data = decode_binary(event.data.to_bytes(), self.player_names)
             debug_print(f"Received message: {data}")
-            if data.get("type") == "players_update":
-                self.other_players = {
-                    p["nickname"]: {
-                        "x": p["x"],
-                        "y": p["y"],
-                        "state": p.get("state", "idle"),
-                        "direction": p.get("direction", "down"),
-                        "current_frame": p.get("current_frame", 0),
-                        "current_time": p.get("current_time", 0),
-                        "is_invulnerable": p.get("is_invulnerable", False),
-                        "afterimages": p.get("afterimages", [])
-                    }
-                    for p in data["players"]
-                    if p["nickname"] != self.nickname
-                }
+            msg_type = data.get("type")
+            if msg_type == "ping":
+                # Answered straight away; the server measures our round trip and picks a send rate from it
+                self.send({"type": "pong", "id": data["id"]})
+                return
+            if msg_type == "players_update":
+                self._apply_keyframe(data)
+                self._record_positions(data.get("t"))
+            elif msg_type == "players_delta":
+                if self._apply_delta(data):
+                    self._record_positions(data.get("t"))
+            if self.on_hit:
+                for attacker, target in data.get("hits", []):
+                    self.on_hit(attacker, target)
         except Exception as e:
             debug_print(f"Error processing message: {e}")
 
+    def _player_entry(self, p):
+        return {
+            "x": p["x"],
+            "y": p["y"],
+            "state": p.get("state", "idle"),
+            "direction": p.get("direction", "down"),
+            "current_frame": p.get("current_frame", 0),
+            "current_time": p.get("current_time", 0),
+            "is_invulnerable": p.get("is_invulnerable", False),
+            "afterimages": p.get("afterimages", [])
+        }
+
+    def _apply_keyframe(self, data):
+        seen = set()
+        for p in data["players"]:
+            nick = p["nickname"]
+            if nick == self.nickname:
+                continue
+            seen.add(nick)
+            if nick in self.other_players:
+                self.other_players[nick].update(self._player_entry(p))
+            else:
+                self.other_players[nick] = self._player_entry(p)
+        for nick in [n for n in self.other_players if n not in seen]:
+            del self.other_players[nick]
+            if self.on_player_left:
+                self.on_player_left(nick)
+        self.snapshot_seq = data.get("seq")
+
+    def _apply_delta(self, data):
+        if self.snapshot_seq is None or data.get("base") != self.snapshot_seq:
+            debug_print(f"Delta base {data.get('base')} does not match {self.snapshot_seq}, requesting resync")
+            self.send({"type": "resync"})
+            return False
+        for p in data.get("joined", []):
+            if p["nickname"] != self.nickname:
+                self.other_players[p["nickname"]] = self._player_entry(p)
+        for p in data.get("changed", []):
+            entry = self.other_players.get(p["nickname"])
+            if entry is not None:
+                entry.update((key, value) for key, value in p.items() if key != "nickname")
+        for nick in data.get("left", []):
+            if self.other_players.pop(nick, None) is not None and self.on_player_left:
+                self.on_player_left(nick)
+        self.snapshot_seq = data["seq"]
+        return True
+
+    def _record_positions(self, server_time):
+        # Every visible player gets a sample per snapshot, changed or not, so a player
+        # that stopped is not blended across the whole gap to its next move.
+        if server_time is None:
+            return
+        offset = server_time - time.time()
+        if self.clock_offset is None or abs(offset - self.clock_offset) > 1:
+            self.clock_offset = offset
+        else:
+            self.clock_offset += (offset - self.clock_offset) * 0.1
+        if self.last_snapshot_time is not None:
+            gap = server_time - self.last_snapshot_time
+            if 0 < gap <= MAX_SNAPSHOT_GAP:
+                # Quick to grow so a lower send rate does not leave players extrapolating, slow to shrink
+                rate = 0.5 if gap > self.snapshot_interval else 0.05
+                self.snapshot_interval += (gap - self.snapshot_interval) * rate
+        self.last_snapshot_time = server_time
+        for nick, entry in self.other_players.items():
+            buffer = self.buffers.get(nick)
+            if buffer is None:
+                buffer = self.buffers[nick] = InterpolationBuffer()
+            buffer.add(server_time, entry["x"], entry["y"])
+        for nick in [n for n in self.buffers if n not in self.other_players]:
+            del self.buffers[nick]
+
+    def render_position(self, nick):
+        entry = self.other_players[nick]
+        buffer = self.buffers.get(nick)
+        if buffer is None or self.clock_offset is None:
+            return entry["x"], entry["y"]
+        delay = max(INTERPOLATION_DELAY, 2 * self.snapshot_interval)
+        return buffer.sample(time.time() + self.clock_offset - delay) or (entry["x"], entry["y"])
+
     def _on_close(self, event):
         debug_print("WebSocket closed")
         self.connected = False
@@ -309,6 +1150,9 @@ class MultiplayerClient:
     def send(self, data):
         if self.ws and self.ws.readyState == 1:
             try:
+                if self.binary:
+                    self.ws.send(to_js(encode_binary(data)))
+                    return
                 message = json.dumps(data)
                 if message == "{}":
                     debug_print(f"Warning: json.dumps produced empty object for data: {data}")
@@ -321,27 +1165,45 @@ class MultiplayerClient:
         else:
             debug_print("WebSocket not open. Could not send:", data)
 
-    def send_position_update(self):
-        self.send({
-            "type": "update",
+    def _player_state(self):
+        anim = self.player.animator
+        return {
             "x": self.player.x,
             "y": self.player.y,
-            "state": self.player.animator.state,
-            "direction": self.player.animator.direction,
-            "current_frame": self.player.animator.current_frame,
-            "current_time": self.player.animator.current_time,
-            "is_invulnerable": self.player.animator.state == 'dodge',
-            "afterimages": [(x, y, alpha, time) for x, y, _, alpha, time in self.player.animator.afterimages]
-        })
+            "state": anim.state,
+            "direction": anim.direction,
+            "current_frame": anim.current_frame,
+            "current_time": anim.current_time,
+            "is_invulnerable": anim.state == 'dodge',
+            "afterimages": [(x, y, alpha, time) for x, y, _, alpha, time in anim.afterimages]
+        }
+
+    def _state_key(self):
+        # The fields whose change is worth a message; current_time and afterimage
+        # timers tick every frame and are reconstructed well enough by other clients.
+        anim = self.player.animator
+        return (self.player.x, self.player.y, anim.state, anim.direction, anim.current_frame, len(anim.afterimages))
+
+    def send_position_update(self, now):
+        key = self._state_key()
+        elapsed = now - self.last_sent_time
+        if key == self.last_sent_key and elapsed < HEARTBEAT_INTERVAL:
+            return
+        if elapsed < 1 / MAX_SEND_RATE:
+            return  # still changed next frame, so it goes out once the rate allows
+        self.send({"type": "update", **self._player_state()})
+        self.last_sent_key = key
+        self.last_sent_time = now
+
+    def send_action(self, action, now):
+        # Discrete events bypass the rate cap so the server sees them immediately.
+        self.send({"type": "action", "action": action, **self._player_state()})
+        self.last_sent_key = self._state_key()
+        self.last_sent_time = now
 
     def get_other_players(self):
         return self.other_players
 
-    async def keep_alive(self):
-        while self.connected:
-            await asyncio.sleep(20)
-            self.send({"type": "ping"})
-
     def _cleanup(self):
         if self.ws:
             self.ws.removeEventListener("open", self.on_open_proxy)
@@ -385,50 +1247,116 @@ async def game_loop():
         debug_print("Canvas clicked, focused")
     canvas.addEventListener("click", create_proxy(on_canvas_click))
 
+    # Assets download while the WebSocket handshake runs; the join only needs the position.
+    player = Player(100, 100, {}, 40, 40)
+    mp_client = MultiplayerClient(player, nickname, {})
+    debug_print("Loading assets and connecting to WebSocket...")
+    connecting = asyncio.ensure_future(mp_client.connect())
+    loader = AssetLoader(cache=await open_sprite_cache())
+    assets = asyncio.ensure_future(load_game_assets(loader))
+    frames = AnimationFrames()
+    while not assets.done():
+        draw_loading_screen(loader.progress)
+        await frames.next()
+
     try:
-        debug_print("Loading player animations...")
-        player_animations, player_w, player_h = await load_player_animations("/static/assets/sprites/player")
-        debug_print("Player animations loaded successfully")
-        player = Player(100, 100, player_animations, player_w, player_h)
+        player_animations, player.width, player.height, big_bg = assets.result()
+        player.animator.animations = player_animations
+        mp_client.animations = player_animations
+        debug_print("Assets loaded successfully")
     except Exception as e:
-        debug_print(f"Failed to load player animations: {e}")
-        player = Player(100, 100, {}, 40, 40)
+        debug_print(f"Failed to load assets: {e}")
+    if big_bg:
+        world.set_tile(big_bg)
+    else:
+        debug_print("Background image not loaded, using fallback")
 
     try:
-        mp_client = MultiplayerClient(player, nickname, player_animations)
-        debug_print("Connecting to WebSocket...")
-        await mp_client.connect()
+        await connecting
         debug_print("WebSocket connection established")
     except Exception as e:
         debug_print(f"Failed to connect to WebSocket: {e}")
         mp_client = None
 
-    try:
-        debug_print("Loading background image...")
-        big_bg = await load_image("/static/assets/background/grass.png")
-        if big_bg:
-            debug_print("Background image loaded successfully")
-            redraw_world_background()
-        else:
-            debug_print("Background image not loaded, using fallback")
-    except Exception as e:
-        debug_print(f"Failed to load background: {e}")
+    nameplates = Nameplates(font)
+    renderer = Renderer()
+    if mp_client:
+        mp_client.on_player_left = nameplates.forget
+        mp_client.on_hit = lambda attacker, target: debug_print(f"{attacker} hit {target}")
 
     player_anim = player.animator
-    last_time = pygame.time.get_ticks() / 1000
-    frame_count = 0
+    frame_stats = FrameStats()
+
+    def simulate_step(sim_time):
+        # One fixed step of local input, movement and animation; everything here runs at SIM_RATE
+        moving = False
+        direction = player_anim.direction
+        speed = dodge_speed if player_anim.state == 'dodge' else player_speed
+        keys = pygame.key.get_pressed()
+        if (keys[pygame.K_LEFT] or 37 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
+            player.x -= speed
+            direction = 'left'
+            moving = True
+            debug_print(f"Moving left: player.x={player.x}")
+        elif (keys[pygame.K_RIGHT] or 39 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
+            player.x += speed
+            direction = 'right'
+            moving = True
+            debug_print(f"Moving right: player.x={player.x}")
+        elif (keys[pygame.K_UP] or 38 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
+            player.y -= speed
+            direction = 'up'
+            moving = True
+            debug_print(f"Moving up: player.y={player.y}")
+        elif (keys[pygame.K_DOWN] or 40 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
+            player.y += speed
+            direction = 'down'
+            moving = True
+            debug_print(f"Moving down: player.y={player.y}")
+        if space_pressed:
+            if player_anim.trigger_attack(sim_time) and mp_client:
+                mp_client.send_action("attack", sim_time)
+                debug_print("Triggered attack")
+        elif (keys[pygame.K_LSHIFT] or 16 in pressed_keys) and moving and player_anim.dodge_cooldown_timer <= 0:
+            if player_anim.trigger_dodge(direction, player.x, player.y):
+                if direction == 'left':
+                    player.x -= speed
+                elif direction == 'right':
+                    player.x += speed
+                elif direction == 'up':
+                    player.y -= speed
+                elif direction == 'down':
+                    player.y += speed
+                if mp_client:
+                    mp_client.send_action("dodge", sim_time)
+                    debug_print("Triggered dodge")
 
-    asyncio.ensure_future(mp_client.keep_alive() if mp_client else asyncio.sleep(0))
+        player.x = max(0, min(world_width - player.width, player.x))
+        player.y = max(0, min(world_height - player.height, player.y))
+        debug_print(f"Player position: ({player.x}, {player.y})")
+
+        player_anim.state = 'run' if moving and player_anim.state not in ['attack1', 'attack2', 'dodge'] else player_anim.state
+        if not moving and player_anim.state not in ['attack1', 'attack2', 'dodge']:
+            player_anim.state = 'idle'
+        player_anim.direction = direction
+        player_anim.update(SIM_DT)
+
+        if mp_client:
+            mp_client.send_position_update(sim_time)
+
+    last_frame = await frames.next()
+    sim_time = last_frame
+    accumulator = 0
+    frame_count = 0
 
     while running:
         try:
+            # Paced by requestAnimationFrame; the simulation catches up in fixed steps and
+            # rendering blends between the last two simulation states.
+            now = await frames.next()
+            frame_time = now - last_frame
+            last_frame = now
             debug_print(f"Game loop iteration: {frame_count}, running: {running}")
-            current_time = pygame.time.get_ticks() / 1000
-            dt = current_time - last_time
-            last_time = current_time
-
-            if mp_client:
-                mp_client.send_position_update()
 
             canvas.focus()
             debug_print(f"Canvas focused: {canvas == js_document.activeElement}")
@@ -438,143 +1366,74 @@ async def game_loop():
                 if event.type == pygame.QUIT:
                     running = False
 
-            moving = False
-            direction = player_anim.direction
-            speed = dodge_speed if player_anim.state == 'dodge' else player_speed
-            keys = pygame.key.get_pressed()
-            if (keys[pygame.K_LEFT] or 37 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
-                player.x -= speed
-                direction = 'left'
-                moving = True
-                debug_print(f"Moving left: player.x={player.x}")
-            elif (keys[pygame.K_RIGHT] or 39 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
-                player.x += speed
-                direction = 'right'
-                moving = True
-                debug_print(f"Moving right: player.x={player.x}")
-            elif (keys[pygame.K_UP] or 38 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
-                player.y -= speed
-                direction = 'up'
-                moving = True
-                debug_print(f"Moving up: player.y={player.y}")
-            elif (keys[pygame.K_DOWN] or 40 in pressed_keys) and player_anim.state not in ['attack1', 'attack2']:
-                player.y += speed
-                direction = 'down'
-                moving = True
-                debug_print(f"Moving down: player.y={player.y}")
-            if space_pressed:
-                player_anim.trigger_attack(current_time)
-                if mp_client and player_anim.state in ['attack1', 'attack2']:
-                    mp_client.send({
-                        "type": "action",
-                        "action": "attack",
-                        "x": player.x,
-                        "y": player.y,
-                        "state": player_anim.state,
-                        "direction": player_anim.direction,
-                        "current_frame": player_anim.current_frame,
-                        "current_time": player_anim.current_time,
-                        "is_invulnerable": player_anim.state == 'dodge',
-                        "afterimages": [(x, y, alpha, time) for x, y, _, alpha, time in player_anim.afterimages]
-                    })
-                    debug_print("Triggered attack")
-            elif (keys[pygame.K_LSHIFT] or 16 in pressed_keys) and moving and player_anim.dodge_cooldown_timer <= 0:
-                if player_anim.trigger_dodge(direction, player.x, player.y):
-                    if direction == 'left':
-                        player.x -= speed
-                    elif direction == 'right':
-                        player.x += speed
-                    elif direction == 'up':
-                        player.y -= speed
-                    elif direction == 'down':
-                        player.y += speed
-                    if mp_client:
-                        mp_client.send({
-                            "type": "action",
-                            "action": "dodge",
-                            "x": player.x,
-                            "y": player.y,
-                            "state": player_anim.state,
-                            "direction": player_anim.direction,
-                            "current_frame": player_anim.current_frame,
-                            "current_time": player_anim.current_time,
-                            "is_invulnerable": player_anim.state == 'dodge',
-                            "afterimages": [(x, y, alpha, time) for x, y, _, alpha, time in player_anim.afterimages]
-                        })
-                        debug_print("Triggered dodge")
-
-            player.x = max(0, min(world_width - player.width, player.x))
-            player.y = max(0, min(world_height - player.height, player.y))
-            debug_print(f"Player position: ({player.x}, {player.y})")
-
-            player_anim.state = 'run' if moving and player_anim.state not in ['attack1', 'attack2', 'dodge'] else player_anim.state
-            if not moving and player_anim.state not in ['attack1', 'attack2', 'dodge']:
-                player_anim.state = 'idle'
-            player_anim.direction = direction
-            player_anim.update(dt)
-
-            camera_x = player.x + player.width // 2 - viewport_width // 2
-            camera_y = player.y + player.height // 2 - viewport_height // 2
+            accumulator += frame_time
+            steps = 0
+            while accumulator >= SIM_DT and steps < MAX_SIM_STEPS:
+                player.save_previous()
+                sim_time += SIM_DT
+                simulate_step(sim_time)
+                accumulator -= SIM_DT
+                steps += 1
+            dropped = int(accumulator // SIM_DT)
+            if dropped:
+                accumulator -= dropped * SIM_DT
+                sim_time += dropped * SIM_DT
+                debug_print(f"Simulation fell behind, dropped {dropped} steps")
+            frame_stats.record(frame_time, steps, dropped)
+            player_x, player_y = player.render_position(accumulator / SIM_DT)
+
+            camera_x = player_x + player.width // 2 - viewport_width // 2
+            camera_y = player_y + player.height // 2 - viewport_height // 2
             camera_x = max(0, min(world_width - viewport_width, camera_x))
             camera_y = max(0, min(world_height - viewport_height, camera_y))
 
-            screen.fill((128, 128, 128))
-            if big_bg:
-                debug_print(f"big_bg: {big_bg is not None}, world size: {world.get_size()}")
-                screen.blit(world, (0, 0), area=pygame.Rect(camera_x, camera_y, viewport_width, viewport_height))
-            else:
-                debug_print("No background, using gray fill")
+            renderer.begin(screen, camera_x, camera_y, world if big_bg else None)
+            if DEBUG and frame_count % RENDER_REPORT_INTERVAL == 0:
+                debug_print(f"World chunks: {len(world.chunks)} cached, {world.generated} generated, {world.evicted} evicted")
+            view = renderer.camera.inflate(player.width * 2, player.height * 2)
 
-            for x, y, frame, alpha, _ in player_anim.afterimages:
-                if frame:
-                    afterimage = frame.copy()
-                    afterimage.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
-                    screen.blit(afterimage, (x - camera_x, y - camera_y))
+            for x, y, (afterimage_direction, afterimage_frame), alpha, _ in player_anim.afterimages:
+                # Captured mid-dodge, so the dodge transparency applies on top of the fade
+                afterimage = sprite_variants.get(player_anim.animations, 'run', afterimage_direction, afterimage_frame, alpha * DODGE_ALPHA // 255)
+                if afterimage:
+                    renderer.sprite(afterimage, x, y)
 
-            debug_print(f"Player frame available: {player_anim.get_frame() is not None}")
             if frame := player_anim.get_frame():
-                screen.blit(frame, (player.x - camera_x, player.y - camera_y))
+                renderer.sprite(frame, player_x, player_y)
             else:
-                debug_print("No player frame, drawing green rectangle")
-                pygame.draw.rect(screen, (0, 255, 0), (player.x - camera_x, player.y - camera_y, player.width, player.height))
-            name_surface = font.render(nickname, True, (255, 255, 255))
-            name_rect = name_surface.get_rect(center=(player.x - camera_x + player.width / 2, player.y - camera_y - 10))
-            screen.blit(name_surface, name_rect)
-
+                renderer.box((0, 255, 0), player_x, player_y, player.width, player.height)
+            nameplates.queue(nickname, player_x - camera_x + player.width / 2, player_y - camera_y - 10)
             for other_nick, other_data in (mp_client.get_other_players().items() if mp_client else {}):
-                other_x = other_data["x"]
-                other_y = other_data["y"]
+                other_x, other_y = mp_client.render_position(other_nick)
+                if not view.collidepoint(other_x, other_y):
+                    # Off screen: skip the variant lookups and the nameplate entirely
+                    renderer.stats["culled"] += 1
+                    continue
                 state = other_data.get("state", "idle")
                 direction = other_data.get("direction", "down")
                 current_frame = other_data.get("current_frame", 0)
                 afterimages = other_data.get("afterimages", [])
-                for x, y, alpha, time in afterimages:
-                    if time > 0:
-                        frames = mp_client.animations.get('run', {}).get(direction, [])
-                        if frames:
-                            afterimage = frames[current_frame].copy()
-                            afterimage.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
-                            screen.blit(afterimage, (x - camera_x, y - camera_y))
-                frames = mp_client.animations.get(state if state != 'dodge' else 'run', {}).get(direction, [])
-                if frames:
-                    frame = frames[current_frame]
-                    if state == 'dodge':
-                        frame = frame.copy()
-                        frame.fill((255, 255, 255, 128), special_flags=pygame.BLEND_RGBA_MULT)
-                    screen.blit(frame, (other_x - camera_x, other_y - camera_y))
+                for x, y, alpha, remaining in afterimages:
+                    if remaining > 0:
+                        afterimage = sprite_variants.get(mp_client.animations, 'run', direction, current_frame, int(alpha))
+                        if afterimage:
+                            renderer.sprite(afterimage, x, y)
+                if state == 'dodge':
+                    frame = sprite_variants.get(mp_client.animations, 'run', direction, current_frame, DODGE_ALPHA)
                 else:
-                    pygame.draw.rect(screen, (0, 0, 255), (other_x - camera_x, other_y - camera_y, player.width, player.height))
-                name_surface = font.render(other_nick, True, (255, 255, 255))
-                name_rect = name_surface.get_rect(center=(other_x - camera_x + player.width / 2, other_y - camera_y - 10))
-                screen.blit(name_surface, name_rect)
-
-            canvas.style.display = "none"
-            canvas.style.display = "block"
-            pygame.display.update()
+                    frames = mp_client.animations.get(state, {}).get(direction, [])
+                    frame = frames[current_frame % len(frames)] if frames else None
+                if frame:
+                    renderer.sprite(frame, other_x, other_y)
+                else:
+                    renderer.box((0, 0, 255), other_x, other_y, player.width, player.height)
+                nameplates.queue(other_nick, other_x - camera_x + player.width / 2, other_y - camera_y - 10)
+            nameplates.draw(renderer)
+            renderer.end()
             debug_print(f"Frame {frame_count} rendered")
+            if DEBUG and frame_count % 600 == 0:
+                debug_print(f"Sprite variant cache: {sprite_variants.stats()}")
             frame_count += 1
-            clock.tick(60)
-            await asyncio.sleep(0.016)
         except Exception as e:
             print(f"Error in game loop: {e}")
 
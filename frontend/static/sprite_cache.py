@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+
+# Decoded sprites are large (4 bytes per pixel), so the cache keeps only the most recently used ones.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+INDEX_KEY = "index"
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+class CacheBackend:
+    # Bytes stored under string keys. Async so browser storage (IndexedDB) fits behind it;
+    # read returns None for a missing key.
+    async def read(self, key):
+        raise NotImplementedError
+
+    async def write(self, key, data):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+class FileSystemBackend(CacheBackend):
+    # One file per key; for desktop pygame and for exercising SpriteCache outside the browser.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    async def read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def write(self, key, data):
+        # Write then rename so a crash never leaves a truncated entry behind.
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    async def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class SpriteCache:
+    # Decoded RGBA pixels keyed by the content hash of the encoded image. An index of
+    # key -> [width, height, size, last used] lives next to the pixels; past max_bytes the
+    # least recently used entries are evicted.
+    def __init__(self, backend, max_bytes=DEFAULT_MAX_BYTES):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.index_dirty = False
+
+    @property
+    def size(self):
+        return sum(entry[2] for entry in self.entries.values())
+
+    async def open(self):
+        raw = await self.backend.read(INDEX_KEY)
+        try:
+            self.entries = json.loads(raw) if raw else {}
+        except ValueError:
+            self.entries = {}  # corrupt index: start over, stale blobs get overwritten on reuse
+        return self
+
+    async def get(self, key):
+        # Returns ((width, height), pixels) or None.
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        pixels = await self.backend.read(key)
+        if pixels is None or len(pixels) != entry[2]:
+            del self.entries[key]
+            self.index_dirty = True
+            return None
+        entry[3] = time.time()
+        self.index_dirty = True
+        return (entry[0], entry[1]), pixels
+
+    async def put(self, key, size, pixels):
+        if len(pixels) > self.max_bytes:
+            return
+        await self.backend.write(key, pixels)
+        self.entries[key] = [size[0], size[1], len(pixels), time.time()]
+        await self.evict()
+        await self.flush(force=True)
+
+    async def evict(self):
+        total = self.size
+        for key in sorted(self.entries, key=lambda k: self.entries[k][3]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)[2]
+            await self.backend.delete(key)
+            self.index_dirty = True
+
+    async def flush(self, force=False):
+        # Access times are only persisted here, so call it once loading is done.
+        if self.index_dirty or force:
+            await self.backend.write(INDEX_KEY, json.dumps(self.entries, separators=(",", ":")).encode())
+            self.index_dirty = False
@@ -0,0 +1,399 @@
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Wire protocols are negotiated through the WebSocket subprotocol header.
+# Clients that do not offer one get JSON, which stays the fallback.
+PROTOCOL_VERSION = 2
+SUBPROTOCOL_BINARY = f"pyg.bin.{PROTOCOL_VERSION}"
+SUBPROTOCOL_JSON = "pyg.json"
+
+STATES = ["idle", "run", "attack1", "attack2", "dodge"]
+DIRECTIONS = ["down", "left", "right", "up"]
+ACTIONS = ["attack", "dodge"]
+STATE_CODES = {name: code for code, name in enumerate(STATES)}
+DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTIONS)}
+ACTION_CODES = {name: code for code, name in enumerate(ACTIONS)}
+
+# Message type bytes (first byte of every binary frame)
+MSG_JOIN = 1
+MSG_UPDATE = 2
+MSG_ACTION = 3
+MSG_PING = 4
+MSG_RESYNC = 5
+MSG_PONG = 6
+MSG_KEYFRAME = 16
+MSG_DELTA = 17
+
+
+# x, y, state, direction, current_frame, flags, current_time, afterimage count
+PLAYER_RECORD = struct.Struct("<ffBBBBfB")
+# x, y, alpha, remaining time in milliseconds
+AFTERIMAGE_RECORD = struct.Struct("<ffBH")
+HIT_RECORD = struct.Struct("<HH")  # attacker id, target id
+FLAG_INVULNERABLE = 1
+
+# Field order of the change mask used in deltas; bit i set means FIELD_ORDER[i] follows.
+FIELD_ORDER = ["x", "y", "state", "direction", "current_frame", "current_time", "is_invulnerable", "afterimages"]
+FIELD_BITS = {name: 1 << bit for bit, name in enumerate(FIELD_ORDER)}
+
+JOIN_HEADER = struct.Struct("<BB")  # type, version
+VIEW_SIZE = struct.Struct("<HH")
+UPDATE_HEADER = struct.Struct("<B")  # type
+PING_FRAME = struct.Struct("<BI")  # type, ping id; server pings and client pongs
+ACTION_HEADER = struct.Struct("<BB")  # type, action
+KEYFRAME_HEADER = struct.Struct("<BId")  # type, seq, server time
+DELTA_HEADER = struct.Struct("<BIId")  # type, seq, base, server time
+U8 = struct.Struct("<B")
+U16 = struct.Struct("<H")
+F32 = struct.Struct("<f")
+
+def encode_message(message):
+    if orjson:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"))
+
+def decode_message(text):
+    if orjson:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def pack_afterimage_records(afterimages):
+    return b"".join(
+        AFTERIMAGE_RECORD.pack(x, y, max(0, min(255, int(alpha))), max(0, min(65535, int(time * 1000))))
+        for x, y, alpha, time in afterimages[:255]
+    )
+
+def pack_afterimages(afterimages):
+    return U8.pack(min(len(afterimages), 255)) + pack_afterimage_records(afterimages)
+
+def unpack_afterimages(buf, offset, count):
+    afterimages = []
+    for _ in range(count):
+        x, y, alpha, time_ms = AFTERIMAGE_RECORD.unpack_from(buf, offset)
+        offset += AFTERIMAGE_RECORD.size
+        afterimages.append([x, y, alpha, time_ms / 1000])
+    return afterimages, offset
+
+def pack_player(info):
+    afterimages = info.get("afterimages") or []
+    count = min(len(afterimages), 255)
+    return PLAYER_RECORD.pack(
+        info.get("x", 0),
+        info.get("y", 0),
+        STATE_CODES.get(info.get("state"), 0),
+        DIRECTION_CODES.get(info.get("direction"), 0),
+        int(info.get("current_frame", 0)) & 0xFF,
+        FLAG_INVULNERABLE if info.get("is_invulnerable") else 0,
+        info.get("current_time", 0),
+        count,
+    ) + pack_afterimage_records(afterimages)
+
+def unpack_player(buf, offset):
+    x, y, state, direction, frame, flags, current_time, count = PLAYER_RECORD.unpack_from(buf, offset)
+    offset += PLAYER_RECORD.size
+    afterimages, offset = unpack_afterimages(buf, offset, count)
+    return {
+        "x": x,
+        "y": y,
+        "state": STATES[state] if state < len(STATES) else "idle",
+        "direction": DIRECTIONS[direction] if direction < len(DIRECTIONS) else "down",
+        "current_frame": frame,
+        "current_time": current_time,
+        "is_invulnerable": bool(flags & FLAG_INVULNERABLE),
+        "afterimages": afterimages,
+    }, offset
+
+def pack_changes(fields):
+    mask = 0
+    parts = []
+    for name in FIELD_ORDER:
+        if name not in fields:
+            continue
+        mask |= FIELD_BITS[name]
+        value = fields[name]
+        if name in ("x", "y", "current_time"):
+            parts.append(F32.pack(value))
+        elif name == "state":
+            parts.append(U8.pack(STATE_CODES.get(value, 0)))
+        elif name == "direction":
+            parts.append(U8.pack(DIRECTION_CODES.get(value, 0)))
+        elif name == "current_frame":
+            parts.append(U8.pack(int(value) & 0xFF))
+        elif name == "is_invulnerable":
+            parts.append(U8.pack(1 if value else 0))
+        else:
+            parts.append(pack_afterimages(value or []))
+    return U8.pack(mask) + b"".join(parts)
+
+def unpack_changes(buf, offset):
+    (mask,) = U8.unpack_from(buf, offset)
+    offset += 1
+    fields = {}
+    for name in FIELD_ORDER:
+        if not mask & FIELD_BITS[name]:
+            continue
+        if name in ("x", "y", "current_time"):
+            (fields[name],) = F32.unpack_from(buf, offset)
+            offset += F32.size
+        elif name == "afterimages":
+            (count,) = U8.unpack_from(buf, offset)
+            fields[name], offset = unpack_afterimages(buf, offset + 1, count)
+        else:
+            (value,) = U8.unpack_from(buf, offset)
+            offset += 1
+            if name == "state":
+                value = STATES[value] if value < len(STATES) else "idle"
+            elif name == "direction":
+                value = DIRECTIONS[value] if value < len(DIRECTIONS) else "down"
+            elif name == "is_invulnerable":
+                value = bool(value)
+            fields[name] = value
+    return fields, offset
+
+def pack_name(player_id, nickname):
+    raw = nickname.encode("utf-8")[:255]
+    return U16.pack(player_id) + U8.pack(len(raw)) + raw
+
+class JsonCodec:
+    name = "json"
+    subprotocol = SUBPROTOCOL_JSON
+    binary = False
+    uses_ids = False
+
+    def decode(self, raw):
+        return decode_message(raw)
+
+    def player_fragment(self, nick, player_id, info):
+        return encode_message({"nickname": nick, **info})
+
+    def changes_fragment(self, nick, player_id, fields):
+        return encode_message({"nickname": nick, **fields})
+
+    def hit_fragment(self, attacker_nick, attacker_id, target_nick, target_id):
+        return encode_message([attacker_nick, target_nick])
+
+    def ping(self, ping_id):
+        return '{"type":"ping","id":%d}' % ping_id
+
+    def keyframe(self, seq, server_time, names, players, hits=()):
+        hits = ',"hits":[%s]' % ",".join(hits) if hits else ""
+        return '{"type":"players_update","seq":%d,"t":%.4f,"players":[%s]%s}' % (seq, server_time, ",".join(players), hits)
+
+    def delta(self, seq, base, server_time, left, names, joined, changed, hits=()):
+        parts = ['{"type":"players_delta","seq":%d,"base":%d,"t":%.4f' % (seq, base, server_time)]
+        if left:
+            parts.append(',"left":%s' % encode_message([nick for nick, _ in left]))
+        if joined:
+            parts.append(',"joined":[%s]' % ",".join(joined))
+        if changed:
+            parts.append(',"changed":[%s]' % ",".join(changed))
+        if hits:
+            parts.append(',"hits":[%s]' % ",".join(hits))
+        parts.append("}")
+        return "".join(parts)
+
+class BinaryCodec:
+    name = "binary"
+    subprotocol = SUBPROTOCOL_BINARY
+    binary = True
+    uses_ids = True
+
+    def decode(self, raw):
+        # Turns a binary frame into the same dict shape the JSON protocol produces.
+        if isinstance(raw, str):
+            return decode_message(raw)
+        try:
+            msg_type = raw[0]
+            if msg_type == MSG_PING:
+                return {"type": "ping"}
+            if msg_type == MSG_RESYNC:
+                return {"type": "resync"}
+            if msg_type == MSG_PONG:
+                return {"type": "pong", "id": PING_FRAME.unpack_from(raw, 0)[1]}
+            if msg_type == MSG_JOIN:
+                _, version = JOIN_HEADER.unpack_from(raw, 0)
+                if version != PROTOCOL_VERSION:
+                    raise ValueError(f"Unsupported protocol version {version}")
+                data, offset = unpack_player(raw, JOIN_HEADER.size)
+                data["view_width"], data["view_height"] = VIEW_SIZE.unpack_from(raw, offset)
+                offset += VIEW_SIZE.size
+                (length,) = U8.unpack_from(raw, offset)
+                data["nickname"] = bytes(raw[offset + 1:offset + 1 + length]).decode("utf-8")
+                data["type"] = "join"
+                return data
+            if msg_type == MSG_UPDATE:
+                data, _ = unpack_player(raw, UPDATE_HEADER.size)
+                data["type"] = "update"
+            elif msg_type == MSG_ACTION:
+                _, action = ACTION_HEADER.unpack_from(raw, 0)
+                data, _ = unpack_player(raw, ACTION_HEADER.size)
+                data["type"] = "action"
+                data["action"] = ACTIONS[action] if action < len(ACTIONS) else None
+            else:
+                raise ValueError(f"Unknown binary message type {msg_type}")
+            return data
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Malformed binary message: {e}")
+
+    def player_fragment(self, nick, player_id, info):
+        return U16.pack(player_id) + pack_player(info)
+
+    def changes_fragment(self, nick, player_id, fields):
+        return U16.pack(player_id) + pack_changes(fields)
+
+    def name_fragment(self, player_id, nick):
+        return pack_name(player_id, nick)
+
+    def hit_fragment(self, attacker_nick, attacker_id, target_nick, target_id):
+        return HIT_RECORD.pack(attacker_id, target_id)
+
+    def ping(self, ping_id):
+        return PING_FRAME.pack(MSG_PING, ping_id)
+
+    def _hits(self, hits):
+        # Optional trailing section, so frames without hits are unchanged on the wire.
+        return [U16.pack(len(hits)), *hits] if hits else []
+
+    def keyframe(self, seq, server_time, names, players, hits=()):
+        return b"".join([
+            KEYFRAME_HEADER.pack(MSG_KEYFRAME, seq, server_time),
+            U16.pack(len(names)), *names,
+            U16.pack(len(players)), *players,
+            *self._hits(hits),
+        ])
+
+    def delta(self, seq, base, server_time, left, names, joined, changed, hits=()):
+        # Left comes first so a reused id is released before it joins again.
+        return b"".join([
+            DELTA_HEADER.pack(MSG_DELTA, seq, base, server_time),
+            U16.pack(len(left)), *(U16.pack(player_id) for _, player_id in left),
+            U16.pack(len(names)), *names,
+            U16.pack(len(joined)), *joined,
+            U16.pack(len(changed)), *changed,
+            *self._hits(hits),
+        ])
+
+    def encode_client(self, data):
+        # Client-side encoder for join/update/action/ping/resync dicts (used by headless clients).
+        msg_type = data.get("type")
+        if msg_type == "ping":
+            return U8.pack(MSG_PING)
+        if msg_type == "resync":
+            return U8.pack(MSG_RESYNC)
+        if msg_type == "pong":
+            return PING_FRAME.pack(MSG_PONG, data["id"])
+        if msg_type == "join":
+            raw = data.get("nickname", "").encode("utf-8")[:255]
+            return b"".join([
+                JOIN_HEADER.pack(MSG_JOIN, PROTOCOL_VERSION),
+                pack_player(data),
+                VIEW_SIZE.pack(data.get("view_width", 800), data.get("view_height", 600)),
+                U8.pack(len(raw)), raw,
+            ])
+        if msg_type == "update":
+            return UPDATE_HEADER.pack(MSG_UPDATE) + pack_player(data)
+        if msg_type == "action":
+            return ACTION_HEADER.pack(MSG_ACTION, ACTION_CODES.get(data.get("action"), 0)) + pack_player(data)
+        raise ValueError(f"Cannot encode message type {msg_type}")
+
+    def decode_server(self, raw, names):
+        # Client-side decoder; names maps player id -> nickname and is updated in place.
+        # Returns the same dict shape as the JSON players_update/players_delta messages.
+        msg_type = raw[0]
+        if msg_type == MSG_PING:
+            return {"type": "ping", "id": PING_FRAME.unpack_from(raw, 0)[1]}
+        if msg_type == MSG_KEYFRAME:
+            _, seq, server_time = KEYFRAME_HEADER.unpack_from(raw, 0)
+            offset = self._read_names(raw, KEYFRAME_HEADER.size, names)
+            players, offset = self._read_players(raw, offset, names)
+            return {"type": "players_update", "seq": seq, "t": server_time, "players": players,
+                    "hits": self._read_hits(raw, offset, names)}
+        if msg_type == MSG_DELTA:
+            _, seq, base, server_time = DELTA_HEADER.unpack_from(raw, 0)
+            offset = DELTA_HEADER.size
+            (count,) = U16.unpack_from(raw, offset)
+            offset += U16.size
+            left = []
+            for _ in range(count):
+                (player_id,) = U16.unpack_from(raw, offset)
+                offset += U16.size
+                left.append(names.get(player_id))
+            offset = self._read_names(raw, offset, names)
+            joined, offset = self._read_players(raw, offset, names)
+            (count,) = U16.unpack_from(raw, offset)
+            offset += U16.size
+            changed = []
+            for _ in range(count):
+                (player_id,) = U16.unpack_from(raw, offset)
+                fields, offset = unpack_changes(raw, offset + U16.size)
+                fields["nickname"] = names.get(player_id)
+                changed.append(fields)
+            return {"type": "players_delta", "seq": seq, "base": base, "t": server_time,
+                    "left": left, "joined": joined, "changed": changed, "hits": self._read_hits(raw, offset, names)}
+        raise ValueError(f"Unknown binary message type {msg_type}")
+
+    def _read_names(self, raw, offset, names):
+        (count,) = U16.unpack_from(raw, offset)
+        offset += U16.size
+        for _ in range(count):
+            (player_id,) = U16.unpack_from(raw, offset)
+            (length,) = U8.unpack_from(raw, offset + U16.size)
+            start = offset + U16.size + 1
+            names[player_id] = bytes(raw[start:start + length]).decode("utf-8")
+            offset = start + length
+        return offset
+
+    def _read_players(self, raw, offset, names):
+        (count,) = U16.unpack_from(raw, offset)
+        offset += U16.size
+        players = []
+        for _ in range(count):
+            (player_id,) = U16.unpack_from(raw, offset)
+            player, offset = unpack_player(raw, offset + U16.size)
+            player["nickname"] = names.get(player_id)
+            players.append(player)
+        return players, offset
+
+    def _read_hits(self, raw, offset, names):
+        if offset >= len(raw):
+            return []
+        (count,) = U16.unpack_from(raw, offset)
+        offset += U16.size
+        hits = []
+        for _ in range(count):
+            attacker, target = HIT_RECORD.unpack_from(raw, offset)
+            offset += HIT_RECORD.size
+            hits.append([names.get(attacker), names.get(target)])
+        return hits
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {codec.subprotocol: codec for codec in (BINARY_CODEC, JSON_CODEC)}
+
+def peek_server_time(raw):
+    # Cheap read of the snapshot timestamp without decoding the whole frame.
+    if isinstance(raw, str):
+        start = raw.find('"t":')
+        if start < 0:
+            return None
+        end = start + 4
+        while raw[end] not in ",}":
+            end += 1
+        return float(raw[start + 4:end])
+    if raw[0] == MSG_KEYFRAME:
+        return KEYFRAME_HEADER.unpack_from(raw, 0)[2]
+    if raw[0] == MSG_DELTA:
+        return DELTA_HEADER.unpack_from(raw, 0)[3]
+    return None
+
+def negotiate(offered):
+    # Pick the first codec we support in server preference order (binary, then JSON).
+    for subprotocol, codec in CODECS.items():
+        if subprotocol in offered:
+            return codec, subprotocol
+    return JSON_CODEC, None
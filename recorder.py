@@ -0,0 +1,105 @@
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+
+# Append-only session log: a magic header, then records of
+#   kind (u8), seconds since the recording started (f64), connection id (u32), payload length (u32), payload.
+# A sidecar "<path>.idx" holds (time, offset) pairs about once per INDEX_INTERVAL so readers can seek.
+MAGIC = b"PYGREC\x01\n"
+RECORD_HEADER = struct.Struct("<BdII")
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_INTERVAL = 1.0
+
+OPEN = 1  # payload: negotiated subprotocol, empty for the JSON fallback
+TEXT = 2  # payload: inbound text message, UTF-8
+BYTES = 3  # payload: inbound binary message
+CLOSE = 4
+TICK = 5  # payload: room name length (u8), room name, binary keyframe of every player in the room
+KIND_NAMES = {OPEN: "open", TEXT: "text", BYTES: "bytes", CLOSE: "close", TICK: "tick"}
+
+class Recorder:
+    # Writes go through the file buffer on the event loop thread; nothing here awaits.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.index = open(path + ".idx", "wb")
+        self.started = time.perf_counter()
+        self.next_index = 0
+        self.next_conn = 0
+        self.records = 0
+
+    def _write(self, kind, conn, payload):
+        if self.file.closed:
+            return  # connections still winding down after shutdown closed the log
+        now = time.perf_counter() - self.started
+        if now >= self.next_index:
+            self.index.write(INDEX_ENTRY.pack(now, self.file.tell()))
+            self.next_index = now + INDEX_INTERVAL
+        self.file.write(RECORD_HEADER.pack(kind, now, conn, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def open(self, subprotocol):
+        # Returns the id later records of this connection refer to.
+        self.next_conn += 1
+        self._write(OPEN, self.next_conn, (subprotocol or "").encode())
+        return self.next_conn
+
+    def message(self, conn, raw):
+        if isinstance(raw, str):
+            self._write(TEXT, conn, raw.encode())
+        else:
+            self._write(BYTES, conn, raw)
+
+    def close_connection(self, conn):
+        self._write(CLOSE, conn, b"")
+
+    def tick(self, room, keyframe):
+        name = room.encode()[:255]
+        self._write(TICK, 0, bytes([len(name)]) + name + keyframe)
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+class LogReader:
+    # Memory-maps a recording; records() yields (kind, time, connection id, payload bytes).
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a session recording")
+        self.index_times = []
+        self.index_offsets = []
+        if os.path.exists(path + ".idx"):
+            with open(path + ".idx", "rb") as f:
+                raw = f.read()
+            for t, offset in INDEX_ENTRY.iter_unpack(raw[:len(raw) - len(raw) % INDEX_ENTRY.size]):
+                self.index_times.append(t)
+                self.index_offsets.append(offset)
+
+    def records(self, offset=None):
+        data = self.data
+        offset = len(MAGIC) if offset is None else offset
+        end = len(data)
+        while offset + RECORD_HEADER.size <= end:
+            kind, t, conn, length = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > end:
+                break  # cut short by a crash mid-write
+            yield kind, t, conn, data[start:start + length]
+            offset = start + length
+
+    def seek(self, t):
+        # Offset of an indexed record at or before time t.
+        i = bisect_right(self.index_times, t) - 1
+        return self.index_offsets[i] if i >= 0 else len(MAGIC)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import websockets
+
+from bot import BotStats
+from protocol import BINARY_CODEC, MSG_PONG, SUBPROTOCOL_BINARY, decode_message, encode_message, peek_server_time
+from recorder import BYTES, CLOSE, KIND_NAMES, OPEN, TEXT, TICK, LogReader
+
+class ReplayConnection:
+    # One recorded client: sends what it sent, drains what the server sends back and answers
+    # the server's pings itself, since the recorded pongs belong to the original session.
+    def __init__(self, url, subprotocol, stats):
+        self.url = url
+        self.subprotocol = subprotocol
+        self.binary = subprotocol == SUBPROTOCOL_BINARY
+        self.stats = stats
+        self.ws = None
+        self.receiver = None
+
+    async def open(self):
+        subprotocols = [self.subprotocol] if self.subprotocol else None
+        self.ws = await websockets.connect(self.url, subprotocols=subprotocols, max_size=None)
+        self.receiver = asyncio.create_task(self.receive_loop())
+
+    async def send(self, payload):
+        await self.ws.send(payload)
+        self.stats.messages_out += 1
+        self.stats.bytes_out += len(payload)
+
+    async def receive_loop(self):
+        try:
+            async for raw in self.ws:
+                received = time.time()
+                self.stats.messages_in += 1
+                self.stats.bytes_in += len(raw) if isinstance(raw, bytes) else len(raw.encode())
+                server_time = peek_server_time(raw)
+                if server_time is not None:
+                    self.stats.latencies.append(received - server_time)
+                    continue
+                try:
+                    data = BINARY_CODEC.decode_server(raw, {}) if isinstance(raw, bytes) else decode_message(raw)
+                except Exception:
+                    self.stats.errors += 1
+                    continue
+                if data.get("type") == "ping":
+                    pong = {"type": "pong", "id": data["id"]}
+                    await self.send(BINARY_CODEC.encode_client(pong) if self.binary else encode_message(pong))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await self.ws.close()
+        self.receiver.cancel()
+
+def is_pong(kind, payload):
+    if kind == BYTES:
+        return payload[:1] == bytes([MSG_PONG])
+    return b'"pong"' in payload and decode_message(payload).get("type") == "pong"
+
+async def replay(url, reader, speed=1.0, stats=None):
+    # Plays the recorded connections against the server at `speed` times the original pace
+    # (0 for as fast as possible) and returns their merged BotStats.
+    stats = stats or BotStats()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    connections = {}
+    try:
+        for kind, t, conn, payload in reader.records():
+            if kind == TICK:
+                continue
+            if speed:
+                delay = started + t / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                if kind == OPEN:
+                    connection = connections[conn] = ReplayConnection(url, payload.decode() or None, stats)
+                    await connection.open()
+                elif kind in (TEXT, BYTES):
+                    connection = connections.get(conn)
+                    if connection and not is_pong(kind, payload):
+                        await connection.send(payload.decode() if kind == TEXT else payload)
+                elif kind == CLOSE:
+                    connection = connections.pop(conn, None)
+                    if connection:
+                        await connection.close()
+            except (OSError, websockets.WebSocketException) as e:
+                stats.errors += 1
+                connections.pop(conn, None)
+                print(f"Replayed connection {conn} failed: {e}")
+    finally:
+        for connection in connections.values():
+            await connection.close()
+    return stats
+
+def describe(reader):
+    kinds = Counter()
+    rooms = Counter()
+    payload_bytes = Counter()
+    last = 0
+    for kind, t, conn, payload in reader.records():
+        kinds[kind] += 1
+        payload_bytes[kind] += len(payload)
+        if kind == TICK:
+            rooms[bytes(payload[1:1 + payload[0]]).decode()] += 1
+        last = t
+    print(f"{reader.path}: {last:.1f}s, {len(reader.index_times)} index entries")
+    for kind, count in sorted(kinds.items()):
+        print(f"  {KIND_NAMES.get(kind, kind)}: {count} records, {payload_bytes[kind]} payload bytes")
+    for room, count in rooms.most_common():
+        print(f"  room {room}: {count} ticks")
+
+def show_state(reader, at, room=None):
+    # Prints the last recorded snapshot of each room at or before `at` seconds into the session.
+    states = {}
+    for kind, t, conn, payload in reader.records(reader.seek(at)):
+        if t > at:
+            break
+        if kind != TICK:
+            continue
+        name = bytes(payload[1:1 + payload[0]]).decode()
+        if room is None or name == room:
+            states[name] = (t, payload[1 + payload[0]:])
+    for name, (t, keyframe) in sorted(states.items()):
+        snapshot = BINARY_CODEC.decode_server(keyframe, {})
+        print(f"room {name} at {t:.3f}s, seq {snapshot['seq']}, {len(snapshot['players'])} players")
+        for player in snapshot["players"]:
+            print(f"  {player['nickname']}: ({player['x']:.1f}, {player['y']:.1f}) {player['state']} {player['direction']}")
+        for attacker, target in snapshot["hits"]:
+            print(f"  hit: {attacker} -> {target}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a session recording or replay it against a server.")
+    parser.add_argument("log", help="recording written with RECORD_PATH")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="summarize the recording")
+    state = commands.add_parser("state", help="print the recorded room state at a point in time")
+    state.add_argument("--at", type=float, required=True, help="seconds since the recording started")
+    state.add_argument("--room")
+    run = commands.add_parser("run", help="replay the recorded clients against a server")
+    run.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    run.add_argument("--speed", type=float, default=1.0, help="multiple of the original pace, 0 for no pacing")
+    args = parser.parse_args()
+    reader = LogReader(args.log)
+    try:
+        if args.command == "info":
+            describe(reader)
+        elif args.command == "state":
+            show_state(reader, args.at, args.room)
+        else:
+            started = time.time()
+            stats = asyncio.run(replay(args.url, reader, args.speed))
+            print(f"replayed in {time.time() - started:.1f}s: sent {stats.messages_out} messages ({stats.bytes_out} bytes), "
+                  f"received {stats.messages_in} messages ({stats.bytes_in} bytes), errors {stats.errors}")
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,22 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+import math
+import os
+import time
+import uuid
+import zlib
+
+from broker import make_broker
+from combat import resolve_attacks
+from metrics import Registry, SamplingProfiler
+from protocol import BINARY_CODEC, FIELD_BITS, decode_message, encode_message, negotiate
+from recorder import Recorder
+from simulation import DODGE, SIM_RATE, EntityBatch
+from spatial import SpatialHash
+from state_store import PlayerStore, valid_player
 
 app = FastAPI()
 
@@ -12,34 +27,796 @@ def debug_print(*args, **kwargs):
     if DEBUG:
         print(*args, **kwargs)
 
-connections = {}  # nickname -> websocket
-players_data = {}  # nickname -> player info dict
+rooms = {}  # name -> Room
 
 empty_msg_count = 0
 MAX_EMPTY_MSGS = 5
+KNOWN_MESSAGE_TYPES = {"ping", "pong", "resync", "join", "update", "action"}
+PLAYER_MESSAGE_TYPES = {"join", "update", "action"}  # carry player fields, checked by valid_player
+
+TICK_RATE = int(os.environ.get("TICK_RATE", 20))  # snapshots per second
+KEYFRAME_INTERVAL = int(os.environ.get("KEYFRAME_INTERVAL", TICK_RATE * 5))  # full resync every ~5s
+
+# Players are sharded into rooms, each with its own store, connections and tick loop. A join may
+# name its room; otherwise, with ZONE_SIZE set, the room is the world region the player stands in
+# and follows them as they move.
+DEFAULT_ROOM = "lobby"
+MAX_ROOM_NAME = 64
+# Room names come from clients and every room runs a tick task, so joins that would open a room
+# past this many are refused
+MAX_ROOMS = int(os.environ.get("MAX_ROOMS", 256))
+ZONE_SIZE = int(os.environ.get("ZONE_SIZE", 0))
+ROOM_IDLE_TIMEOUT = float(os.environ.get("ROOM_IDLE_TIMEOUT", 30))  # seconds an empty room lingers
+WORLD_WIDTH = int(os.environ.get("WORLD_WIDTH", 1000))
+WORLD_HEIGHT = int(os.environ.get("WORLD_HEIGHT", 1000))
+
+# Every room can hold server-driven NPCs, simulated together by simulation.EntityBatch while
+# players are present. NPC state is not shared over the broker, so with BROKER_URL set each
+# worker would run a different set under the same nicknames; NPCs are turned off then.
+NPCS_PER_ROOM = int(os.environ.get("NPCS_PER_ROOM", 0))
+NPC_PREFIX = "npc:"  # reserved: players cannot join under a nickname starting with this
+MAX_NICKNAME = 32  # characters; the binary protocol carries at most 255 bytes of UTF-8
+
+# Clients only receive players inside their viewport plus this margin. The margin is at least
+# half the default viewport so cameras clamped at the world edge are still covered.
+DEFAULT_VIEW_WIDTH = 800
+DEFAULT_VIEW_HEIGHT = 600
+# Viewports come from the client and bound every interest query, so they are clamped
+MAX_VIEW_WIDTH = DEFAULT_VIEW_WIDTH * 4
+MAX_VIEW_HEIGHT = DEFAULT_VIEW_HEIGHT * 4
+INTEREST_MARGIN = int(os.environ.get("INTEREST_MARGIN", 400))
+GRID_CELL_SIZE = int(os.environ.get("GRID_CELL_SIZE", 256))
+
+# With a broker, several worker processes (uvicorn --workers N) share one world: each room
+# publishes the players it owns every tick and mirrors the other workers' players in that room.
+# Attacks are resolved on the attacker's worker, which publishes the hits alongside.
+BROKER_URL = os.environ.get("BROKER_URL", "")
+BROKER_HEARTBEAT = 1.0  # seconds between publishes when nothing changed
+BROKER_TIMEOUT = float(os.environ.get("BROKER_TIMEOUT", 5))  # drop a silent worker's players after this
+WORKER_ID = uuid.uuid4().hex[:12]
+broker = make_broker(BROKER_URL)
+if broker and NPCS_PER_ROOM:
+    print("NPCS_PER_ROOM is ignored with BROKER_URL set: NPCs are not shared between workers.")
+    NPCS_PER_ROOM = 0
+worker_seen = {}  # worker id -> loop time of its last message
+
+# Appends every inbound message and every room snapshot to a session log for replay.py; with
+# several workers put {worker} in the path so each writes its own file.
+RECORD_PATH = os.environ.get("RECORD_PATH", "")
+recorder = None
+
+# Required by /metrics and /debug endpoints for non-loopback clients. Behind a reverse proxy every
+# request comes from loopback, so proxied requests always need the token.
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN")
+FORWARDING_HEADERS = ("forwarded", "x-forwarded-for", "x-real-ip")
+
+registry = Registry()
+messages_in = registry.counter("game_messages_in_total", "Messages received from clients.", ("type",))
+messages_out = registry.counter("game_messages_out_total", "Snapshot frames sent to clients.", ("type",))
+bytes_in = registry.counter("game_bytes_in_total", "Payload bytes received from clients.")
+bytes_out = registry.counter("game_bytes_out_total", "Payload bytes sent to clients.")
+snapshots_dropped = registry.counter("game_snapshots_dropped_total", "Snapshots discarded from full send queues.")
+serialize_seconds = registry.histogram("game_serialize_seconds", "Time to build and encode one client frame.")
+tick_seconds = registry.histogram("game_tick_seconds", "Time to take a snapshot and queue it for every client.")
+rtt_seconds = registry.histogram(
+    "game_rtt_seconds", "Ping round trip time to clients.", buckets=(0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+combat_seconds = registry.histogram("game_combat_seconds", "Time to resolve one tick's attacks.")
+hits_total = registry.counter("game_hits_total", "Attacks that landed.")
+fanout_seconds = registry.histogram("game_fanout_seconds", "Time from snapshot creation until every client has written it.")
+registry.gauge("game_rooms", "Rooms open on this worker.", callback=lambda: {(): len(rooms)})
+registry.gauge(
+    "game_connected_players", "Players currently joined.", ("room",),
+    callback=lambda: {(name,): len(room.connections) for name, room in rooms.items()},
+)
+registry.gauge(
+    "game_remote_players", "Players mirrored from other workers.", ("room",),
+    callback=lambda: {(name,): len(room.remote_owners) for name, room in rooms.items()},
+)
+registry.gauge(
+    "game_send_level", "Clients on each adaptive send level.", ("room", "level"),
+    callback=lambda: {
+        (name, str(level)): sum(conn.level == level for conn in room.connections.values())
+        for name, room in rooms.items() for level in range(len(SEND_LEVELS))
+    },
+)
+# Per room rather than per client: nicknames are chosen by players and would make the label set unbounded
+registry.gauge(
+    "game_send_queued", "Snapshots waiting in the send queues of a room's clients.", ("room",),
+    callback=lambda: {(name,): sum(conn.queue.qsize() for conn in room.connections.values()) for name, room in rooms.items()},
+)
+registry.gauge(
+    "game_send_queue_depth_max", "Longest send queue among a room's clients.", ("room",),
+    callback=lambda: {
+        (name,): max((conn.queue.qsize() for conn in room.connections.values()), default=0) for name, room in rooms.items()
+    },
+)
+profiler = SamplingProfiler()
+
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", 4))  # outbound messages buffered per client
+MAX_BEHIND_TICKS = int(os.environ.get("MAX_BEHIND_TICKS", TICK_RATE * 3))  # disconnect after ~3s of backlog
+CLOSE_TIMEOUT = 1.0
+
+# The server pings each client it is sending to and keeps a smoothed RTT and jitter (RFC 6298
+# style). Clients on slow or congested links drop to a send level with fewer snapshots and, at
+# the bottom, fewer fields; a client whose send queue backs up drops a level straight away.
+ADAPTIVE_RATE = os.environ.get("ADAPTIVE_RATE", "1") != "0"
+PING_INTERVAL = float(os.environ.get("PING_INTERVAL", 1.0))
+PING_TIMEOUT = 5.0  # an unanswered ping counts as lost after this long
+SEND_LEVELS = [(1, True), (2, True), (4, False)]  # (send every Nth snapshot, full detail)
+LEVEL_RTT_LIMITS = [0.15, 0.3]  # RTT + 2 * jitter, in seconds, beyond which a client drops past each level
+ALL_FIELDS = sum(FIELD_BITS.values())
+# Enough to draw a player; remote animation clocks and afterimages are left out
+LOW_DETAIL_FIELDS = ALL_FIELDS & ~(FIELD_BITS["current_time"] | FIELD_BITS["afterimages"])
+
+class ClientConnection:
+    def __init__(self, websocket, codec):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.behind_ticks = 0  # consecutive ticks where the previous message was still queued
+        self.dropped = 0
+        self.sent_seq = None  # seq of the last frame written to the socket, the base of the next delta
+        self.needs_keyframe = True
+        self.nickname = None
+        self.room = None
+        self.zoned = False  # room chosen by position, so it changes as the player moves
+        self.slot = None
+        self.view_width = DEFAULT_VIEW_WIDTH
+        self.view_height = DEFAULT_VIEW_HEIGHT
+        self.visible = {}  # slot -> nickname for everything the client currently holds
+        self.named = {}  # slot -> nickname the client has been told about
+        self.missed = []  # (seq, change masks, hits) of snapshots skipped or dropped since the last frame
+        self.owed = False  # missed changes that no queued snapshot carries yet
+        self.rtt = None  # smoothed round trip time in seconds, None until the first pong
+        self.jitter = 0  # smoothed deviation of the round trip time
+        self.ping_id = 0
+        self.ping_sent = None  # perf_counter time of the outstanding ping
+        self.last_ping = 0
+        self.level = 0  # index into SEND_LEVELS
+        self.closed = False
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, snapshot):
+        if self.closed:
+            return
+        if self.queue.empty():
+            self.behind_ticks = 0
+        else:
+            self.behind_ticks += 1
+            if self.behind_ticks > MAX_BEHIND_TICKS:
+                print(f"{self.websocket.client} is too far behind ({self.queue.qsize()} queued), disconnecting.")
+                asyncio.create_task(self.close())
+                return
+            if self.behind_ticks >= 2:
+                self.set_level(self.level + 1)
+        every, _ = SEND_LEVELS[self.level]
+        if snapshot.seq % every and not snapshot.is_keyframe and not self.needs_keyframe:
+            self.miss(snapshot)
+            return
+        if self.queue.full():
+            # Snapshots supersede each other, so the stalest one is the cheapest to lose.
+            stale = self.queue.get_nowait()
+            self.miss(stale)
+            stale.finish()
+            self.dropped += 1
+            snapshots_dropped.inc()
+        snapshot.pending += 1
+        self.queue.put_nowait(snapshot)
+        self.owed = False  # its frame folds in everything missed before it
+
+    def miss(self, snapshot):
+        # Carry what changed in a snapshot this client never gets into a later delta.
+        self.missed.append((snapshot.seq, snapshot.frame.change_masks, snapshot.hits))
+        self.owed = True
+
+    def take_missed(self, seq):
+        # Folded masks and hits of the missed snapshots older than seq. A skipped snapshot can be
+        # newer than one still queued; its changes wait for a frame that carries their values.
+        masks = {}
+        hits = []
+        kept = []
+        for missed_seq, change_masks, missed_hits in self.missed:
+            if missed_seq > seq:
+                kept.append((missed_seq, change_masks, missed_hits))
+                continue
+            for slot, mask in change_masks.items():
+                masks[slot] = masks.get(slot, 0) | mask
+            hits.extend(missed_hits)
+        self.missed = kept
+        return masks, hits
+
+    def set_level(self, level):
+        level = max(0, min(len(SEND_LEVELS) - 1, level))
+        if not ADAPTIVE_RATE or level == self.level:
+            return
+        if SEND_LEVELS[level][1] != SEND_LEVELS[self.level][1]:
+            self.needs_keyframe = True  # the client's copy of the dropped fields is stale either way
+        debug_print(f"{self.nickname} moves to send level {level} (rtt {self.rtt}, jitter {self.jitter:.4f})")
+        self.level = level
+
+    def ping_due(self):
+        now = time.perf_counter()
+        if self.ping_sent is not None:
+            if now - self.ping_sent < PING_TIMEOUT:
+                return False
+            self.ping_sent = None
+            if self.rtt is not None:
+                self.set_level(self.level + 1)  # lost ping from a client that does answer
+        return now - self.last_ping >= PING_INTERVAL
+
+    def on_pong(self, ping_id):
+        if self.ping_sent is None or ping_id != self.ping_id:
+            return
+        sample = time.perf_counter() - self.ping_sent
+        self.ping_sent = None
+        rtt_seconds.observe(sample)
+        if self.rtt is None:
+            self.rtt = sample
+            self.jitter = sample / 2
+        else:
+            self.jitter += (abs(sample - self.rtt) - self.jitter) / 4
+            self.rtt += (sample - self.rtt) / 8
+        latency = self.rtt + 2 * self.jitter
+        target = sum(latency > limit for limit in LEVEL_RTT_LIMITS)
+        if target > self.level:
+            self.set_level(target)
+        elif target < self.level and latency < LEVEL_RTT_LIMITS[self.level - 1] * 0.8:
+            self.set_level(self.level - 1)  # climb back one level at a time, with some headroom
+
+    async def _send(self, frame):
+        if self.codec.binary:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+        bytes_out.inc(len(frame))
+
+    async def _writer(self):
+        try:
+            while True:
+                snapshot = await self.queue.get()
+                # Pings ride along with snapshot traffic: there is no rate to adapt while idle.
+                if self.ping_due():
+                    self.ping_id = (self.ping_id + 1) & 0xFFFFFFFF
+                    self.ping_sent = self.last_ping = time.perf_counter()
+                    await self._send(self.codec.ping(self.ping_id))
+                    messages_out.inc(1, "ping")
+                started = time.perf_counter()
+                kind, frame = snapshot.frame_for(self)
+                if frame is not None:
+                    serialize_seconds.observe(time.perf_counter() - started)
+                    await self._send(frame)
+                    messages_out.inc(1, kind)
+                    self.sent_seq = snapshot.seq
+                snapshot.finish()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Closing the socket ends the receive loop, whose cleanup takes the player out of the room.
+            print(f"Failed to send update to {self.nickname or self.websocket.client}, disconnecting: {e}")
+            asyncio.create_task(self.close())
+
+    async def close(self):
+        if self.closed and self.writer_task.done():
+            return
+        self.closed = True
+        self.writer_task.cancel()
+        while not self.queue.empty():
+            self.queue.get_nowait().finish()
+        try:
+            await asyncio.wait_for(self.websocket.close(), CLOSE_TIMEOUT)
+        except Exception as e:
+            debug_print(f"Error closing websocket: {e}")
+
+class Snapshot:
+    # Each player's record is encoded at most once per tick and codec; per-client frames
+    # are assembled from those shared fragments according to what the client can see.
+    def __init__(self, room, seq, frame, is_keyframe, hits=()):
+        self.room = room
+        self.seq = seq
+        self.time = time.time()
+        self.created = time.perf_counter()
+        self.pending = 0  # connections that still have this snapshot queued
+        self.frame = frame  # StoreFrame taken from the player store for this tick
+        self.is_keyframe = is_keyframe
+        self.hits = hits  # (attacker slot, target slot) resolved this tick
+        self._full = {}
+        self._changed = {}
+        self._hits = {}
+
+    def finish(self):
+        self.pending -= 1
+        if self.pending == 0:
+            fanout_seconds.observe(time.perf_counter() - self.created)
+
+    def full_fragment(self, codec, slot, full_detail=True):
+        key = (codec.name, slot, full_detail)
+        fragment = self._full.get(key)
+        if fragment is None:
+            frame = self.frame
+            record = frame.record(slot)
+            if not full_detail:
+                record["current_time"] = 0
+                record["afterimages"] = []
+            fragment = self._full[key] = codec.player_fragment(frame.nicknames[slot], slot, record)
+        return fragment
+
+    def changed_fragment(self, codec, slot, mask):
+        # Keyed by mask too: clients that skipped snapshots or get less detail need other fields.
+        key = (codec.name, slot, mask)
+        fragment = self._changed.get(key)
+        if fragment is None:
+            frame = self.frame
+            fragment = self._changed[key] = codec.changes_fragment(frame.nicknames[slot], slot, frame.changes(slot, mask))
+        return fragment
+
+    def hit_fragment(self, codec, hit):
+        key = (codec.name, hit)
+        fragment = self._hits.get(key)
+        if fragment is None:
+            attacker, target = hit
+            nicknames = self.frame.nicknames
+            fragment = self._hits[key] = codec.hit_fragment(nicknames[attacker], attacker, nicknames[target], target)
+        return fragment
+
+    def hits_for(self, conn, visible, missed_hits):
+        # Hits the client can see a side of; its own slot is not in visible.
+        hits = self.hits
+        if missed_hits:
+            frame = self.frame
+            hits = [hit for hit in missed_hits if hit[0] in frame and hit[1] in frame] + list(hits)
+        return [hit for hit in hits if hit[0] in visible or hit[1] in visible or conn.slot in hit]
+
+    def names_for(self, conn, slots):
+        # The binary protocol refers to players by id; nicknames go out once per client.
+        if not conn.codec.uses_ids:
+            return []
+        names = []
+        for slot in slots:
+            nick = self.frame.nicknames[slot]
+            if conn.named.get(slot) != nick:
+                conn.named[slot] = nick
+                names.append(self.room.name_fragment(slot, nick))
+        return names
+
+    def visible_to(self, conn):
+        frame = self.frame
+        slot = conn.slot
+        if conn.room is not self.room or slot is None or slot not in frame or frame.nicknames[slot] != conn.nickname:
+            return None
+        x = frame.columns["x"][slot]
+        y = frame.columns["y"][slot]
+        half_w = conn.view_width / 2 + INTEREST_MARGIN
+        half_h = conn.view_height / 2 + INTEREST_MARGIN
+        visible = self.room.player_index.query(x - half_w, y - half_h, x + half_w, y + half_h)
+        visible.discard(slot)
+        return {other: frame.nicknames[other] for other in visible if other in frame}
+
+    def frame_for(self, conn):
+        codec = conn.codec
+        visible = self.visible_to(conn)
+        if visible is None:
+            conn.needs_keyframe = True
+            return None, None
+        full_detail = SEND_LEVELS[conn.level][1]
+        # A delta applies on top of the last frame this client got; snapshots it skipped are
+        # folded in from conn.missed, so the delta still covers everything since then.
+        missed, missed_hits = conn.take_missed(self.seq)
+        if self.is_keyframe or conn.needs_keyframe or conn.sent_seq is None:
+            conn.needs_keyframe = False
+            conn.visible = visible
+            hits = self.hits_for(conn, visible, missed_hits)
+            names = self.names_for(conn, [*visible, *(slot for hit in hits for slot in hit)])
+            players = [self.full_fragment(codec, slot, full_detail) for slot in visible]
+            return "keyframe", codec.keyframe(self.seq, self.time, names, players, [self.hit_fragment(codec, hit) for hit in hits])
+        known = conn.visible
+        entered = [slot for slot, nick in visible.items() if known.get(slot) != nick]
+        left = [(nick, slot) for slot, nick in known.items() if visible.get(slot) != nick]
+        change_masks = self.frame.change_masks
+        fields = ALL_FIELDS if full_detail else LOW_DETAIL_FIELDS
+        changed = []
+        for slot, nick in visible.items():
+            if (slot in change_masks or slot in missed) and known.get(slot) == nick:
+                mask = (change_masks.get(slot, 0) | missed.get(slot, 0)) & fields
+                if mask:
+                    changed.append((slot, mask))
+        hits = self.hits_for(conn, visible, missed_hits)
+        if not entered and not left and not changed and not hits:
+            return None, None
+        conn.visible = visible
+        names = self.names_for(conn, [*entered, *(slot for hit in hits for slot in hit)])
+        return "delta", codec.delta(
+            self.seq,
+            conn.sent_seq,
+            self.time,
+            left,
+            names,
+            [self.full_fragment(codec, slot) for slot in entered],
+            [self.changed_fragment(codec, slot, mask) for slot, mask in changed],
+            [self.hit_fragment(codec, hit) for hit in hits],
+        )
+
+class Room:
+    # One shard of the world. Rooms share nothing but the event loop and the broker, so a busy
+    # room's snapshot and fan-out work never runs inside a quiet room's tick.
+    def __init__(self, name):
+        self.name = name
+        self.connections = {}  # nickname -> ClientConnection
+        self.players = PlayerStore()  # slot-indexed player state; the slot is also the binary protocol id
+        self.player_index = SpatialHash(GRID_CELL_SIZE)
+        self.name_fragments = {}  # slot -> (nickname, encoded id/nickname entry for the binary protocol)
+        self.remote_owners = {}  # nickname -> worker id, for players connected to other workers
+        self.outbox = set()  # local nicknames changed since the last publish
+        self.departed = []  # local nicknames that left since the last publish
+        self.last_publish = 0
+        self.snapshot_seq = 0
+        self.state_dirty = False  # set whenever player state changes, cleared by the tick
+        self.empty_since = None
+        self.tick_task = None
+        self.npcs = None  # EntityBatch
+        self.npc_slots = []  # store slot of each NPC, by entity index
+        self.npc_clock = 0  # simulation time owed to the NPCs, run in whole steps
+        self.pending_attacks = []  # (slot, nickname) of every attack since the last tick
+        self.outbox_hits = []  # [attacker, target] nicknames of hits resolved here since the last publish
+        self.remote_hits = []  # (attacker, target) nicknames of hits resolved on other workers
+
+    def start(self):
+        if NPCS_PER_ROOM:
+            self.spawn_npcs()
+        self.tick_task = asyncio.create_task(self.tick_loop())
+        if broker:
+            asyncio.create_task(self.announce())
+        debug_print(f"Room {self.name} opened.")
+
+    def join(self, client, nickname, data):
+        self.connections[nickname] = client
+        self.remote_owners.pop(nickname, None)
+        if broker:
+            self.outbox.add(nickname)
+        client.room = self
+        client.nickname = nickname
+        client.sent_seq = None
+        client.needs_keyframe = True
+        client.visible = {}
+        client.named = {}
+        client.missed = []
+        client.owed = False
+        slot = self.players.add(nickname, {"x": 100, "y": 100, **data})
+        client.slot = slot
+        self.player_index.update(slot, *self.players.position(slot))
+        self.empty_since = None
+        self.state_dirty = True
+
+    def update(self, client, data):
+        if self.connections.get(client.nickname) is not client:
+            return  # superseded by a newer connection with the same nickname
+        self.players.write(client.slot, data)
+        self.player_index.update(client.slot, data["x"], data["y"])
+        if broker:
+            self.outbox.add(client.nickname)
+        self.state_dirty = True
+
+    def leave(self, client):
+        nickname = client.nickname
+        if self.connections.get(nickname) is not client:
+            return
+        del self.connections[nickname]
+        if broker:
+            self.outbox.discard(nickname)
+            self.departed.append(nickname)
+        self.remove_player(nickname)
+        client.room = None
+        self.state_dirty = True
+
+    def remove_player(self, nickname):
+        slot = self.players.remove(nickname)
+        if slot is not None:
+            self.player_index.remove(slot)
+            self.name_fragments.pop(slot, None)
+
+    def name_fragment(self, slot, nickname):
+        # Checked against the nickname: a snapshot taken before a slot changed hands can still be
+        # in a slow client's queue and must not cache the old player's name for the new one.
+        cached = self.name_fragments.get(slot)
+        if cached is None or cached[0] != nickname:
+            cached = self.name_fragments[slot] = (nickname, BINARY_CODEC.name_fragment(slot, nickname))
+        return cached[1]
+
+    def spawn_npcs(self):
+        # Seeded by room name so a room reopens with the same NPCs.
+        self.npcs = EntityBatch(NPCS_PER_ROOM, WORLD_WIDTH, WORLD_HEIGHT, seed=zlib.crc32(self.name.encode()))
+        for i in range(NPCS_PER_ROOM):
+            slot = self.players.add(f"{NPC_PREFIX}{i}", self.npcs.record(i))
+            self.npc_slots.append(slot)
+            self.player_index.update(slot, *self.players.position(slot))
+
+    def step_npcs(self, elapsed):
+        npcs = self.npcs
+        self.npc_clock += elapsed
+        steps = int(self.npc_clock * SIM_RATE)
+        if not steps:
+            return
+        self.npc_clock -= steps / SIM_RATE
+        for _ in range(steps):
+            attacked, _ = npcs.step(1 / SIM_RATE, *npcs.choose_inputs(1 / SIM_RATE))
+            for i in attacked.nonzero()[0].tolist():
+                self.pending_attacks.append((self.npc_slots[i], f"{NPC_PREFIX}{i}"))
+        self.players.write_columns(self.npc_slots, {
+            "x": npcs.x,
+            "y": npcs.y,
+            "state": npcs.state,
+            "direction": npcs.direction,
+            "current_frame": npcs.current_frame,
+            "current_time": npcs.current_time,
+            "is_invulnerable": npcs.state == DODGE,
+        })
+        ghosts = npcs.afterimage_alive.any(axis=1).tolist()
+        for i, (slot, x, y) in enumerate(zip(self.npc_slots, npcs.x.tolist(), npcs.y.tolist())):
+            self.player_index.update(slot, x, y)
+            if ghosts[i] or self.players.afterimages[slot]:
+                self.players.write_afterimages(slot, npcs.afterimages(i))
+        self.state_dirty = True
+
+    def queue_attack(self, client):
+        self.pending_attacks.append((client.slot, client.nickname))
+
+    def resolve_attacks(self):
+        # All of a tick's swings are resolved together against current positions. Attacks by
+        # players that left or changed room since are dropped.
+        attackers = [slot for slot, nickname in self.pending_attacks if self.players.slot_of(nickname) == slot]
+        self.pending_attacks = []
+        started = time.perf_counter()
+        hits = resolve_attacks(attackers, self.players, self.player_index)
+        combat_seconds.observe(time.perf_counter() - started)
+        if hits:
+            hits_total.inc(len(hits))
+            if broker:
+                nicknames = self.players.nicknames
+                self.outbox_hits.extend([nicknames[attacker], nicknames[target]] for attacker, target in hits)
+        return hits
+
+    def take_remote_hits(self):
+        # Slots of the hits other workers published, for players still in this room.
+        slot_of = self.players.slot_of
+        hits = [(slot_of(attacker), slot_of(target)) for attacker, target in self.remote_hits]
+        self.remote_hits = []
+        return [hit for hit in hits if None not in hit]
+
+    def broadcast_snapshot(self, hits=()):
+        self.snapshot_seq += 1
+        seq = self.snapshot_seq
+        snapshot = Snapshot(self, seq, self.players.snapshot(), seq % KEYFRAME_INTERVAL == 0, hits)
+        for conn in list(self.connections.values()):
+            conn.enqueue(snapshot)
+        if recorder:
+            self.record(snapshot)
+
+    def record(self, snapshot):
+        # The whole room as one binary keyframe, built from the fragments binary clients share.
+        names = [self.name_fragment(slot, snapshot.frame.nicknames[slot]) for slot in snapshot.frame.active]
+        recorder.tick(self.name, BINARY_CODEC.keyframe(
+            snapshot.seq, snapshot.time, names,
+            [snapshot.full_fragment(BINARY_CODEC, slot) for slot in snapshot.frame.active],
+            [snapshot.hit_fragment(BINARY_CODEC, hit) for hit in snapshot.hits],
+        ))
+
+    async def tick_loop(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / TICK_RATE
+        next_tick = loop.time()
+        while True:
+            next_tick += interval
+            if self.npcs is not None and self.connections:
+                try:
+                    self.step_npcs(interval)
+                except Exception as e:
+                    print(f"Error simulating NPCs of room {self.name}: {e}")
+            hits = []
+            if self.pending_attacks:
+                try:
+                    hits = self.resolve_attacks()
+                except Exception as e:
+                    self.pending_attacks = []
+                    print(f"Error resolving attacks in room {self.name}: {e}")
+            if self.remote_hits:
+                hits = hits + self.take_remote_hits()
+            if broker:
+                try:
+                    await self.publish_local_state()
+                    self.expire_silent_workers()
+                except Exception as e:
+                    print(f"Error publishing room {self.name} to broker: {e}")
+            # Changes a client skipped are owed a later snapshot, even if nothing else moves. Once
+            # one is queued for it, a slow writer is no reason to keep broadcasting.
+            owed = any(conn.owed for conn in self.connections.values())
+            if self.state_dirty or hits or owed:
+                self.state_dirty = False
+                try:
+                    started = time.perf_counter()
+                    self.broadcast_snapshot(hits)
+                    tick_seconds.observe(time.perf_counter() - started)
+                except Exception as e:
+                    print(f"Error in tick loop of room {self.name}: {e}")
+            if self.connections:
+                self.empty_since = None
+            elif self.empty_since is None:
+                self.empty_since = loop.time()
+            elif loop.time() - self.empty_since > ROOM_IDLE_TIMEOUT:
+                # Torn down lazily so players hopping between rooms do not churn them.
+                if broker and self.departed:
+                    await self.publish_local_state()
+                rooms.pop(self.name, None)
+                debug_print(f"Room {self.name} closed after being empty for {ROOM_IDLE_TIMEOUT}s.")
+                return
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                debug_print(f"Tick of room {self.name} overran by {-delay:.4f}s")
+                next_tick = loop.time()
+
+    async def announce(self):
+        # Ask the other workers for everything they hold in this room.
+        self.outbox.update(self.connections)
+        await broker.publish(encode_message({"worker": WORKER_ID, "room": self.name, "hello": True}))
+
+    async def publish_local_state(self):
+        now = asyncio.get_running_loop().time()
+        if not self.outbox and not self.departed and not self.outbox_hits and now - self.last_publish < BROKER_HEARTBEAT:
+            return
+        changed = {}
+        for nickname in self.outbox:
+            conn = self.connections.get(nickname)
+            if conn is not None and conn.slot is not None:
+                changed[nickname] = self.players.record(conn.slot)
+        message = {"worker": WORKER_ID, "room": self.name, "players": changed, "left": self.departed}
+        if self.outbox_hits:
+            message["hits"] = self.outbox_hits
+            self.outbox_hits = []
+        self.outbox.clear()
+        self.departed = []
+        self.last_publish = now
+        await broker.publish(encode_message(message))
+
+    def expire_silent_workers(self):
+        now = asyncio.get_running_loop().time()
+        for nickname, worker in list(self.remote_owners.items()):
+            if now - worker_seen.get(worker, 0) > BROKER_TIMEOUT:
+                debug_print(f"Worker {worker} went silent, dropping {nickname} from room {self.name}.")
+                del self.remote_owners[nickname]
+                self.remove_player(nickname)
+                self.state_dirty = True
+
+    def apply_remote(self, worker, message):
+        if message.get("hello"):
+            # A worker opened this room: send it everything we own on the next tick.
+            self.outbox.update(self.connections)
+        for nickname, data in message.get("players", {}).items():
+            if nickname in self.connections:
+                continue  # the local connection owns this nickname
+            self.remote_owners[nickname] = worker
+            slot = self.players.add(nickname, data)
+            self.player_index.update(slot, *self.players.position(slot))
+            self.state_dirty = True
+        for nickname in message.get("left", []):
+            if self.remote_owners.get(nickname) == worker:
+                del self.remote_owners[nickname]
+                self.remove_player(nickname)
+                self.state_dirty = True
+        for attacker, target in message.get("hits", []):
+            # Merged into this worker's next snapshot, once the players above are applied
+            self.remote_hits.append((attacker, target))
+
+    async def close(self):
+        if self.tick_task:
+            self.tick_task.cancel()
+        local_nicknames = list(self.connections)
+        for conn in list(self.connections.values()):
+            await conn.close()
+        if broker and local_nicknames:
+            try:
+                await broker.publish(encode_message({"worker": WORKER_ID, "room": self.name, "left": local_nicknames}))
+            except Exception as e:
+                debug_print(f"Error announcing shutdown to broker: {e}")
+        self.connections.clear()
+        self.remote_owners.clear()
+        self.players.clear()
+
+def get_room(name):
+    # None when the room is not open and MAX_ROOMS are.
+    room = rooms.get(name)
+    if room is None:
+        if len(rooms) >= MAX_ROOMS:
+            return None
+        room = rooms[name] = Room(name)
+        room.start()
+    return room
+
+def view_size(value, default, limit):
+    # None for anything that is not a finite number.
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return max(1, min(limit, value))
+
+def zone_for(x, y):
+    return f"zone:{int(x) // ZONE_SIZE}:{int(y) // ZONE_SIZE}"
+
+def room_for_join(data):
+    name = data.get("room")
+    if isinstance(name, str) and 0 < len(name) <= MAX_ROOM_NAME:
+        return name, False
+    if ZONE_SIZE > 0:
+        return zone_for(data.get("x", 100), data.get("y", 100)), True
+    return DEFAULT_ROOM, False
+
+def on_broker_message(payload):
+    message = decode_message(payload)
+    worker = message.get("worker")
+    if worker == WORKER_ID:
+        return
+    worker_seen[worker] = asyncio.get_running_loop().time()
+    # Rooms without local players are not mirrored; opening one later says hello and catches up.
+    room = rooms.get(message.get("room"))
+    if room is not None:
+        room.apply_remote(worker, message)
+
+async def on_broker_connect():
+    for room in list(rooms.values()):
+        await room.announce()
 
 @app.get("/.well-known/appspecific/com.chrome.devtools.json")
 async def well_known_probe(request: Request):
     return {"status": "ok"}
 
+@app.on_event("startup")
+async def startup_event():
+    global recorder
+    if RECORD_PATH:
+        recorder = Recorder(RECORD_PATH.format(worker=WORKER_ID))
+        print(f"Recording session to {recorder.path}")
+    if broker:
+        await broker.start(on_broker_message, on_broker_connect)
+        print(f"Worker {WORKER_ID} joined the shared world via {BROKER_URL}.")
+    print(f"Rooms tick at {TICK_RATE} Hz.")
+    if NPCS_PER_ROOM:
+        print(f"Simulating {NPCS_PER_ROOM} NPCs per room at {SIM_RATE} Hz.")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down. Closing all websocket connections.")
-    for ws in list(connections.values()):
-        await ws.close()
-    connections.clear()
-    players_data.clear()
+    for room in list(rooms.values()):
+        await room.close()
+    rooms.clear()
+    if broker:
+        await broker.close()
+    if recorder:
+        recorder.close()
+        print(f"Recorded {recorder.records} records to {recorder.path}")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    client = ClientConnection(websocket, codec)
+    record_id = recorder.open(subprotocol) if recorder else None
     nickname = None
     empty_msg_count = 0
 
     try:
         while True:
             try:
-                data = await websocket.receive_json()
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                raw = message.get("bytes")
+                if raw is None:
+                    raw = message.get("text")
+                bytes_in.inc(len(raw))
+                if recorder:
+                    recorder.message(record_id, raw)
+                data = codec.decode(raw)
                 debug_print(f"Received raw data: {data}")
                 if not isinstance(data, dict) or not data:
                     empty_msg_count += 1
@@ -59,6 +836,8 @@ async def websocket_endpoint(websocket: WebSocket):
                     await websocket.close()
                     break
                 continue
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 print(f"Unexpected error receiving JSON: {e}")
                 break
@@ -67,67 +846,134 @@ async def websocket_endpoint(websocket: WebSocket):
             if not msg_type:
                 debug_print(f"Missing 'type' in message: {data}")
                 continue
+            messages_in.inc(1, msg_type if msg_type in KNOWN_MESSAGE_TYPES else "unknown")
 
-            if msg_type == "ping":
+            if msg_type in PLAYER_MESSAGE_TYPES and not valid_player(data):
+                debug_print(f"Dropping {msg_type} with invalid player fields from {nickname or websocket.client}: {data}")
                 continue
-            elif msg_type == "join":
-                nickname = data.get("nickname")
-                if nickname:
-                    connections[nickname] = websocket
-                    players_data[nickname] = {
-                        "x": data.get("x", 100),
-                        "y": data.get("y", 100),
-                        "state": data.get("state", "idle"),
-                        "direction": data.get("direction", "down"),
-                        "current_frame": data.get("current_frame", 0),
-                        "current_time": data.get("current_time", 0),
-                        "is_invulnerable": data.get("is_invulnerable", False),
-                        "afterimages": data.get("afterimages", [])
-                    }
-                    debug_print(f"{nickname} joined.")
-                else:
-                    debug_print("Join message missing 'nickname'")
-            elif msg_type == "update" or msg_type == "action":
-                if nickname:
-                    x = data.get("x")
-                    y = data.get("y")
-                    if x is not None and y is not None:
-                        players_data[nickname] = {
-                            "x": x,
-                            "y": y,
-                            "state": data.get("state", "idle"),
-                            "direction": data.get("direction", "down"),
-                            "current_frame": data.get("current_frame", 0),
-                            "current_time": data.get("current_time", 0),
-                            "is_invulnerable": data.get("is_invulnerable", False),
-                            "afterimages": data.get("afterimages", [])
-                        }
+
+            # One bad message must not take down this handler, and with it the player's room state
+            try:
+                if msg_type == "ping":
+                    continue
+                elif msg_type == "pong":
+                    client.on_pong(data.get("id"))
+                elif msg_type == "resync":
+                    client.needs_keyframe = True
+                    if client.room:
+                        client.room.state_dirty = True
+                elif msg_type == "join":
+                    # Numeric player fields were checked by valid_player above; the rest are checked here
+                    requested = data.get("nickname")
+                    view_width = view_size(data.get("view_width"), DEFAULT_VIEW_WIDTH, MAX_VIEW_WIDTH)
+                    view_height = view_size(data.get("view_height"), DEFAULT_VIEW_HEIGHT, MAX_VIEW_HEIGHT)
+                    if not isinstance(requested, str) or not 0 < len(requested) <= MAX_NICKNAME or requested.startswith(NPC_PREFIX):
+                        debug_print(f"Join message with a missing, invalid or reserved nickname: {requested!r}")
+                    elif view_width is None or view_height is None:
+                        debug_print(f"Join message with an invalid view size: {data.get('view_width')!r}x{data.get('view_height')!r}")
+                    else:
+                        room_name, zoned = room_for_join(data)
+                        room = get_room(room_name)
+                        if room is None:
+                            debug_print(f"Join to room {room_name!r} refused, {MAX_ROOMS} rooms are already open")
+                            continue
+                        if client.room:
+                            client.room.leave(client)
+                        nickname = requested
+                        client.view_width = view_width
+                        client.view_height = view_height
+                        client.zoned = zoned
+                        room.join(client, nickname, data)
+                        debug_print(f"{nickname} joined room {room_name}.")
+                elif msg_type == "update" or msg_type == "action":
+                    if client.room:
+                        x = data.get("x")
+                        y = data.get("y")
+                        if x is not None and y is not None:
+                            zone = None
+                            if client.zoned and zone_for(x, y) != client.room.name:
+                                # A zone that cannot open keeps the player in the room it is in
+                                zone = get_room(zone_for(x, y))
+                            if zone is not None:
+                                client.room.leave(client)
+                                zone.join(client, nickname, data)
+                            else:
+                                client.room.update(client, data)
+                            if msg_type == "action" and data.get("action") == "attack":
+                                client.room.queue_attack(client)
+                        else:
+                            debug_print(f"Update/action message missing position data: {data}")
                     else:
-                        debug_print(f"Update/action message missing position data: {data}")
-
-                    players_list = [{"nickname": nick, **info} for nick, info in players_data.items()]
-                    for conn in list(connections.values()):
-                        try:
-                            await conn.send_json({"type": "players_update", "players": players_list})
-                        except Exception as e:
-                            debug_print(f"Failed to send update to a client: {e}")
+                        debug_print("Received 'update' or 'action' message before 'join'")
                 else:
-                    debug_print("Received 'update' or 'action' message before 'join'")
-            else:
-                debug_print(f"Unknown message type: {msg_type}")
+                    debug_print(f"Unknown message type: {msg_type}")
+            except Exception as e:
+                print(f"Error handling {msg_type} from {nickname or websocket.client}: {e}")
 
     except WebSocketDisconnect:
         print(f"{nickname or websocket.client} disconnected.")
     finally:
-        if nickname:
-            connections.pop(nickname, None)
-            players_data.pop(nickname, None)
-            players_list = [{"nickname": nick, **info} for nick, info in players_data.items()]
-            for conn in list(connections.values()):
-                try:
-                    await conn.send_json({"type": "players_update", "players": players_list})
-                except Exception as e:
-                    debug_print(f"Failed to send update to a client: {e}")
+        await client.close()
+        if client.room:
+            client.room.leave(client)
+        if recorder:
+            recorder.close_connection(record_id)
+
+def debug_allowed(request, token):
+    if DEBUG_TOKEN:
+        return token == DEBUG_TOKEN
+    if any(header in request.headers for header in FORWARDING_HEADERS):
+        return False
+    return request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost")
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request, token: str = None):
+    # Prometheus can pass the token as a scrape param
+    if not debug_allowed(request, token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/clients")
+async def client_status(request: Request, token: str = None):
+    # Link quality per connection: what the adaptive send rate is working from.
+    if not debug_allowed(request, token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return {
+        name: {
+            nick: {
+                "rtt_ms": conn.rtt * 1000 if conn.rtt is not None else None,
+                "jitter_ms": conn.jitter * 1000,
+                "level": conn.level,
+                "queued": conn.queue.qsize(),
+                "dropped": conn.dropped,
+            }
+            for nick, conn in room.connections.items()
+        }
+        for name, room in rooms.items()
+    }
+
+@app.get("/debug/profiler")
+async def profiler_status(request: Request, token: str = None):
+    if not debug_allowed(request, token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return {"running": profiler.running, "samples": profiler.samples, "interval": profiler.interval}
+
+@app.post("/debug/profiler/start")
+async def profiler_start(request: Request, interval_ms: float = 5, token: str = None):
+    if not debug_allowed(request, token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    profiler.start(interval_ms / 1000)
+    print(f"Sampling profiler started ({interval_ms}ms interval).")
+    return {"running": True}
+
+@app.post("/debug/profiler/stop")
+async def profiler_stop(request: Request, token: str = None):
+    # Returns folded stacks ("a;b;c count" per line), ready for flamegraph tools.
+    if not debug_allowed(request, token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    folded = profiler.stop()
+    print(f"Sampling profiler stopped after {profiler.samples} samples.")
+    return PlainTextResponse(folded)
 
 @app.get("/")
 async def root():
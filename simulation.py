@@ -0,0 +1,211 @@
+import argparse
+import random
+
+from protocol import DIRECTIONS, DIRECTION_CODES, STATES, STATE_CODES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Movement and combat tuning mirrors frontend/static/main.py; speeds are pixels per step at SIM_RATE
+SIM_RATE = 60
+PLAYER_SIZE = 40
+PLAYER_SPEED = 3
+DODGE_SPEED = 6
+DODGE_DURATION = 0.3
+DODGE_COOLDOWN = 0.5
+ATTACK_DURATION = 0.5
+ATTACK_COOLDOWN = 0.3
+COMBO_WINDOW = 0.3  # a second attack press this soon after the first queues attack2
+FRAME_DURATION = 0.1
+FRAME_COUNT = 8
+DIRECTION_STEPS = {"left": (-1, 0), "right": (1, 0), "up": (0, -1), "down": (0, 1)}
+AFTERIMAGES = [(200, 0.2), (150, 0.1)]  # (alpha, lifetime) of the ghosts a dodge leaves behind
+
+# Random input shared by bots and NPCs: hold an arrow key for a while, sometimes let go,
+# sometimes press space or shift.
+HOLD_CHOICES = [None, "left", "right", "up", "down", "left", "right", "up", "down"]
+HOLD_TIME = (0.3, 2.0)
+ATTACK_CHANCE = 0.01
+DODGE_CHANCE = 0.005
+
+IDLE, RUN, ATTACK1, ATTACK2, DODGE = (STATE_CODES[name] for name in ["idle", "run", "attack1", "attack2", "dodge"])
+NO_DIRECTION = -1
+
+class EntityBatch:
+    # Many entities under the same state machine as bot.Bot.step (itself the headless copy of the
+    # game_loop movement block and PlayerAnimation.update), one NumPy array per field. step()
+    # advances every entity at once; held directions use DIRECTION_CODES, NO_DIRECTION for none.
+    def __init__(self, count, world_width, world_height, seed=None):
+        if np is None:
+            raise RuntimeError("EntityBatch needs numpy: pip install numpy")
+        self.count = count
+        self.world_width = world_width
+        self.world_height = world_height
+        self.random = np.random.default_rng(seed)
+        self.x = self.random.uniform(0, world_width - PLAYER_SIZE, count)
+        self.y = self.random.uniform(0, world_height - PLAYER_SIZE, count)
+        self.state = np.full(count, IDLE, dtype="uint8")
+        self.direction = np.full(count, DIRECTION_CODES["down"], dtype="uint8")
+        self.current_frame = np.zeros(count, dtype="int64")
+        self.current_time = np.zeros(count)
+        self.attack_timer = np.zeros(count)
+        self.dodge_timer = np.zeros(count)
+        self.dodge_cooldown_timer = np.zeros(count)
+        self.cooldown_timer = np.zeros(count)
+        self.queued_attack = np.zeros(count, dtype=bool)
+        self.last_attack_press = np.full(count, -COMBO_WINDOW)
+        # A dodge cooldown outlasts every afterimage, so each entity needs at most one set
+        self.afterimage_x = np.zeros((count, len(AFTERIMAGES)))
+        self.afterimage_y = np.zeros((count, len(AFTERIMAGES)))
+        self.afterimage_time = np.zeros((count, len(AFTERIMAGES)))
+        self.afterimage_alive = np.zeros((count, len(AFTERIMAGES)), dtype=bool)
+        self.held = np.full(count, NO_DIRECTION, dtype="int8")
+        self.hold_timer = np.zeros(count)
+        self.clock = 0.0
+        # Indexed by held direction code; the trailing zero is what NO_DIRECTION (-1) picks up
+        self.step_x = np.array([DIRECTION_STEPS[d][0] for d in DIRECTIONS] + [0], dtype="float64")
+        self.step_y = np.array([DIRECTION_STEPS[d][1] for d in DIRECTIONS] + [0], dtype="float64")
+        self.hold_choices = np.array([NO_DIRECTION if d is None else DIRECTION_CODES[d] for d in HOLD_CHOICES], dtype="int8")
+
+    def choose_inputs(self, dt):
+        # Vectorized Bot.choose_input; returns (held, attack, dodge) arrays for step().
+        self.hold_timer -= dt
+        expired = np.nonzero(self.hold_timer <= 0)[0]
+        if len(expired):
+            self.held[expired] = self.random.choice(self.hold_choices, len(expired))
+            self.hold_timer[expired] = self.random.uniform(*HOLD_TIME, len(expired))
+        roll = self.random.random(self.count)
+        attack = roll < ATTACK_CHANCE
+        dodge = ~attack & (roll < ATTACK_CHANCE + DODGE_CHANCE)
+        return self.held, attack, dodge
+
+    def step(self, dt, held, attack, dodge):
+        # Returns (attacked, dodged) masks: the entities that would send an attack or dodge action.
+        state = self.state
+        attacking = (state == ATTACK1) | (state == ATTACK2)
+        moving = (held != NO_DIRECTION) & ~attacking
+        speed = np.where(state == DODGE, DODGE_SPEED, PLAYER_SPEED)
+        self.x += np.where(moving, self.step_x[held] * speed, 0)
+        self.y += np.where(moving, self.step_y[held] * speed, 0)
+
+        start_attack = attack & ~attacking & (state != DODGE) & (self.cooldown_timer <= 0)
+        combo = attack & (state == ATTACK1) & ~self.queued_attack & (self.clock - self.last_attack_press < COMBO_WINDOW)
+        dodged = dodge & ~attack & moving & (self.dodge_cooldown_timer <= 0)
+        state[start_attack] = ATTACK1
+        self.attack_timer[start_attack] = ATTACK_DURATION
+        self.last_attack_press[start_attack] = self.clock
+        self.queued_attack[combo] = True
+        state[dodged] = DODGE
+        self.dodge_timer[dodged] = DODGE_DURATION
+        self.dodge_cooldown_timer[dodged] = DODGE_COOLDOWN
+        for i, (_, lifetime) in enumerate(AFTERIMAGES):
+            self.afterimage_x[dodged, i] = self.x[dodged]
+            self.afterimage_y[dodged, i] = self.y[dodged]
+            self.afterimage_time[dodged, i] = lifetime
+            self.afterimage_alive[dodged, i] = True
+        # game_loop takes one more step into the dodge, at the speed picked before it started
+        self.x[dodged] += self.step_x[held[dodged]] * speed[dodged]
+        self.y[dodged] += self.step_y[held[dodged]] * speed[dodged]
+
+        np.clip(self.x, 0, self.world_width - PLAYER_SIZE, out=self.x)
+        np.clip(self.y, 0, self.world_height - PLAYER_SIZE, out=self.y)
+        free = (state != ATTACK1) & (state != ATTACK2) & (state != DODGE)
+        state[free] = np.where(moving[free], RUN, IDLE)
+        self.direction[moving] = held[moving]
+        self.advance_timers(dt)
+        return start_attack | combo, dodged
+
+    def advance_timers(self, dt):
+        # Vectorized PlayerAnimation.update; a scalar `if timer > 0: timer -= dt` becomes a masked subtract.
+        self.afterimage_alive &= self.afterimage_time > 0
+        self.afterimage_time[self.afterimage_alive] -= dt
+        self.dodge_cooldown_timer[self.dodge_cooldown_timer > 0] -= dt
+        self.cooldown_timer[self.cooldown_timer > 0] -= dt
+
+        state = self.state
+        dodging = state == DODGE
+        self.dodge_timer[dodging] -= dt
+        ended = dodging & (self.dodge_timer <= 0)
+        state[ended] = IDLE
+        self.queued_attack[ended] = False
+
+        attacking = (state == ATTACK1) | (state == ATTACK2)
+        self.attack_timer[attacking] -= dt
+        finished = attacking & (self.attack_timer <= 0)
+        chained = finished & (state == ATTACK1) & self.queued_attack
+        stopped = finished & ~chained
+        state[chained] = ATTACK2
+        self.attack_timer[chained] = ATTACK_DURATION
+        # PlayerAnimation.update resets the state before checking for attack2, so no cooldown applies
+        self.cooldown_timer[stopped] = 0
+        state[stopped] = IDLE
+        self.queued_attack[finished] = False
+
+        # Repeated subtraction rather than divmod keeps the floats identical to the scalar loop
+        self.current_time += dt
+        due = self.current_time >= FRAME_DURATION
+        while due.any():
+            self.current_time[due] -= FRAME_DURATION
+            self.current_frame[due] = (self.current_frame[due] + 1) % FRAME_COUNT
+            due = self.current_time >= FRAME_DURATION
+        self.clock += dt
+
+    def afterimages(self, i):
+        return [[float(self.afterimage_x[i, k]), float(self.afterimage_y[i, k]), alpha, float(self.afterimage_time[i, k])]
+                for k, (alpha, _) in enumerate(AFTERIMAGES) if self.afterimage_alive[i, k]]
+
+    def record(self, i):
+        # One entity in the shape PlayerStore.write and the wire protocol use.
+        state = int(self.state[i])
+        return {
+            "x": float(self.x[i]),
+            "y": float(self.y[i]),
+            "state": STATES[state],
+            "direction": DIRECTIONS[int(self.direction[i])],
+            "current_frame": int(self.current_frame[i]),
+            "current_time": float(self.current_time[i]),
+            "is_invulnerable": state == DODGE,
+            "afterimages": self.afterimages(i),
+        }
+
+def check_parity(count, steps, seed=0, dt=1 / SIM_RATE):
+    # Drives EntityBatch and one scalar bot.Bot per entity with identical inputs and returns the
+    # first mismatch as (step, entity, field, scalar value, batch value), or None.
+    from bot import Bot
+    rng = random.Random(seed)
+    batch = EntityBatch(count, 1000, 1000, seed=seed)
+    bots = []
+    for i in range(count):
+        bot = Bot("", f"bot{i}", seed=seed + i)
+        bot.x, bot.y = float(batch.x[i]), float(batch.y[i])
+        bots.append(bot)
+    for n in range(steps):
+        inputs = [(rng.choice(HOLD_CHOICES), rng.random() < 0.05, rng.random() < 0.05) for _ in bots]
+        held = np.array([NO_DIRECTION if h is None else DIRECTION_CODES[h] for h, _, _ in inputs], dtype="int8")
+        attacked, dodged = batch.step(dt, held, np.array([a for _, a, _ in inputs]), np.array([d for _, _, d in inputs]))
+        for i, (bot, (h, a, d)) in enumerate(zip(bots, inputs)):
+            actions = bot.apply_input(dt, h, a, d)
+            expected = {**bot.player_state(), "actions": actions}
+            actual = {**batch.record(i), "actions": ["attack"] * bool(attacked[i]) + ["dodge"] * bool(dodged[i])}
+            for field, value in expected.items():
+                if actual[field] != value:
+                    return n, i, field, value, actual[field]
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Check EntityBatch against the scalar bot simulation.")
+    parser.add_argument("--entities", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for dt in (1 / SIM_RATE, 1 / 20, 0.037):
+        mismatch = check_parity(args.entities, args.steps, args.seed, dt)
+        if mismatch:
+            raise SystemExit(f"dt={dt:.4f}: step {mismatch[0]}, entity {mismatch[1]}, {mismatch[2]}: "
+                             f"scalar {mismatch[3]!r}, batch {mismatch[4]!r}")
+        print(f"dt={dt:.4f}: {args.entities} entities match over {args.steps} steps")
+
+if __name__ == "__main__":
+    main()
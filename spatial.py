@@ -0,0 +1,55 @@
+class SpatialHash:
+    # Uniform grid keyed on cell coordinates; each cell holds the keys whose position falls inside it.
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> set of keys
+        self.positions = {}  # key -> (x, y, cell)
+
+    def _cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def update(self, key, x, y):
+        cell = self._cell(x, y)
+        old = self.positions.get(key)
+        if old is not None and old[2] != cell:
+            self._discard(key, old[2])
+        if old is None or old[2] != cell:
+            self.cells.setdefault(cell, set()).add(key)
+        self.positions[key] = (x, y, cell)
+
+    def remove(self, key):
+        old = self.positions.pop(key, None)
+        if old is not None:
+            self._discard(key, old[2])
+
+    def _discard(self, key, cell):
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, left, top, right, bottom):
+        # Keys whose position lies inside the rectangle (edges inclusive).
+        min_cx, min_cy = self._cell(left, top)
+        max_cx, max_cy = self._cell(right, bottom)
+        found = set()
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = self.cells.get((cx, cy))
+                if not bucket:
+                    continue
+                if min_cx < cx < max_cx and min_cy < cy < max_cy:
+                    found.update(bucket)
+                    continue
+                for key in bucket:
+                    x, y, _ = self.positions[key]
+                    if left <= x <= right and top <= y <= bottom:
+                        found.add(key)
+        return found
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
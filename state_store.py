@@ -0,0 +1,260 @@
+import math
+from array import array
+from collections import deque
+
+from protocol import DIRECTIONS, DIRECTION_CODES, FIELD_BITS, STATES, STATE_CODES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Per-slot columns; the order matches protocol.FIELD_ORDER so change masks line up with the wire format.
+COLUMNS = [
+    ("x", "d"),
+    ("y", "d"),
+    ("state", "B"),
+    ("direction", "B"),
+    ("current_frame", "B"),
+    ("current_time", "d"),
+    ("is_invulnerable", "B"),
+]
+NUMPY_TYPES = {"d": "float64", "B": "uint8", "I": "uint32"}
+AFTERIMAGES_BIT = FIELD_BITS["afterimages"]
+MAX_AFTERIMAGES = 16  # a dodge leaves two; a client never holds more than a few at once
+FLOAT32_MAX = 3.4e38  # positions and times go out as f32 in the binary protocol
+NUMERIC_FIELDS = ("x", "y", "current_frame", "current_time")
+
+def _wire_number(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value) and abs(value) <= FLOAT32_MAX
+
+def valid_player(data):
+    # Player fields arrive from clients and are only packed when a frame is built, so a message
+    # carrying a value the wire format cannot hold is refused here instead of failing there.
+    for name in NUMERIC_FIELDS:
+        if name in data and not _wire_number(data[name]):
+            return False
+    for name, codes in (("state", STATE_CODES), ("direction", DIRECTION_CODES)):
+        if name in data and not (isinstance(data[name], str) and data[name] in codes):
+            return False
+    return True
+
+def clean_afterimages(afterimages):
+    # Afterimages arrive from clients and are only packed when a binary peer's frame is built,
+    # so malformed entries are dropped here instead of failing there.
+    if not isinstance(afterimages, (list, tuple)):
+        return []
+    cleaned = []
+    for entry in afterimages:
+        if isinstance(entry, (list, tuple)) and len(entry) == 4 and all(_wire_number(value) for value in entry):
+            cleaned.append(list(entry))
+            if len(cleaned) == MAX_AFTERIMAGES:
+                break
+    return cleaned
+
+def _zeros(typecode, n):
+    if np is not None:
+        return np.zeros(n, dtype=NUMPY_TYPES[typecode])
+    return array(typecode, bytes(array(typecode).itemsize * n))
+
+def _grow(column, typecode, n):
+    if np is not None:
+        return np.concatenate([column, np.zeros(n - len(column), dtype=NUMPY_TYPES[typecode])])
+    column.extend(_zeros(typecode, n - len(column)))
+    return column
+
+class StoreFrame:
+    # Immutable view of the store taken once per tick; values are plain Python lists.
+    def __init__(self, columns, nicknames, active, afterimages, change_masks):
+        self.columns = columns  # name -> list indexed by slot
+        self.nicknames = nicknames
+        self.active = active  # list of live slots
+        self.afterimages = afterimages
+        self.change_masks = change_masks  # slot -> FIELD_BITS mask, only for slots that changed
+
+    def __contains__(self, slot):
+        return slot < len(self.nicknames) and self.nicknames[slot] is not None
+
+    def record(self, slot):
+        columns = self.columns
+        return {
+            "x": columns["x"][slot],
+            "y": columns["y"][slot],
+            "state": STATES[columns["state"][slot]],
+            "direction": DIRECTIONS[columns["direction"][slot]],
+            "current_frame": columns["current_frame"][slot],
+            "current_time": columns["current_time"][slot],
+            "is_invulnerable": bool(columns["is_invulnerable"][slot]),
+            "afterimages": self.afterimages[slot],
+        }
+
+    def changes(self, slot, mask=None):
+        # mask defaults to what changed this tick; callers may widen or narrow it.
+        if mask is None:
+            mask = self.change_masks.get(slot)
+        if not mask:
+            return None
+        record = self.record(slot)
+        return {name: value for name, value in record.items() if mask & FIELD_BITS[name]}
+
+class PlayerStore:
+    # Fixed-width columns indexed by slot; a player's slot doubles as its wire-protocol id.
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.columns = {name: _zeros(typecode, capacity) for name, typecode in COLUMNS}
+        self.previous = {name: _zeros(typecode, capacity) for name, typecode in COLUMNS}
+        self.active = _zeros("B", capacity)
+        self.generation = _zeros("I", capacity)  # bumped whenever a slot is handed to a new player
+        self.previous_generation = _zeros("I", capacity)
+        self.nicknames = [None] * capacity
+        self.afterimages = [[] for _ in range(capacity)]
+        self.afterimages_changed = set()
+        self.slots = {}  # nickname -> slot
+        self.free_slots = deque()  # released slots, reused oldest first
+        self.high_water = 0  # slots below this index have been used at least once
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, nickname):
+        return nickname in self.slots
+
+    def slot_of(self, nickname):
+        return self.slots.get(nickname)
+
+    def _ensure_capacity(self, n):
+        if n <= self.capacity:
+            return
+        capacity = max(n, self.capacity * 2)
+        for name, typecode in COLUMNS:
+            self.columns[name] = _grow(self.columns[name], typecode, capacity)
+            self.previous[name] = _grow(self.previous[name], typecode, capacity)
+        self.active = _grow(self.active, "B", capacity)
+        self.generation = _grow(self.generation, "I", capacity)
+        self.previous_generation = _grow(self.previous_generation, "I", capacity)
+        self.nicknames.extend([None] * (capacity - self.capacity))
+        self.afterimages.extend([] for _ in range(capacity - self.capacity))
+        self.capacity = capacity
+
+    def add(self, nickname, data):
+        slot = self.slots.get(nickname)
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.popleft()
+            else:
+                slot = self.high_water
+                self.high_water += 1
+                self._ensure_capacity(self.high_water)
+            self.slots[nickname] = slot
+            self.nicknames[slot] = nickname
+            self.active[slot] = 1
+            self.generation[slot] += 1
+        self.write(slot, data)
+        return slot
+
+    def remove(self, nickname):
+        slot = self.slots.pop(nickname, None)
+        if slot is None:
+            return None
+        self.nicknames[slot] = None
+        self.active[slot] = 0
+        self.afterimages[slot] = []
+        self.afterimages_changed.discard(slot)
+        self.free_slots.append(slot)
+        return slot
+
+    def clear(self):
+        for nickname in list(self.slots):
+            self.remove(nickname)
+
+    def write(self, slot, data):
+        columns = self.columns
+        columns["x"][slot] = data.get("x", 0)
+        columns["y"][slot] = data.get("y", 0)
+        columns["state"][slot] = STATE_CODES.get(data.get("state"), 0)
+        columns["direction"][slot] = DIRECTION_CODES.get(data.get("direction"), 0)
+        columns["current_frame"][slot] = int(data.get("current_frame", 0)) & 0xFF
+        columns["current_time"][slot] = data.get("current_time", 0)
+        columns["is_invulnerable"][slot] = 1 if data.get("is_invulnerable") else 0
+        self.write_afterimages(slot, clean_afterimages(data.get("afterimages")))
+
+    def write_afterimages(self, slot, afterimages):
+        if afterimages != self.afterimages[slot]:
+            self.afterimages[slot] = afterimages
+            self.afterimages_changed.add(slot)
+
+    def write_columns(self, slots, values):
+        # Bulk write for batch-simulated entities: values maps column name -> sequence aligned with slots.
+        for name, column in values.items():
+            if np is not None:
+                self.columns[name][slots] = column
+            else:
+                target = self.columns[name]
+                for slot, value in zip(slots, column):
+                    target[slot] = value
+
+    def record(self, slot):
+        # Live state of one slot in the same shape write() accepts.
+        columns = self.columns
+        return {
+            "x": float(columns["x"][slot]),
+            "y": float(columns["y"][slot]),
+            "state": STATES[columns["state"][slot]],
+            "direction": DIRECTIONS[columns["direction"][slot]],
+            "current_frame": int(columns["current_frame"][slot]),
+            "current_time": float(columns["current_time"][slot]),
+            "is_invulnerable": bool(columns["is_invulnerable"][slot]),
+            "afterimages": self.afterimages[slot],
+        }
+
+    def position(self, slot):
+        return self.columns["x"][slot], self.columns["y"][slot]
+
+    def snapshot(self):
+        # One pass over the columns: diff against the previous snapshot, then roll it forward.
+        n = self.high_water
+        columns = {name: self.columns[name][:n].tolist() for name, _ in COLUMNS}
+        if np is not None:
+            mask = np.zeros(n, dtype="uint8")
+            for bit, (name, _) in enumerate(COLUMNS):
+                mask |= (self.columns[name][:n] != self.previous[name][:n]).astype("uint8") << bit
+                self.previous[name][:n] = self.columns[name][:n]
+            # Slots handed to a new player since the last snapshot are joins, not changes.
+            same_player = (self.generation[:n] == self.previous_generation[:n]) & (self.active[:n] == 1)
+            for slot in self.afterimages_changed:
+                mask[slot] |= AFTERIMAGES_BIT
+            mask *= same_player
+            self.previous_generation[:n] = self.generation[:n]
+            changed = np.nonzero(mask)[0]
+            change_masks = dict(zip(changed.tolist(), mask[changed].tolist()))
+            active = np.nonzero(self.active[:n])[0].tolist()
+        else:
+            change_masks = {}
+            active = []
+            for slot in range(n):
+                if not self.active[slot]:
+                    continue
+                active.append(slot)
+                if self.generation[slot] != self.previous_generation[slot]:
+                    continue
+                bits = AFTERIMAGES_BIT if slot in self.afterimages_changed else 0
+                for bit, (name, _) in enumerate(COLUMNS):
+                    if columns[name][slot] != self.previous[name][slot]:
+                        bits |= 1 << bit
+                if bits:
+                    change_masks[slot] = bits
+            for name, _ in COLUMNS:
+                self.previous[name][:n] = self.columns[name][:n]
+            self.previous_generation[:n] = self.generation[:n]
+        self.afterimages_changed.clear()
+        return StoreFrame(columns, self.nicknames[:n], active, self.afterimages[:n], change_masks)
+
+    def query_rect(self, left, top, right, bottom):
+        # Bulk range query over the position columns (edges inclusive).
+        n = self.high_water
+        xs = self.columns["x"][:n]
+        ys = self.columns["y"][:n]
+        if np is not None:
+            inside = (xs >= left) & (xs <= right) & (ys >= top) & (ys <= bottom) & (self.active[:n] == 1)
+            return np.nonzero(inside)[0].tolist()
+        return [slot for slot in range(n) if self.active[slot] and left <= xs[slot] <= right and top <= ys[slot] <= bottom]
@@ -0,0 +1,85 @@
+import math
+import random
+
+import pytest
+
+import combat
+from combat import REACH, resolve_attacks
+from spatial import SpatialHash
+from state_store import PlayerStore
+
+ATTACKER = {"x": 100, "y": 100, "direction": "right"}
+TARGETS = {
+    "front": ({"x": 150, "y": 100}, True),
+    "edge_of_reach": ({"x": 100 + REACH, "y": 100}, True),
+    "past_reach": ({"x": 101 + REACH, "y": 100}, False),
+    "inside_arc": ({"x": 140, "y": 160}, True),
+    "outside_arc": ({"x": 130, "y": 170}, False),
+    "below": ({"x": 100, "y": 160}, False),
+    "behind": ({"x": 60, "y": 100}, False),
+    "overlapping_behind": ({"x": 90, "y": 100}, True),
+    "dodging": ({"x": 150, "y": 100, "is_invulnerable": True}, False),
+}
+
+def world(players):
+    store = PlayerStore()
+    index = SpatialHash(64)
+    slots = {}
+    for nickname, data in players.items():
+        slot = slots[nickname] = store.add(nickname, data)
+        index.update(slot, *store.position(slot))
+    return store, index, slots
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(combat, "np", None)
+    elif combat.np is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+def test_swing_hits_what_is_in_reach_and_arc(backend):
+    store, index, slots = world({"attacker": ATTACKER, **{name: data for name, (data, _) in TARGETS.items()}})
+    hits = resolve_attacks([slots["attacker"]], store, index)
+    hit_names = {store.nicknames[target] for attacker, target in hits}
+    assert hit_names == {name for name, (_, expected) in TARGETS.items() if expected}
+    assert all(attacker == slots["attacker"] for attacker, _ in hits)
+
+def test_every_attack_is_resolved_once(backend):
+    store, index, slots = world({"a": ATTACKER, "b": {"x": 150, "y": 100, "direction": "left"}})
+    hits = resolve_attacks([slots["a"], slots["b"], slots["a"]], store, index)
+    assert sorted(hits) == sorted([(slots["a"], slots["b"]), (slots["b"], slots["a"]), (slots["a"], slots["b"])])
+    assert resolve_attacks([], store, index) == []
+
+def brute_force(attackers, store):
+    # Every attacker against every player, without the broad phase.
+    columns = store.columns
+    hits = []
+    for attacker in attackers:
+        face_x, face_y = combat.FACING[columns["direction"][attacker]]
+        for target in store.slots.values():
+            if target == attacker or columns["is_invulnerable"][target]:
+                continue
+            dx = columns["x"][target] - columns["x"][attacker]
+            dy = columns["y"][target] - columns["y"][attacker]
+            distance = math.hypot(dx, dy)
+            if distance <= REACH and (dx * face_x + dy * face_y >= combat.MIN_COSINE * distance or distance < combat.HALF_SIZE):
+                hits.append((attacker, target))
+    return sorted(hits)
+
+def test_crowd_matches_brute_force(backend):
+    rng = random.Random(7)
+    players = {
+        f"p{i}": {
+            "x": rng.uniform(0, 400),
+            "y": rng.uniform(0, 400),
+            "direction": rng.choice(["up", "down", "left", "right"]),
+            "is_invulnerable": rng.random() < 0.1,
+        }
+        for i in range(200)
+    }
+    store, index, slots = world(players)
+    attackers = rng.sample(sorted(slots.values()), 50)
+    hits = resolve_attacks(attackers, store, index)
+    assert sorted(hits) == brute_force(attackers, store)
+    assert len(hits) > 50
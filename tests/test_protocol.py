@@ -0,0 +1,153 @@
+import math
+import struct
+
+import pytest
+
+from protocol import (
+    BINARY_CODEC, FIELD_ORDER, JSON_CODEC, MSG_JOIN, PROTOCOL_VERSION, decode_message, peek_server_time,
+)
+from state_store import FLOAT32_MAX, MAX_AFTERIMAGES, clean_afterimages, valid_player
+
+PLAYER = {
+    "x": 123.5,
+    "y": -40.25,
+    "state": "attack1",
+    "direction": "left",
+    "current_frame": 3,
+    "current_time": 0.125,
+    "is_invulnerable": True,
+    "afterimages": [[10.5, 20.5, 128, 0.25], [11.5, 21.5, 64, 0.125]],
+}
+
+def assert_player(decoded, expected):
+    # Positions and times travel as f32; the values above are exact in f32.
+    for name in FIELD_ORDER:
+        assert decoded[name] == expected[name], name
+
+def test_client_messages_round_trip():
+    join = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**PLAYER, "type": "join", "nickname": "ålice", "view_width": 1024, "view_height": 768}))
+    assert join["type"] == "join"
+    assert join["nickname"] == "ålice"
+    assert (join["view_width"], join["view_height"]) == (1024, 768)
+    assert_player(join, PLAYER)
+    update = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**PLAYER, "type": "update"}))
+    assert update["type"] == "update"
+    assert_player(update, PLAYER)
+    action = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**PLAYER, "type": "action", "action": "dodge"}))
+    assert action["action"] == "dodge"
+    assert_player(action, PLAYER)
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode_client({"type": "pong", "id": 7})) == {"type": "pong", "id": 7}
+
+def test_join_with_other_version_is_refused():
+    raw = bytearray(BINARY_CODEC.encode_client({"type": "join", "nickname": "a"}))
+    assert raw[:2] == bytes([MSG_JOIN, PROTOCOL_VERSION])
+    raw[1] = PROTOCOL_VERSION + 1
+    with pytest.raises(ValueError):
+        BINARY_CODEC.decode(bytes(raw))
+
+def test_truncated_message_is_malformed():
+    raw = BINARY_CODEC.encode_client({**PLAYER, "type": "update"})
+    with pytest.raises(ValueError):
+        BINARY_CODEC.decode(raw[:-3])
+
+def test_keyframe_round_trip():
+    names = {}
+    frame = BINARY_CODEC.keyframe(
+        42, 1700000000.5,
+        [BINARY_CODEC.name_fragment(0, "alice"), BINARY_CODEC.name_fragment(3, "bob")],
+        [BINARY_CODEC.player_fragment("alice", 0, PLAYER), BINARY_CODEC.player_fragment("bob", 3, {**PLAYER, "x": 1.0})],
+        [BINARY_CODEC.hit_fragment("alice", 0, "bob", 3)],
+    )
+    decoded = BINARY_CODEC.decode_server(frame, names)
+    assert names == {0: "alice", 3: "bob"}
+    assert decoded["type"] == "players_update"
+    assert (decoded["seq"], decoded["t"]) == (42, 1700000000.5)
+    assert peek_server_time(frame) == 1700000000.5
+    alice, bob = decoded["players"]
+    assert (alice["nickname"], bob["nickname"]) == ("alice", "bob")
+    assert_player(alice, PLAYER)
+    assert bob["x"] == 1.0
+    assert decoded["hits"] == [["alice", "bob"]]
+
+def test_keyframe_without_hits():
+    frame = BINARY_CODEC.keyframe(1, 0.0, [], [])
+    assert BINARY_CODEC.decode_server(frame, {})["hits"] == []
+
+def test_delta_round_trip():
+    names = {0: "alice", 3: "bob"}
+    frame = BINARY_CODEC.delta(
+        43, 42, 1700000000.55,
+        [("bob", 3)],
+        # bob's id is reused by carol in the same frame: left is applied before the new name
+        [BINARY_CODEC.name_fragment(3, "carol")],
+        [BINARY_CODEC.player_fragment("carol", 3, PLAYER)],
+        [BINARY_CODEC.changes_fragment("alice", 0, {"x": 5.5, "state": "dodge", "afterimages": []})],
+        [BINARY_CODEC.hit_fragment("carol", 3, "alice", 0)],
+    )
+    decoded = BINARY_CODEC.decode_server(frame, names)
+    assert (decoded["seq"], decoded["base"], decoded["t"]) == (43, 42, 1700000000.55)
+    assert decoded["left"] == ["bob"]
+    assert names == {0: "alice", 3: "carol"}
+    assert decoded["joined"][0]["nickname"] == "carol"
+    assert_player(decoded["joined"][0], PLAYER)
+    assert decoded["changed"] == [{"x": 5.5, "state": "dodge", "afterimages": [], "nickname": "alice"}]
+    assert decoded["hits"] == [["carol", "alice"]]
+
+def test_every_changed_field_round_trips():
+    for name in FIELD_ORDER:
+        frame = BINARY_CODEC.delta(2, 1, 0.0, [], [], [], [BINARY_CODEC.changes_fragment("a", 0, {name: PLAYER[name]})])
+        changed = BINARY_CODEC.decode_server(frame, {0: "a"})["changed"]
+        assert changed == [{name: PLAYER[name], "nickname": "a"}]
+
+def test_json_frames_match_binary_shape():
+    keyframe = decode_message(JSON_CODEC.keyframe(
+        42, 1.5, [], [JSON_CODEC.player_fragment("alice", 0, PLAYER)], [JSON_CODEC.hit_fragment("alice", 0, "bob", 3)],
+    ))
+    assert keyframe["players"] == [{"nickname": "alice", **PLAYER}]
+    assert keyframe["hits"] == [["alice", "bob"]]
+    delta = decode_message(JSON_CODEC.delta(43, 42, 1.5, [("bob", 3)], [], [], [JSON_CODEC.changes_fragment("alice", 0, {"x": 1})]))
+    assert (delta["base"], delta["left"], delta["changed"]) == (42, ["bob"], [{"nickname": "alice", "x": 1}])
+
+def test_frame_counter_wraps_at_a_byte():
+    for frame, expected in ((0, 0), (255, 255), (256, 0), (257, 1)):
+        decoded = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**PLAYER, "type": "update", "current_frame": frame}))
+        assert decoded["current_frame"] == expected
+
+def test_afterimage_count_and_fields_are_clamped():
+    many = [[1.0, 2.0, 300, 70.0]] * 300
+    decoded = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**PLAYER, "type": "update", "afterimages": many}))
+    assert len(decoded["afterimages"]) == 255
+    assert decoded["afterimages"][0] == [1.0, 2.0, 255, 65.535]
+    assert len(clean_afterimages(many)) == MAX_AFTERIMAGES
+
+@pytest.mark.parametrize("value", [FLOAT32_MAX, -FLOAT32_MAX, 0, 1e-45])
+def test_accepted_values_pack_as_f32(value):
+    data = {**PLAYER, "x": value, "y": value, "current_time": value}
+    assert valid_player(data)
+    decoded = BINARY_CODEC.decode(BINARY_CODEC.encode_client({**data, "type": "update"}))
+    assert math.isfinite(decoded["x"])
+
+@pytest.mark.parametrize("value", [1e39, -1e39, math.inf, math.nan])
+@pytest.mark.parametrize("field", ["x", "y", "current_time"])
+def test_values_f32_cannot_carry_are_refused(field, value):
+    assert not valid_player({**PLAYER, field: value})
+    if not math.isnan(value) and not math.isinf(value):
+        with pytest.raises((struct.error, OverflowError)):
+            BINARY_CODEC.encode_client({**PLAYER, "type": "update", field: value})
+
+@pytest.mark.parametrize("data", [
+    {"x": "abc"},
+    {"y": None},
+    {"current_frame": True},
+    {"current_frame": math.nan},
+    {"state": ["a"]},
+    {"state": "flying"},
+    {"direction": {}},
+    {"direction": None},
+])
+def test_malformed_fields_are_refused(data):
+    assert not valid_player({**PLAYER, **data})
+
+def test_afterimages_the_wire_cannot_carry_are_dropped():
+    assert clean_afterimages([[1, 2], [1, 2, "a", 3], [1e39, 1, 1, 1], [math.nan, 1, 1, 1], [5, 6, 200, 0.1]]) == [[5, 6, 200, 0.1]]
+    assert clean_afterimages("nope") == []
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import websockets
+
+from protocol import BINARY_CODEC, SUBPROTOCOL_BINARY
+from recorder import BYTES, CLOSE, OPEN, TEXT, TICK, LogReader, Recorder
+from replay import replay, show_state
+
+JOIN = json.dumps({"type": "join", "nickname": "alice", "x": 100, "y": 100})
+UPDATE = json.dumps({"type": "update", "x": 101, "y": 100})
+PONG = json.dumps({"type": "pong", "id": 1})
+BINARY_JOIN = BINARY_CODEC.encode_client({"type": "join", "nickname": "bob", "x": 200, "y": 100})
+BINARY_UPDATE = BINARY_CODEC.encode_client({"type": "update", "x": 201, "y": 100, "state": "run"})
+
+def record_session(path):
+    recorder = Recorder(str(path))
+    alice = recorder.open(None)
+    recorder.message(alice, JOIN)
+    bob = recorder.open(SUBPROTOCOL_BINARY)
+    recorder.message(bob, BINARY_JOIN)
+    recorder.message(alice, PONG)  # answers a ping of the original session; never replayed
+    recorder.message(alice, UPDATE)
+    recorder.tick("lobby", BINARY_CODEC.keyframe(
+        7, 1.5,
+        [BINARY_CODEC.name_fragment(0, "alice"), BINARY_CODEC.name_fragment(1, "bob")],
+        [BINARY_CODEC.player_fragment("alice", 0, {"x": 101, "y": 100}),
+         BINARY_CODEC.player_fragment("bob", 1, {"x": 201, "y": 100, "state": "run"})],
+        [BINARY_CODEC.hit_fragment("alice", 0, "bob", 1)],
+    ))
+    recorder.message(bob, BINARY_UPDATE)
+    recorder.close_connection(bob)
+    recorder.close_connection(alice)
+    recorder.close()
+    return alice, bob
+
+def test_log_reads_back_what_was_recorded(tmp_path):
+    path = tmp_path / "session.log"
+    alice, bob = record_session(path)
+    reader = LogReader(str(path))
+    try:
+        records = [(kind, conn, bytes(payload)) for kind, _, conn, payload in reader.records()]
+        assert [(kind, conn) for kind, conn, _ in records] == [
+            (OPEN, alice), (TEXT, alice), (OPEN, bob), (BYTES, bob), (TEXT, alice), (TEXT, alice),
+            (TICK, 0), (BYTES, bob), (CLOSE, bob), (CLOSE, alice),
+        ]
+        assert records[2][2] == SUBPROTOCOL_BINARY.encode()
+        assert records[3][2] == BINARY_JOIN
+        times = [t for _, t, _, _ in reader.records()]
+        assert times == sorted(times)
+        assert reader.seek(0) == reader.seek(-1)
+        assert list(reader.records(reader.seek(times[-1])))[-1][0] == CLOSE
+    finally:
+        reader.close()
+
+def test_cut_short_log_stops_at_the_last_whole_record(tmp_path):
+    path = tmp_path / "session.log"
+    record_session(path)
+    path.write_bytes(path.read_bytes()[:-3])
+    reader = LogReader(str(path))
+    try:
+        assert [kind for kind, _, _, _ in reader.records()][-1] == CLOSE
+        assert len(list(reader.records())) == 9
+    finally:
+        reader.close()
+
+def test_state_shows_the_recorded_room(tmp_path, capsys):
+    path = tmp_path / "session.log"
+    record_session(path)
+    reader = LogReader(str(path))
+    try:
+        show_state(reader, 60)
+    finally:
+        reader.close()
+    out = capsys.readouterr().out
+    assert "room lobby" in out and "seq 7, 2 players" in out
+    assert "alice: (101.0, 100.0) idle down" in out
+    assert "bob: (201.0, 100.0) run down" in out
+    assert "hit: alice -> bob" in out
+
+def test_replay_sends_the_recorded_messages(tmp_path):
+    path = tmp_path / "session.log"
+    record_session(path)
+    received = []
+
+    async def handler(ws):
+        async for message in ws:
+            received.append((ws.subprotocol, message))
+
+    async def main():
+        # Like the game server, accept clients that offer no subprotocol (the JSON fallback)
+        select = lambda connection, offered: offered[0] if offered else None
+        async with websockets.serve(handler, "127.0.0.1", 0, select_subprotocol=select) as server:
+            port = server.sockets[0].getsockname()[1]
+            reader = LogReader(str(path))
+            try:
+                stats = await replay(f"ws://127.0.0.1:{port}/ws", reader, speed=0)
+            finally:
+                reader.close()
+            await asyncio.sleep(0.1)
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats.errors == 0
+    # In order per connection, on the subprotocol each was recorded with, without the recorded pong
+    assert [message for protocol, message in received if protocol is None] == [JOIN, UPDATE]
+    assert [message for protocol, message in received if protocol == SUBPROTOCOL_BINARY] == [BINARY_JOIN, BINARY_UPDATE]
+    assert stats.messages_out == 4
@@ -0,0 +1,128 @@
+import ast
+import json
+import random
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import simulation
+from bot import Bot
+from simulation import DIRECTIONS, FRAME_COUNT, HOLD_CHOICES, PLAYER_SIZE, SIM_RATE, check_parity
+
+ROOT = Path(__file__).resolve().parent.parent
+CLIENT = ROOT / "frontend" / "static" / "main.py"
+ATLAS_SOURCES = ROOT / "frontend" / "static" / "assets" / "sprites" / "atlas_sources.json"
+KEY_CODES = {"left": 37, "up": 38, "right": 39, "down": 40}
+SHIFT = 16
+ANIMATED_STATES = ["idle", "run", "attack1", "attack2"]  # dodge draws the run strip
+
+# Known differences between the client and Bot/EntityBatch, left out of the comparison:
+# - the client clamps to the world with its sprite size, the simulation with PLAYER_SIZE;
+# - the client wraps current_frame at the length of the strip it draws, the simulation at
+#   FRAME_COUNT (every strip in atlas_sources.json has that many frames, checked below);
+# - the client holds several arrow keys at once and picks left, right, up, down in that
+#   order; bots hold at most one.
+
+def load_client():
+    # PlayerAnimation and game_loop's simulate_step, executed from the client source itself so
+    # the comparison cannot drift from what the browser runs.
+    source = CLIENT.read_text()
+    tree = ast.parse(source)
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    animation = next(node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == "PlayerAnimation")
+    game_loop = next(node for node in tree.body if isinstance(node, ast.AsyncFunctionDef) and node.name == "game_loop")
+    simulate_step = next(node for node in game_loop.body if isinstance(node, ast.FunctionDef) and node.name == "simulate_step")
+    namespace = {**constants, "debug_print": lambda *args, **kwargs: None, "SIM_DT": 1 / SIM_RATE}
+    exec(compile(ast.Module(body=[animation, simulate_step], type_ignores=[]), str(CLIENT), "exec"), namespace)
+    return namespace, constants
+
+class ClientPlayer:
+    # Drives the client's simulate_step with scripted input instead of the keyboard.
+    def __init__(self, x, y):
+        self.namespace, _ = load_client()
+        animations = {state: {direction: [None] * FRAME_COUNT for direction in DIRECTIONS} for state in ANIMATED_STATES}
+        self.player = SimpleNamespace(x=x, y=y, width=PLAYER_SIZE, height=PLAYER_SIZE)
+        self.player.animator = self.namespace["PlayerAnimation"](animations)
+        self.actions = []
+        self.namespace.update(
+            player=self.player,
+            player_anim=self.player.animator,
+            pygame=SimpleNamespace(key=SimpleNamespace(get_pressed=lambda: defaultdict(bool)),
+                                   K_LEFT=0, K_RIGHT=1, K_UP=2, K_DOWN=3, K_LSHIFT=4),
+            mp_client=SimpleNamespace(send_action=lambda action, t: self.actions.append(action),
+                                      send_position_update=lambda t: None),
+        )
+
+    def step(self, sim_time, held, attack, dodge):
+        keys = set()
+        if held is not None:
+            keys.add(KEY_CODES[held])
+        if dodge:
+            keys.add(SHIFT)
+        self.namespace["pressed_keys"] = keys
+        self.namespace["space_pressed"] = attack
+        self.actions = []
+        self.namespace["simulate_step"](sim_time)
+        return self.actions
+
+    def state(self):
+        anim = self.player.animator
+        return {
+            "x": self.player.x,
+            "y": self.player.y,
+            "state": anim.state,
+            "direction": anim.direction,
+            "current_frame": anim.current_frame,
+            "current_time": anim.current_time,
+            "afterimages": [[x, y, alpha, time] for x, y, _, alpha, time in anim.afterimages],
+        }
+
+def test_constants_match_client():
+    _, constants = load_client()
+    assert simulation.PLAYER_SPEED == constants["player_speed"]
+    assert simulation.DODGE_SPEED == constants["dodge_speed"]
+    assert simulation.DODGE_DURATION == constants["dodge_duration"]
+    assert simulation.DODGE_COOLDOWN == constants["dodge_cooldown"]
+    assert simulation.ATTACK_DURATION == constants["attack_duration"]
+    assert simulation.ATTACK_COOLDOWN == constants["attack_cooldown"]
+    assert simulation.SIM_RATE == constants["SIM_RATE"]
+    assert simulation.FRAME_DURATION == ClientPlayer(0, 0).player.animator.frame_duration
+
+def test_frame_count_matches_atlas():
+    sources = json.loads(ATLAS_SOURCES.read_text())
+    for source in sources.values():
+        assert set(source["frames"].values()) == {FRAME_COUNT}
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bot_matches_client(seed):
+    rng = random.Random(seed)
+    bot = Bot("", "bot", seed=seed)
+    bot.x, bot.y = 500.0, 500.0
+    client = ClientPlayer(bot.x, bot.y)
+    dt = 1 / SIM_RATE
+    sim_time = 0
+    held = None
+    for n in range(3000):
+        if rng.random() < 0.05:
+            held = rng.choice(HOLD_CHOICES)
+        attack = rng.random() < 0.05
+        dodge = rng.random() < 0.05
+        expected_actions = client.step(sim_time, held, attack, dodge)
+        actions = bot.apply_input(dt, held, attack, dodge)
+        sim_time += dt
+        state = bot.player_state()
+        for field, value in client.state().items():
+            assert state[field] == value, f"step {n}: {field}"
+        assert actions == expected_actions, f"step {n}: actions"
+
+@pytest.mark.parametrize("dt", [1 / SIM_RATE, 1 / 20, 0.037])
+def test_batch_matches_bot(dt):
+    assert check_parity(50, 1000, seed=1, dt=dt) is None
@@ -0,0 +1,205 @@
+import asyncio
+
+import pytest
+
+import server
+from protocol import BINARY_CODEC, JSON_CODEC, decode_message
+
+CODECS = [JSON_CODEC, BINARY_CODEC]
+OBSERVER = {"x": 100, "y": 100}
+
+class Socket:
+    # Stands in for the WebSocket; clearing `open` stalls the writer like a slow link.
+    client = "test"
+
+    def __init__(self):
+        self.frames = []
+        self.open = asyncio.Event()
+        self.open.set()
+
+    async def send_text(self, frame):
+        await self.open.wait()
+        self.frames.append(frame)
+
+    send_bytes = send_text
+
+    async def close(self):
+        pass
+
+class Viewer:
+    # What a client rebuilds from the frames it receives; a delta must build on the last frame applied.
+    def __init__(self, codec, socket):
+        self.codec = codec
+        self.socket = socket
+        self.read = 0
+        self.names = {}
+        self.seq = None
+        self.players = {}
+        self.hits = []
+
+    def receive(self):
+        for frame in self.socket.frames[self.read:]:
+            data = self.codec.decode_server(frame, self.names) if self.codec.binary else decode_message(frame)
+            if data["type"] == "players_update":
+                self.players = {p.pop("nickname"): p for p in data["players"]}
+            elif data["type"] == "players_delta":
+                assert data["base"] == self.seq, "delta on top of a frame the client does not have"
+                for nick in data.get("left", []):
+                    del self.players[nick]
+                for p in data.get("joined", []):
+                    self.players[p.pop("nickname")] = p
+                for p in data.get("changed", []):
+                    self.players[p.pop("nickname")].update(p)
+            else:
+                continue
+            self.seq = data["seq"]
+            self.hits.extend(data.get("hits", []))
+        self.read = len(self.socket.frames)
+
+async def settle(conn):
+    # Lets the writer send what it can; a stalled one keeps its queue.
+    for _ in range(4 * server.SEND_QUEUE_SIZE):
+        await asyncio.sleep(0)
+
+async def observe(room, codec, nickname="observer"):
+    socket = Socket()
+    conn = server.ClientConnection(socket, codec)
+    room.join(conn, nickname, OBSERVER)
+    return conn, Viewer(codec, socket)
+
+def place(room, nickname, **fields):
+    # Players of another worker: the quickest way to add, move and drop players in a room.
+    room.apply_remote("other", {"players": {nickname: {"x": 110, "y": 100, **fields}}})
+
+def leave(room, nickname):
+    room.apply_remote("other", {"left": [nickname]})
+
+def expected(room, observer):
+    # Every other player in the room, as the server holds it; all of them stay in view.
+    return {nick: room.players.record(slot) for nick, slot in room.players.slots.items() if nick != observer}
+
+def run(scenario):
+    async def main():
+        room = server.Room("test")
+        try:
+            await scenario(room)
+        finally:
+            for conn in list(room.connections.values()):
+                await conn.close()
+    asyncio.run(main())
+
+@pytest.fixture(autouse=True)
+def fixed_send_level(monkeypatch):
+    # Levels are set by each test; a backed-up queue must not move them.
+    monkeypatch.setattr(server, "ADAPTIVE_RATE", False)
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+def test_skipped_snapshots_are_folded_into_the_next_delta(codec):
+    async def scenario(room):
+        conn, viewer = await observe(room, codec)
+        place(room, "alice")
+        room.broadcast_snapshot()
+        await settle(conn)
+        conn.level = 1  # every 2nd snapshot
+        for step in range(1, 9):
+            # Changes land on skipped and sent snapshots alike, each touching different fields
+            if step % 3 == 0:
+                place(room, "alice", x=110 + step, state="run", direction="left")
+            elif step % 3 == 1:
+                place(room, "alice", x=110, y=100 + step)
+            else:
+                place(room, "alice", x=110, y=100, current_time=step / 4, afterimages=[[1, 2, 3, step / 4]])
+            hits = [(room.players.slot_of("alice"), conn.slot)] if step == 3 else []
+            room.broadcast_snapshot(hits)
+            await settle(conn)
+        room.broadcast_snapshot()
+        await settle(conn)
+        viewer.receive()
+        assert viewer.players == expected(room, "observer")
+        assert viewer.hits == [["alice", "observer"]]
+        assert conn.missed == [] and not conn.owed
+    run(scenario)
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+def test_snapshots_dropped_from_a_full_queue_are_not_lost(codec):
+    async def scenario(room):
+        conn, viewer = await observe(room, codec)
+        place(room, "alice")
+        place(room, "bob", x=120)
+        room.broadcast_snapshot()
+        await settle(conn)
+        conn.websocket.open.clear()  # the writer stalls on the next frame
+        for step in range(1, 3 * server.SEND_QUEUE_SIZE):
+            place(room, "alice", x=110 + step)
+            if step == 2:
+                place(room, "bob", x=120, state="dodge", is_invulnerable=True)
+            room.broadcast_snapshot()
+            await settle(conn)
+        assert conn.dropped > 0
+        conn.websocket.open.set()
+        await settle(conn)
+        viewer.receive()
+        assert viewer.players == expected(room, "observer")
+        assert viewer.players["bob"]["state"] == "dodge"
+    run(scenario)
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+def test_reused_slot_is_a_new_player(codec):
+    async def scenario(room):
+        conn, viewer = await observe(room, codec)
+        conn.websocket.open.clear()
+        room.broadcast_snapshot()  # the writer stalls sending this one
+        await settle(conn)
+        place(room, "alice", x=150)
+        slot = room.players.slot_of("alice")
+        room.broadcast_snapshot()  # queued behind it, naming alice
+        leave(room, "alice")
+        place(room, "bob", x=150)  # same position, so only the nickname tells them apart
+        assert room.players.slot_of("bob") == slot
+        room.broadcast_snapshot()
+        # The queued frame is only built now, after the slot changed hands
+        conn.websocket.open.set()
+        await settle(conn)
+        place(room, "bob", x=160)
+        room.broadcast_snapshot()
+        await settle(conn)
+        viewer.receive()
+        assert viewer.players == expected(room, "observer")
+        assert set(viewer.players) == {"bob"}
+        # A client joining later must learn the slot under its new nickname
+        late, late_viewer = await observe(room, codec, "late")
+        room.broadcast_snapshot()
+        await settle(late)
+        late_viewer.receive()
+        assert set(late_viewer.players) == {"bob", "observer"}
+    run(scenario)
+
+def test_delta_base_is_the_last_frame_written():
+    async def scenario(room):
+        conn, viewer = await observe(room, JSON_CODEC)
+        place(room, "alice")
+        room.broadcast_snapshot()
+        await settle(conn)
+        room.broadcast_snapshot()  # nothing changed: no frame, so the base stays put
+        await settle(conn)
+        place(room, "alice", x=111)
+        room.broadcast_snapshot()
+        await settle(conn)
+        frames = [decode_message(frame) for frame in conn.websocket.frames]
+        snapshots = [frame for frame in frames if frame["type"] != "ping"]
+        assert [frame["seq"] for frame in snapshots] == [1, 3]
+        assert snapshots[1]["base"] == 1
+        assert conn.sent_seq == 3
+        viewer.receive()
+        assert viewer.players == expected(room, "observer")
+    run(scenario)
+
+def test_take_missed_keeps_snapshots_newer_than_the_frame():
+    async def scenario(room):
+        conn, _ = await observe(room, JSON_CODEC)
+        conn.missed = [(3, {1: 0b01}, [(1, 2)]), (5, {1: 0b10, 2: 0b100}, []), (7, {2: 0b1}, [(2, 1)])]
+        masks, hits = conn.take_missed(5)
+        assert masks == {1: 0b11, 2: 0b100}
+        assert hits == [(1, 2)]
+        assert conn.missed == [(7, {2: 0b1}, [(2, 1)])]
+    run(scenario)
@@ -0,0 +1,58 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+spec = importlib.util.spec_from_file_location("sprite_cache", ROOT / "frontend" / "static" / "sprite_cache.py")
+sprite_cache = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sprite_cache)
+
+FileSystemBackend = sprite_cache.FileSystemBackend
+SpriteCache = sprite_cache.SpriteCache
+content_hash = sprite_cache.content_hash
+
+ATLAS = b"\x89PNG atlas v1"
+PIXELS = bytes(range(256)) * 4  # 16x16 RGBA
+
+def open_cache(directory, max_bytes=sprite_cache.DEFAULT_MAX_BYTES):
+    return asyncio.run(SpriteCache(FileSystemBackend(str(directory)), max_bytes).open())
+
+def test_miss_then_hit_after_reload(tmp_path):
+    cache = open_cache(tmp_path)
+    key = content_hash(ATLAS)
+    assert asyncio.run(cache.get(key)) is None
+    asyncio.run(cache.put(key, (16, 16), PIXELS))
+    # A new page load opens the cache from what the last one left on disk
+    reloaded = open_cache(tmp_path)
+    assert asyncio.run(reloaded.get(key)) == ((16, 16), PIXELS)
+
+def test_changed_atlas_misses(tmp_path):
+    cache = open_cache(tmp_path)
+    asyncio.run(cache.put(content_hash(ATLAS), (16, 16), PIXELS))
+    rebuilt = ATLAS.replace(b"v1", b"v2")
+    reloaded = open_cache(tmp_path)
+    assert asyncio.run(reloaded.get(content_hash(rebuilt))) is None
+    assert asyncio.run(reloaded.get(content_hash(ATLAS))) is not None
+
+def test_damaged_entry_is_dropped(tmp_path):
+    cache = open_cache(tmp_path)
+    key = content_hash(ATLAS)
+    asyncio.run(cache.put(key, (16, 16), PIXELS))
+    (tmp_path / key).write_bytes(PIXELS[:100])
+    assert asyncio.run(cache.get(key)) is None
+    assert key not in cache.entries
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=2 * len(PIXELS))
+    first, second, third = (content_hash(bytes([n])) for n in range(3))
+    asyncio.run(cache.put(first, (16, 16), PIXELS))
+    asyncio.run(cache.put(second, (16, 16), PIXELS))
+    cache.entries[first][3] += 1  # touched after second
+    asyncio.run(cache.put(third, (16, 16), PIXELS))
+    assert set(cache.entries) == {first, third}
+    assert not (tmp_path / second).exists()
+    assert cache.size <= cache.max_bytes
+
+def test_corrupt_index_starts_empty(tmp_path):
+    (tmp_path / sprite_cache.INDEX_KEY).write_bytes(b"{not json")
+    assert open_cache(tmp_path).entries == {}